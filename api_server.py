@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP API 服務
+接受多個客戶端送出的工作（影片 URL 與選項），排入佇列後由與批次模式相同的
+下載 -> 轉錄 -> LLM 三段工作者處理。所有工作共用同一個 YouTubeTranscriptAnalyzer，
+Whisper 模型只在啟動時載入一次。
+
+    python api_server.py --port 8000 --max-queue 16
+
+端點：
+    POST   /jobs               送出工作 {"url": ..., "language": "en", "resume": true}
+                               202 新工作；200 同一影片已在處理中（回傳既有工作）；
+                               429 佇列已滿（Retry-After 為建議的重試秒數）
+    GET    /jobs               所有工作的狀態
+    GET    /jobs/<id>          工作狀態
+    GET    /jobs/<id>/events   進度事件（Server-Sent Events），支援 Last-Event-ID 續接
+    GET    /jobs/<id>/result   處理後的逐字稿與摘要（未完成時 409）
+    DELETE /jobs/<id>          取消排隊中或進行中的工作（在下一個階段開始前停止）；
+                               已結束的工作則從列表中移除
+    GET    /health             佇列與工作者狀態
+    GET    /metrics            Prometheus 格式的計量（見 metrics.py）
+
+    curl -X POST localhost:8000/jobs -d '{"url": "https://www.youtube.com/watch?v=..."}'
+    curl -N localhost:8000/jobs/<id>/events
+"""
+
+import json
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from stage_scheduler import StageTrace
+from youtube_transcript_analyzer import build_parser, build_analyzer, check_args
+
+# 結束狀態
+TERMINAL = ("done", "failed", "cancelled")
+# POST 內容的大小上限
+MAX_BODY_BYTES = 64 * 1024
+# SSE 沒有新事件時送出註解行的間隔（避免代理伺服器關閉閒置連線）
+HEARTBEAT_SECONDS = 15
+# 還沒有完成的工作可估計時，429 回應建議的重試秒數
+DEFAULT_RETRY_AFTER = 30
+
+
+class QueueFull(Exception):
+    """等待與進行中的工作數已達上限"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"佇列已滿，請於 {retry_after} 秒後重試")
+        self.retry_after = retry_after
+
+
+class ApiJob:
+    """一個 API 工作的狀態與進度事件"""
+
+    def __init__(self, job_id, url, video_id, language=None, resume=True):
+        self.job_id = job_id
+        self.url = url
+        self.video_id = video_id
+        self.language = language
+        self.resume = resume
+        self.status = "queued"
+        self.error = None
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        # 各階段之間傳遞的資料（檢查點、音訊檔、逐字稿）
+        self.checkpoint = None
+        self.audio_file = None
+        self.transcript = None
+        self.trace = ProgressTrace(self)
+        self.events = []
+        self.condition = threading.Condition()
+        self.emit("status", status="queued")
+
+    @property
+    def key(self):
+        """判斷重複送出的鍵（同一部影片共用同一個檢查點目錄，不能同時處理）"""
+        return self.video_id or self.url
+
+    @property
+    def done(self):
+        return self.status in TERMINAL
+
+    def emit(self, event, **data):
+        """新增一個進度事件並喚醒等待中的 SSE 連線"""
+        data["time"] = time.time()
+        with self.condition:
+            self.events.append({"id": len(self.events) + 1, "event": event, "data": data})
+            self.condition.notify_all()
+
+    def set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        if status in TERMINAL:
+            self.finished = time.time()
+        elif self.started is None and status != "queued":
+            self.started = time.time()
+        self.emit("status", status=status, error=error)
+
+    def wait_events(self, after, timeout):
+        """回傳編號大於 after 的事件；沒有新事件時最多等待 timeout 秒"""
+        with self.condition:
+            if len(self.events) <= after and not self.done:
+                self.condition.wait(timeout)
+            return self.events[after:]
+
+    def to_dict(self, result=False):
+        record = {
+            "job_id": self.job_id,
+            "url": self.url,
+            "video_id": self.video_id,
+            "status": self.status,
+            "cancel_requested": self.cancel_requested,
+            "error": self.error,
+            "language": self.language,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "events": len(self.events),
+        }
+        if result:
+            record["result"] = self.result
+        return record
+
+
+class ProgressTrace(StageTrace):
+    """除了記錄時間軸，每個完成的階段（含各段翻譯與摘要）也送到工作的事件串流"""
+
+    def __init__(self, job):
+        super().__init__(pid=1, name=job.url)
+        self.job = job
+
+    def add(self, name, start, end, category="stage", args=None):
+        super().add(name, start, end, category, args)
+        self.job.emit("stage", name=name, category=category, seconds=round(end - start, 3))
+
+
+class JobQueue:
+    def __init__(self, analyzer, download_workers=2, transcribe_workers=1, llm_workers=2,
+                 max_queue=16, queue_size=4, keep_finished=200):
+        """analyzer: 所有工作共用的分析器
+        download_workers / transcribe_workers / llm_workers: 各階段的工作者數
+        （每個轉錄工作者一份 Whisper 模型，啟動時載入）
+        max_queue: 等待與進行中的工作數上限，超過時拒絕新工作（HTTP 429）
+        queue_size: 階段之間的佇列長度，下游忙碌時上游暫停，避免音訊檔堆積
+        keep_finished: 保留最近幾個已結束的工作供查詢
+        """
+        self.analyzer = analyzer
+        self.max_queue = max_queue
+        self.keep_finished = keep_finished
+        self.jobs = OrderedDict()
+        self.lock = threading.RLock()
+        self.closed = False
+        # 最近完成的工作耗時（估計 Retry-After）
+        self.durations = deque(maxlen=20)
+        # 進入佇列的工作數已由 max_queue 限制，第一段佇列不需要另設上限
+        self.download_queue = queue.Queue()
+        self.transcribe_queue = queue.Queue(maxsize=queue_size)
+        self.llm_queue = queue.Queue(maxsize=queue_size)
+        self.workers = {"download": download_workers, "transcribe": transcribe_workers, "llm": llm_workers}
+
+        print("正在載入 Whisper 模型...")
+        models = analyzer.create_transcribe_models(transcribe_workers)
+        threads = [threading.Thread(target=self.download_worker, daemon=True) for _ in range(download_workers)]
+        threads += [threading.Thread(target=self.transcribe_worker, args=(model,), daemon=True) for model in models]
+        threads += [threading.Thread(target=self.llm_worker, daemon=True) for _ in range(llm_workers)]
+        for thread in threads:
+            thread.start()
+
+    def active_count(self):
+        return sum(1 for job in self.jobs.values() if not job.done)
+
+    def retry_after(self):
+        """以最近完成的工作耗時估計下一個空位出現的秒數"""
+        if not self.durations:
+            return DEFAULT_RETRY_AFTER
+        average = sum(self.durations) / len(self.durations)
+        return max(1, min(600, int(average / max(self.workers["llm"], 1))))
+
+    def submit(self, url, language=None, resume=True):
+        """送出工作，回傳 (工作, 是否為新工作)；佇列已滿時拋出 QueueFull"""
+        video_id = self.analyzer.extract_video_id(url)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("服務正在關閉")
+            # 同一部影片已在處理中時回傳既有工作
+            for job in self.jobs.values():
+                if not job.done and job.key == (video_id or url):
+                    return job, False
+            if self.active_count() >= self.max_queue:
+                raise QueueFull(self.retry_after())
+            job = ApiJob(uuid.uuid4().hex[:12], url, video_id, language, resume)
+            self.jobs[job.job_id] = job
+            self.evict()
+        self.download_queue.put(job)
+        return job, True
+
+    def evict(self):
+        """只保留最近 keep_finished 個已結束的工作"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        """取消工作；已結束的工作則移除。回傳工作（不存在時為 None）"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.done:
+                del self.jobs[job_id]
+                return job
+            job.cancel_requested = True
+            # 還在排隊的工作立即結束，空出名額；進行中的工作在下一個階段開始前停止
+            if job.status == "queued":
+                self.finish(job, "cancelled")
+        return job
+
+    def finish(self, job, status, error=None):
+        with self.lock:
+            if job.done:
+                return
+            job.set_status(status, error)
+            if status == "done" and job.started:
+                self.durations.append(job.finished - job.started)
+        if job.audio_file and job.checkpoint is None:
+            self.analyzer.cleanup_temp_files(job.audio_file)
+        job.audio_file = None
+        print(f"工作 {job.job_id} {status}: {job.url}" + (f" - {error}" if error else ""))
+
+    def begin(self, job, status):
+        """進入下一個階段；工作已結束或已要求取消時回傳 False（略過）"""
+        with self.lock:
+            if job.done:
+                return False
+            if job.cancel_requested:
+                self.finish(job, "cancelled")
+                return False
+            job.set_status(status)
+            return True
+
+    def download_worker(self):
+        analyzer = self.analyzer
+        while True:
+            job = self.download_queue.get()
+            if job is None:
+                break
+            if not self.begin(job, "downloading"):
+                continue
+            try:
+                job.checkpoint = analyzer.open_job(job.url) if job.resume else None
+                transcript, audio_file = analyzer.fetch_stage(job.url, job.video_id, job.trace,
+                                                              job.checkpoint, job.language)
+                if transcript:
+                    job.transcript = transcript
+                    self.llm_queue.put(job)
+                elif audio_file:
+                    job.audio_file = audio_file
+                    self.transcribe_queue.put(job)
+                else:
+                    self.finish(job, "failed", "音訊下載失敗")
+            except Exception as e:
+                self.finish(job, "failed", f"下載失敗: {e}")
+
+    def transcribe_worker(self, model):
+        analyzer = self.analyzer
+        while True:
+            job = self.transcribe_queue.get()
+            if job is None:
+                break
+            if not self.begin(job, "transcribing"):
+                continue
+            # 轉錄階段負責刪除不在檢查點中的音訊
+            audio_file, job.audio_file = job.audio_file, None
+            try:
+                result = analyzer.transcribe_stage(job.video_id, audio_file, job.trace, model=model,
+                                                   job=job.checkpoint, language=job.language)
+                if not result:
+                    self.finish(job, "failed", "逐字稿提取失敗")
+                    continue
+                job.transcript = result
+                self.llm_queue.put(job)
+            except Exception as e:
+                self.finish(job, "failed", f"轉錄失敗: {e}")
+
+    def llm_worker(self):
+        analyzer = self.analyzer
+        while True:
+            job = self.llm_queue.get()
+            if job is None:
+                break
+            if not self.begin(job, "processing"):
+                continue
+            try:
+                def on_start(transcript, language):
+                    job.emit("transcript", language=language, segments=len(transcript),
+                             duration=transcript.duration)
+
+                result = analyzer.analyze_stage(job.url, job.video_id, job.transcript, job.trace,
+                                                job=job.checkpoint, language=job.language, on_start=on_start)
+                result['transcript'] = result['transcript'].text
+                job.language = result['language']
+                job.result = result
+                job.transcript = None
+                self.finish(job, "done")
+            except Exception as e:
+                self.finish(job, "failed", f"LLM 處理失敗: {e}")
+
+    def stats(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            active = self.active_count()
+        return {
+            "status": "closing" if self.closed else "ok",
+            "active": active,
+            "max_queue": self.max_queue,
+            "jobs": counts,
+            "workers": self.workers,
+            "stage_queues": {"download": self.download_queue.qsize(),
+                             "transcribe": self.transcribe_queue.qsize(),
+                             "llm": self.llm_queue.qsize()},
+        }
+
+    def close(self):
+        """停止接受新工作並釋放分析器資源（進行中的工作隨行程結束）"""
+        with self.lock:
+            self.closed = True
+        self.analyzer.close()
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {"error": message}, headers)
+
+    def route(self):
+        """回傳 (路徑各段, 查詢參數, 工作)；路徑為 /jobs/<id>... 但工作不存在時已回應 404"""
+        parts = urlsplit(self.path)
+        segments = [segment for segment in parts.path.split("/") if segment]
+        job = None
+        if len(segments) >= 2 and segments[0] == "jobs":
+            job = self.server.job_queue.get(segments[1])
+            if job is None:
+                self.send_error_json(404, f"找不到工作: {segments[1]}")
+                return None
+        return segments, parse_qs(parts.query), job
+
+    def do_GET(self):
+        route = self.route()
+        if route is None:
+            return
+        segments, query, job = route
+        job_queue = self.server.job_queue
+        if segments == ["health"]:
+            self.send_json(200, job_queue.stats())
+        elif segments == ["metrics"]:
+            body = job_queue.analyzer.metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif segments == ["jobs"]:
+            self.send_json(200, [item.to_dict() for item in job_queue.list()])
+        elif job is not None and len(segments) == 2:
+            self.send_json(200, job.to_dict())
+        elif job is not None and segments[2:] == ["result"]:
+            if job.status != "done":
+                self.send_json(409, job.to_dict())
+            else:
+                self.send_json(200, job.to_dict(result=True))
+        elif job is not None and segments[2:] == ["events"]:
+            after = self.headers.get("Last-Event-ID") or query.get("after", ["0"])[0]
+            self.stream_events(job, int(after) if str(after).isdigit() else 0)
+        else:
+            self.send_error_json(404, "not found")
+
+    def stream_events(self, job, after):
+        """以 Server-Sent Events 送出進度，工作結束後關閉連線"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            while True:
+                events = job.wait_events(after, HEARTBEAT_SECONDS)
+                if not events:
+                    if job.done:
+                        break
+                    self.wfile.write(b": keep-alive\n\n")
+                for event in events:
+                    data = json.dumps(event["data"], ensure_ascii=False, default=str)
+                    self.wfile.write(f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n".encode("utf-8"))
+                    after = event["id"]
+                self.wfile.flush()
+                if job.done and after >= len(job.events):
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            # 客戶端已中斷連線（可帶 Last-Event-ID 重新連線）
+            pass
+
+    def do_POST(self):
+        route = self.route()
+        if route is None:
+            return
+        if route[0] != ["jobs"]:
+            self.send_error_json(404, "not found")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self.send_error_json(413, f"內容超過 {MAX_BODY_BYTES} 位元組")
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_error_json(400, "內容不是有效的 JSON")
+            return
+        url = request.get("url") if isinstance(request, dict) else None
+        if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+            self.send_error_json(400, "需要 http(s) 影片 URL: {\"url\": ...}")
+            return
+        language = request.get("language")
+        if language is not None and not isinstance(language, str):
+            self.send_error_json(400, "language 必須是語言代碼字串（如 en、zh）")
+            return
+        try:
+            job, created = self.server.job_queue.submit(url, language, bool(request.get("resume", True)))
+        except QueueFull as e:
+            self.send_error_json(429, str(e), {"Retry-After": e.retry_after})
+            return
+        except RuntimeError as e:
+            self.send_error_json(503, str(e))
+            return
+        self.send_json(202 if created else 200, job.to_dict(), {"Location": f"/jobs/{job.job_id}"})
+
+    def do_DELETE(self):
+        route = self.route()
+        if route is None:
+            return
+        segments, _, job = route
+        if job is None or len(segments) != 2:
+            self.send_error_json(404, "not found")
+            return
+        self.server.job_queue.cancel(job.job_id)
+        self.send_json(200, job.to_dict())
+
+
+def create_api_server(job_queue, host="127.0.0.1", port=8000):
+    """建立 API 服務（呼叫 serve_forever() 開始處理請求）"""
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.job_queue = job_queue
+    return server
+
+
+def main():
+    """啟動 HTTP API 服務"""
+    parser = build_parser("YouTube 逐字稿分析 HTTP API 服務")
+    group = parser.add_argument_group("API 服務")
+    group.add_argument("--host", default="127.0.0.1", help="監聽位址（預設 127.0.0.1，容器中使用 0.0.0.0）")
+    group.add_argument("--port", type=int, default=8000, help="監聽連接埠（預設 8000）")
+    group.add_argument("--max-queue", type=int, default=16,
+                       help="等待與進行中的工作數上限，超過時回應 429（預設 16）")
+    group.add_argument("--keep-finished", type=int, default=200,
+                       help="保留最近幾個已結束的工作供查詢（預設 200）")
+    args = check_args(parser, parser.parse_args())
+
+    analyzer = build_analyzer(args)
+    job_queue = JobQueue(
+        analyzer,
+        download_workers=args.download_workers,
+        transcribe_workers=args.transcribe_workers,
+        llm_workers=args.batch_llm_workers,
+        max_queue=args.max_queue,
+        queue_size=args.queue_size,
+        keep_finished=args.keep_finished,
+    )
+    server = create_api_server(job_queue, args.host, args.port)
+    print(f"API 服務: http://{args.host}:{server.server_port}（POST /jobs 送出工作）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n服務被使用者中斷")
+    finally:
+        server.server_close()
+        job_queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+語言檢測微基準測試
+比較原本以 re.findall 建立每個字元字串的檢測方式與 language_detect.py 的
+查表計數（完整掃描與取樣），記錄各文字長度的耗時與 tracemalloc 記憶體峰值。
+
+    python benchmark_language.py --sizes 100000 1000000 10000000
+"""
+
+import re
+import json
+import time
+import argparse
+import tracemalloc
+
+from language_detect import count_scripts, detect_script_language
+
+SAMPLES = {
+    "en": "The quick brown fox jumps over the lazy dog while the narrator explains the next step. ",
+    "zh": "這部影片介紹如何使用語音辨識模型產生逐字稿，並且以大型語言模型整理重點。",
+    "ja": "この動画では音声認識モデルを使って文字起こしを作成し、要点をまとめます。",
+    "ko": "이 영상에서는 음성 인식 모델로 자막을 만들고 핵심 내용을 정리합니다. ",
+}
+
+
+def regex_detect(text):
+    """原本的檢測方式：兩次 re.findall"""
+    chinese_chars = re.findall(r'[一-鿿]', text)
+    english_chars = re.findall(r'[a-zA-Z]', text)
+    chinese_ratio = len(chinese_chars) / len(text) if text else 0
+    english_ratio = len(english_chars) / len(text) if text else 0
+    return english_ratio > chinese_ratio and english_ratio > 0.3
+
+
+def make_text(language, size):
+    sample = SAMPLES[language]
+    return (sample * (size // len(sample) + 1))[:size]
+
+
+def measure(func, text, repeat):
+    """回傳 (最佳耗時秒數, 記憶體峰值 MB, 結果)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / 1024 / 1024, result
+
+
+def main():
+    """執行語言檢測微基準測試"""
+    parser = argparse.ArgumentParser(description="語言檢測微基準測試")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 1000000, 10000000],
+                        help="測試的文字長度（字元數）")
+    parser.add_argument("--languages", nargs="+", choices=sorted(SAMPLES), default=["en", "zh"],
+                        help="測試的語言")
+    parser.add_argument("--repeat", type=int, default=3, help="每項重複次數（取最佳）")
+    parser.add_argument("--json", default=None, help="將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    methods = {
+        "regex": regex_detect,
+        "table": lambda text: detect_script_language(text, sample_chars=0)[0],
+        "sampled": lambda text: detect_script_language(text)[0],
+    }
+    # 預先建立查表，避免計入第一次呼叫
+    count_scripts("warmup")
+
+    results = []
+    print(f"{'語言':<4} {'字元數':>10} {'方法':<8} {'耗時 (ms)':>10} {'記憶體峰值 (MB)':>16} 結果")
+    for language in args.languages:
+        for size in args.sizes:
+            text = make_text(language, size)
+            for name, func in methods.items():
+                seconds, peak_mb, result = measure(func, text, args.repeat)
+                results.append({"language": language, "chars": size, "method": name,
+                                "seconds": seconds, "peak_mb": peak_mb, "result": result})
+                print(f"{language:<4} {size:>10} {name:<8} {seconds * 1000:>10.2f} {peak_mb:>16.2f} {result}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端效能基準測試
+以本地樣本執行完整流程，量測每個階段的耗時，方便比較不同 commit 的表現：
+
+1. 下載：本地 HTTP 服務提供樣本音訊，由 yt-dlp（generic 解析器）解析並下載
+2. Whisper 轉錄
+3. 語言檢測
+4. LLM 處理（翻譯／加標點）與摘要：與分析器相同，以 process_and_summarize 的
+   階段 DAG 執行（使用 fake_ollama_server.py，可設定延遲）
+
+每個階段記錄實際耗時、CPU 時間（含 FFmpeg 等子行程）與到該階段結束為止的
+最大常駐記憶體（peak RSS），並計算即時率（RTF = 耗時 / 音訊秒數），結果輸出為 JSON。
+
+用法：
+    # 自動產生 30 秒與 120 秒的合成樣本
+    python benchmark_pipeline.py --model tiny --output bench.json
+    # 使用自己的樣本（音訊檔搭配同名 .txt 參考逐字稿，格式同 compare_backends.py）
+    python benchmark_pipeline.py --fixtures fixtures --llm-latency 0.5 --output bench.json
+    # 與先前的結果比較
+    python benchmark_pipeline.py --output new.json --compare bench.json
+
+合成樣本只是有節奏的諧波音，Whisper 通常辨識不出文字；轉錄結果為空時，
+LLM 階段改用樣本的參考逐字稿，讓每個階段都有實際的工作量。
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+import platform
+import tempfile
+import functools
+import statistics
+import subprocess
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Windows 沒有 resource 模組，不記錄 peak RSS
+    resource = None
+
+from compare_backends import find_fixtures
+from fake_ollama_server import start_fake_ollama
+from transcript_store import SegmentStore
+from transcription_backends import BACKENDS
+from youtube_transcript_analyzer import YouTubeTranscriptAnalyzer
+
+SAMPLE_RATE = 16000
+WORDS = ("the model reads every frame of audio and writes down what it hears so that "
+         "we can translate the talk and keep a short summary of the main points for later").split()
+
+
+def generate_fixtures(directory, durations):
+    """產生合成樣本：類似語音節奏的諧波音（有停頓）與對應的參考逐字稿"""
+    rng = np.random.default_rng(0)
+    fixtures = []
+    for duration in durations:
+        name = f"synthetic_{int(duration)}s"
+        t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+        pitch = 140 + 40 * np.sin(2 * np.pi * 0.3 * t)
+        phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+        voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+        # 每秒約 4 個音節，每 6 秒停頓 1 秒
+        envelope = np.clip(np.sin(2 * np.pi * 2 * t), 0, None) * ((t % 6) < 5)
+        audio = 0.2 * voice * envelope + 0.005 * rng.standard_normal(len(t))
+        pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+        audio_path = os.path.join(directory, name + ".wav")
+        with wave.open(audio_path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(pcm.tobytes())
+
+        # 約每秒 2.5 個字，每 12 個字一句
+        words = [WORDS[i % len(WORDS)] for i in range(int(duration * 2.5))]
+        sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+        fixtures.append((audio_path, " ".join(sentences)))
+    return fixtures
+
+
+def start_media_server(directory):
+    """以本地 HTTP 服務提供樣本音訊（yt-dlp 以 generic 解析器處理直接連結）"""
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def peak_rss_mb():
+    """目前行程與子行程的最大常駐記憶體（MB）"""
+    if resource is None:
+        return None, None
+    # Linux 的單位是 KB，macOS 是 bytes
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def measure(stages, name, func, *args, **kwargs):
+    """執行一個階段並記錄耗時、CPU 時間與 peak RSS"""
+    before = os.times()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    wall = time.perf_counter() - start
+    after = os.times()
+    rss, child_rss = peak_rss_mb()
+    stages[name] = {
+        "wall_seconds": wall,
+        "cpu_seconds": (after.user - before.user) + (after.system - before.system),
+        "child_cpu_seconds": (after.children_user - before.children_user)
+                             + (after.children_system - before.children_system),
+        "peak_rss_mb": rss,
+        "child_peak_rss_mb": child_rss,
+    }
+    return result
+
+
+def audio_seconds(path):
+    """WAV 樣本直接讀取長度，其他格式由下載後的解碼結果決定"""
+    try:
+        with wave.open(path, "rb") as f:
+            return f.getnframes() / f.getframerate()
+    except (wave.Error, EOFError):
+        return None
+
+
+def run_fixture(analyzer, url, reference):
+    """對單一樣本執行完整流程，回傳各階段的量測結果"""
+    stages = {}
+    audio_file = measure(stages, "download", analyzer.download_audio, url)
+    if not audio_file:
+        raise RuntimeError(f"下載失敗: {url}")
+    try:
+        duration = audio_seconds(audio_file)
+        store = measure(stages, "transcribe", analyzer.transcribe_audio, audio_file)
+        if store is None:
+            raise RuntimeError(f"轉錄失敗: {url}")
+        if duration is None:
+            duration = store.duration
+    finally:
+        analyzer.cleanup_temp_files(audio_file)
+
+    transcript_chars = len(store.text)
+    if not store:
+        store = SegmentStore.from_result({'text': reference, 'language': "en"})
+    language = measure(stages, "detect_language", analyzer.detect_language, store.text, store.language,
+                       store.language_probs)
+    measure(stages, "process_and_summarize", analyzer.process_and_summarize, store, language)
+
+    for stats in stages.values():
+        stats["rtf"] = stats["wall_seconds"] / duration if duration else None
+    total = sum(stats["wall_seconds"] for stats in stages.values())
+    return {
+        "audio_seconds": duration,
+        "transcript_chars": transcript_chars,
+        "used_reference_text": transcript_chars == 0,
+        "stages": stages,
+        "total_wall_seconds": total,
+        "rtf": total / duration if duration else None,
+    }
+
+
+def median_run(runs):
+    """多次執行時，每個數值取中位數"""
+    if len(runs) == 1:
+        return runs[0]
+    merged = dict(runs[-1])
+    merged["stages"] = {}
+    for stage in runs[0]["stages"]:
+        merged["stages"][stage] = {
+            key: statistics.median(run["stages"][stage][key] for run in runs)
+            if runs[0]["stages"][stage][key] is not None else None
+            for key in runs[0]["stages"][stage]
+        }
+    for key in ("total_wall_seconds", "rtf"):
+        values = [run[key] for run in runs if run[key] is not None]
+        merged[key] = statistics.median(values) if values else None
+    merged["runs"] = len(runs)
+    return merged
+
+
+def git_commit():
+    """目前的 commit（不在 git 目錄中時為 None）"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def print_report(report):
+    """以表格輸出各樣本、各階段的耗時"""
+    print(f"\n=== 基準測試結果（commit {report['commit']}）===")
+    for name, result in report["fixtures"].items():
+        print(f"\n{name}（音訊 {result['audio_seconds'] or 0:.1f} 秒，總 RTF {result['rtf'] or 0:.3f}）")
+        print(f"  {'階段':<22} {'耗時(s)':>9} {'CPU(s)':>9} {'子行程CPU':>9} {'RTF':>8} {'peak RSS(MB)':>13}")
+        for stage, stats in result["stages"].items():
+            rss = f"{stats['peak_rss_mb']:.0f}" if stats["peak_rss_mb"] is not None else "-"
+            print(f"  {stage:<22} {stats['wall_seconds']:>9.3f} {stats['cpu_seconds']:>9.3f} "
+                  f"{stats['child_cpu_seconds']:>9.3f} {stats['rtf'] or 0:>8.4f} {rss:>13}")
+
+
+def print_comparison(report, baseline):
+    """與先前的結果比較每個階段的耗時"""
+    print(f"\n=== 與 commit {baseline.get('commit')} 比較 ===")
+    for name, result in report["fixtures"].items():
+        previous = baseline.get("fixtures", {}).get(name)
+        if not previous:
+            print(f"{name}: 基準結果中沒有此樣本")
+            continue
+        print(name)
+        for stage, stats in result["stages"].items():
+            old = previous["stages"].get(stage)
+            if not old or not old["wall_seconds"]:
+                continue
+            change = (stats["wall_seconds"] - old["wall_seconds"]) / old["wall_seconds"]
+            print(f"  {stage:<22} {old['wall_seconds']:>9.3f} -> {stats['wall_seconds']:>9.3f} 秒 ({change:+.1%})")
+
+
+def main():
+    """執行基準測試"""
+    parser = argparse.ArgumentParser(description="端到端效能基準測試")
+    parser.add_argument("--fixtures", default=None,
+                        help="樣本目錄（音訊檔搭配同名 .txt 參考逐字稿）；未指定時產生合成樣本")
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 120],
+                        help="合成樣本的長度（秒，預設 30 120）")
+    parser.add_argument("--model", default="tiny", help="Whisper 模型名稱（預設 tiny）")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="openai-whisper", help="轉錄引擎")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="模擬 Ollama 每個請求的延遲秒數")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="模擬 Ollama 串流時每個 token 的間隔")
+    parser.add_argument("--llm-client", choices=["langchain", "async"], default="async", help="LLM 客戶端")
+    parser.add_argument("--llm-workers", type=int, default=4, help="同時送出的 LLM 請求數")
+    parser.add_argument("--chunk-tokens", type=int, default=1500, help="每段送給 LLM 的 token 上限")
+    parser.add_argument("--summary-mode", choices=["auto", "single", "hierarchical"], default="auto",
+                        help="摘要模式（同分析器的 --summary-mode）")
+    parser.add_argument("--repeat", type=int, default=1, help="每個樣本執行次數（結果取中位數）")
+    parser.add_argument("--output", default=None, help="結果 JSON 檔")
+    parser.add_argument("--compare", default=None, help="與先前的結果 JSON 比較")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="yta_bench_")
+    llm_server = start_fake_ollama(latency=args.llm_latency, token_delay=args.token_delay)
+    try:
+        if args.fixtures:
+            fixtures = find_fixtures(args.fixtures)
+            media_dir = args.fixtures
+        else:
+            fixtures = generate_fixtures(temp_dir, args.durations)
+            media_dir = temp_dir
+        if not fixtures:
+            print("找不到任何樣本")
+            return
+        media_server = start_media_server(media_dir)
+
+        analyzer = YouTubeTranscriptAnalyzer(
+            use_cache=False,
+            llm_cache=False,
+            whisper_model_name=args.model,
+            backend=args.backend,
+            llm_base_url=f"http://127.0.0.1:{llm_server.server_port}",
+            llm_client=args.llm_client,
+            llm_workers=args.llm_workers,
+            chunk_tokens=args.chunk_tokens,
+            summary_mode=args.summary_mode,
+        )
+        setup = {}
+        measure(setup, "load_model", lambda: analyzer.whisper_model)
+        measure(setup, "connect_llm", lambda: analyzer.llm)
+        # 先建立 yt-dlp session，避免第一個樣本的下載時間包含匯入與初始化
+        measure(setup, "ytdlp_session", analyzer.get_ydl_session)
+
+        results = {}
+        for path, reference in fixtures:
+            name = os.path.basename(path)
+            url = f"http://127.0.0.1:{media_server.server_port}/{name}"
+            runs = [run_fixture(analyzer, url, reference) for _ in range(args.repeat)]
+            results[name] = median_run(runs)
+        analyzer.close()
+        media_server.shutdown()
+    finally:
+        llm_server.shutdown()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "setup": setup,
+        "fixtures": results,
+    }
+    print_report(report)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已寫入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+轉錄引擎比較
+以本地音訊樣本比較各轉錄引擎的載入時間、即時率（RTF）與錯誤率（WER）。
+
+樣本目錄中每個音訊檔搭配同名的 .txt 參考逐字稿，例如：
+    fixtures/
+        talk_en.mp3
+        talk_en.txt
+        talk_zh.m4a
+        talk_zh.txt
+
+用法：
+    python compare_backends.py fixtures --backends openai-whisper faster-whisper --model base
+    python compare_backends.py fixtures --json results.json
+
+RTF = 轉錄秒數 / 音訊秒數（越小越快，小於 1 表示比即時快）。
+參考稿含中日韓文字時以字元計算錯誤率（CER），其餘以單字計算（WER）。
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+
+from transcription_backends import BACKENDS, create_backend
+from youtube_transcript_analyzer import YouTubeTranscriptAnalyzer
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".webm", ".ogg", ".opus", ".flac", ".mp4"}
+CJK_CHAR = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+PUNCTUATION = re.compile(r'[^\w\s]|_')
+
+
+def find_fixtures(directory):
+    """列出有參考逐字稿的音訊檔，回傳 (音訊路徑, 參考文字) 列表"""
+    fixtures = []
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in AUDIO_EXTENSIONS:
+            continue
+        reference_path = os.path.join(directory, stem + ".txt")
+        if not os.path.exists(reference_path):
+            print(f"略過 {name}：找不到參考逐字稿 {stem}.txt")
+            continue
+        with open(reference_path, "r", encoding="utf-8") as f:
+            fixtures.append((os.path.join(directory, name), f.read()))
+    return fixtures
+
+
+def tokenize(text, by_char):
+    """去除標點並切成單字（或中日韓字元）"""
+    text = PUNCTUATION.sub(" ", text.lower())
+    if by_char:
+        return [char for char in text if not char.isspace()]
+    return text.split()
+
+
+def edit_distance(reference, hypothesis):
+    """兩個序列的 Levenshtein 距離"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp in enumerate(hypothesis, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref != hyp),
+            )
+        previous = current
+    return previous[-1]
+
+
+def error_rate(reference, hypothesis):
+    """回傳 (錯誤率, 計算單位)；參考稿含中日韓文字時使用 CER"""
+    by_char = bool(CJK_CHAR.search(reference))
+    ref_tokens = tokenize(reference, by_char)
+    hyp_tokens = tokenize(hypothesis, by_char)
+    if not ref_tokens:
+        return (0.0 if not hyp_tokens else 1.0), ("cer" if by_char else "wer")
+    return edit_distance(ref_tokens, hyp_tokens) / len(ref_tokens), ("cer" if by_char else "wer")
+
+
+def compare(fixtures, backends, model_name, options=None):
+    """逐一載入引擎並轉錄所有樣本，回傳每個引擎的結果"""
+    options = options or {}
+    # 只用來解碼音訊：不建立快取與工作檢查點目錄
+    decoder = YouTubeTranscriptAnalyzer(use_cache=False, resume=False)
+
+    # 先解碼一次音訊，各引擎使用相同的輸入陣列
+    audios = []
+    for path, reference in fixtures:
+        try:
+            audio = decoder.load_audio_array(path, memmap_seconds=0)
+        except Exception as e:
+            print(f"略過 {os.path.basename(path)}：音訊解碼失敗: {e}")
+            continue
+        audios.append((path, reference, audio))
+    decoder.close()
+
+    report = []
+    for name in backends:
+        print(f"\n=== {name} ({model_name}) ===")
+        start = time.perf_counter()
+        try:
+            backend = create_backend(name, model_name)
+        except Exception as e:
+            print(f"無法載入引擎 {name}: {e}")
+            report.append({"backend": name, "model": model_name, "error": str(e)})
+            continue
+        load_seconds = time.perf_counter() - start
+
+        files = []
+        for path, reference, audio in audios:
+            duration = len(audio) / YouTubeTranscriptAnalyzer.SAMPLE_RATE
+            start = time.perf_counter()
+            result = backend.transcribe(audio, **options)
+            elapsed = time.perf_counter() - start
+            rate, unit = error_rate(reference, result['text'])
+            files.append({
+                "file": os.path.basename(path),
+                "audio_seconds": duration,
+                "transcribe_seconds": elapsed,
+                "rtf": elapsed / duration if duration else 0.0,
+                unit: rate,
+                "language": result['language'],
+                "segments": len(result['segments']),
+            })
+            print(f"{os.path.basename(path)}: RTF {files[-1]['rtf']:.3f}  {unit.upper()} {rate:.2%}")
+
+        total_audio = sum(item["audio_seconds"] for item in files)
+        total_time = sum(item["transcribe_seconds"] for item in files)
+        report.append({
+            "backend": name,
+            "model": model_name,
+            "load_seconds": load_seconds,
+            "audio_seconds": total_audio,
+            "transcribe_seconds": total_time,
+            "rtf": total_time / total_audio if total_audio else 0.0,
+            "files": files,
+        })
+    return report
+
+
+def print_report(report):
+    """以表格輸出比較結果"""
+    print(f"\n{'引擎':<16} {'載入(s)':>8} {'音訊(s)':>8} {'轉錄(s)':>8} {'RTF':>7} {'WER/CER':>8}")
+    for entry in report:
+        if "error" in entry:
+            print(f"{entry['backend']:<16} 錯誤: {entry['error']}")
+            continue
+        rates = [item.get("wer", item.get("cer")) for item in entry["files"]]
+        mean_rate = sum(rates) / len(rates) if rates else 0.0
+        print(f"{entry['backend']:<16} {entry['load_seconds']:>8.2f} {entry['audio_seconds']:>8.1f} "
+              f"{entry['transcribe_seconds']:>8.2f} {entry['rtf']:>7.3f} {mean_rate:>8.2%}")
+
+
+def main():
+    """比較轉錄引擎"""
+    parser = argparse.ArgumentParser(description="比較轉錄引擎的即時率與錯誤率")
+    parser.add_argument("fixtures", help="音訊樣本目錄（每個音訊檔搭配同名 .txt 參考逐字稿）")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=sorted(BACKENDS),
+                        help="要比較的引擎（預設全部）")
+    parser.add_argument("--model", default="base", help="Whisper 模型名稱（預設 base）")
+    parser.add_argument("--language", default=None, help="固定轉錄語言（預設自動偵測）")
+    parser.add_argument("--json", default=None, help="將完整結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    fixtures = find_fixtures(args.fixtures)
+    if not fixtures:
+        print("找不到任何音訊樣本")
+        return
+
+    options = {"language": args.language} if args.language else {}
+    report = compare(fixtures, args.backends, args.model, options)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已寫入: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模擬 Ollama 的本地測試服務
+提供 /api/tags、/api/generate、/api/chat，回應格式與 Ollama 相同
+（stream 預設為 true，逐 token 以 NDJSON 傳回），不需要下載任何模型，
+可用來測試 LLM 客戶端、重試與並行行為。
+
+回應內容為 prompt 最後一行非空白文字前加上「[模型名稱]」，方便檢查對應關係。
+
+啟動：
+    python fake_ollama_server.py --port 11500 --latency 0.2 --fail-rate 0.1
+分析器端：
+    python youtube_transcript_analyzer.py --ollama-url http://127.0.0.1:11500 --llm-client async
+
+在程式中使用：
+    server = start_fake_ollama(port=0)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    ...
+    server.shutdown()
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json(200, {"models": [{"name": name} for name in self.server.models]})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "invalid json"})
+            return
+
+        if self.path not in ("/api/generate", "/api/chat"):
+            self.send_json(404, {"error": "not found"})
+            return
+
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if random.random() < server.fail_rate:
+                with server.stats_lock:
+                    server.failures += 1
+                self.send_json(503, {"error": "模擬的暫時性錯誤"})
+                return
+            if request.get("model") not in server.models:
+                self.send_json(404, {"error": f"model '{request.get('model')}' not found"})
+                return
+            self.respond(request, chat=self.path == "/api/chat")
+        finally:
+            with server.stats_lock:
+                server.active -= 1
+
+    def respond(self, request, chat):
+        """產生回應；stream 為 true（Ollama 預設）時逐 token 傳回"""
+        server = self.server
+        if chat:
+            messages = request.get("messages") or [{}]
+            prompt = messages[-1].get("content", "")
+        else:
+            prompt = request.get("prompt", "")
+        lines = [line.strip() for line in prompt.splitlines() if line.strip()]
+        text = f"[{request['model']}] {lines[-1] if lines else ''}"
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+
+        start = time.time()
+        time.sleep(server.latency)
+
+        def message(content, done):
+            payload = {"model": request["model"], "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                       "done": done}
+            if chat:
+                payload["message"] = {"role": "assistant", "content": content}
+            else:
+                payload["response"] = content
+            if done:
+                payload.update({
+                    "total_duration": int((time.time() - start) * 1e9),
+                    "prompt_eval_count": len(prompt) // 4,
+                    "eval_count": len(tokens),
+                })
+            return payload
+
+        if not request.get("stream", True):
+            self.send_json(200, message(text, True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            self.write_chunk(message(token, False))
+            time.sleep(server.token_delay)
+        self.write_chunk(message("", True))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, payload):
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, models=("gemma:7b",), latency=0.0, token_delay=0.0,
+                 fail_rate=0.0, verbose=False):
+        """latency: 每個請求開始回應前的延遲秒數；token_delay: 串流時每個 token 的間隔；
+        fail_rate: 回傳 503 的機率（用於測試重試）"""
+        super().__init__(address, FakeOllamaHandler)
+        self.models = list(models)
+        self.latency = latency
+        self.token_delay = token_delay
+        self.fail_rate = fail_rate
+        self.verbose = verbose
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.active = 0
+        self.max_active = 0
+
+
+def start_fake_ollama(host="127.0.0.1", port=0, **kwargs):
+    """在背景執行緒啟動模擬服務，port=0 時自動選擇可用連接埠"""
+    server = FakeOllamaServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    """啟動模擬 Ollama 服務"""
+    parser = argparse.ArgumentParser(description="模擬 Ollama 的本地測試服務")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--model", action="append", default=None, help="可用的模型名稱（可重複，預設 gemma:7b）")
+    parser.add_argument("--latency", type=float, default=0.0, help="每個請求的延遲秒數")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="串流時每個 token 的間隔秒數")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="回傳 503 的機率")
+    parser.add_argument("--verbose", action="store_true", help="印出每個請求")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer((args.host, args.port), models=args.model or ["gemma:7b"],
+                              latency=args.latency, token_delay=args.token_delay,
+                              fail_rate=args.fail_rate, verbose=args.verbose)
+    print(f"模擬 Ollama 服務已啟動: http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n已停止（請求 {server.requests}，模擬失敗 {server.failures}，最大並行 {server.max_active}）")
+
+
+if __name__ == "__main__":
+    main()
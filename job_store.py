@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可續跑的工作檢查點
+每部影片一個工作目錄，保存各階段完成的產物與 manifest.json：
+
+    jobs/<影片 ID>/
+        manifest.json        各階段狀態（每次更新都以暫存檔 + os.replace 原子寫入）
+        audio.m4a            下載的音訊（逐字稿保存後刪除）
+        transcript.json      逐字稿片段（SegmentStore 欄位格式）
+        process/0000.txt     各段的 LLM 處理結果
+        partial/0000.txt     各段的分段摘要
+        summary.txt          最終摘要
+
+程式中斷後重新執行同一部影片時，從最後完成的階段（或段落）繼續：
+已有逐字稿就不再下載與轉錄，已完成的段落不再呼叫 LLM。
+逐字稿記錄轉錄模型與參數，每段 LLM 結果與摘要記錄與 LLM 快取相同的鍵
+（模型、prompt 與生成參數，見 llm_cache.make_cache_key）；設定不同時會重新產生。
+
+工作完成時刪除工作目錄（結果已在逐字稿與 LLM 快取中），只保留失敗或未完成的工作；
+開啟新工作前依大小與存放時間淘汰最舊的工作目錄（本行程開啟中的工作不會被刪除）。
+
+命令列用法：
+    python job_store.py list
+    python job_store.py show VIDEO_ID
+    python job_store.py prune --max-mb 200
+    python job_store.py prune --older-than 7
+    python job_store.py delete VIDEO_ID
+    python job_store.py clear
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+
+from transcript_cache import DEFAULT_CACHE_DIR
+from transcript_store import SegmentStore
+
+MANIFEST_VERSION = 2
+# 失敗或未完成的工作保留的天數
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+def text_hash(text):
+    """URL 的雜湊（非 YouTube 影片的工作 ID）"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def directory_size(path):
+    """目錄內所有檔案的總大小"""
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                continue
+    return total
+
+
+def atomic_write(path, data):
+    """先寫入同目錄的暫存檔並 fsync，再以 os.replace 取代，中斷時不會留下寫到一半的檔案"""
+    directory = os.path.dirname(path)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class Job:
+    """單一影片的工作目錄"""
+
+    def __init__(self, path, job_id, url=None):
+        self.path = path
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.manifest = self.load_manifest()
+        if self.manifest is None:
+            now = time.time()
+            self.manifest = {
+                "version": MANIFEST_VERSION,
+                "job_id": job_id,
+                "url": url,
+                "status": "running",
+                "created": now,
+                "updated": now,
+                "stages": {},
+            }
+            self.save_manifest()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+
+    def load_manifest(self):
+        """讀取 manifest；不存在或版本不符時回傳 None（重新開始）"""
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+    def save_manifest(self):
+        self.manifest["updated"] = time.time()
+        atomic_write(self.manifest_path, json.dumps(self.manifest, ensure_ascii=False, indent=2))
+
+    def stage(self, name):
+        """已完成階段的記錄（未完成時為 None）"""
+        return self.manifest["stages"].get(name)
+
+    def complete(self, name, **info):
+        """記錄階段完成並寫入 manifest"""
+        with self.lock:
+            self.manifest["stages"][name] = dict(info, completed=time.time())
+            self.save_manifest()
+
+    def artifact(self, relative):
+        return os.path.join(self.path, relative)
+
+    # 音訊
+
+    def save_audio(self, audio_file):
+        """將下載的音訊移入工作目錄，回傳新的路徑（原暫存目錄一併刪除）"""
+        name = "audio" + os.path.splitext(audio_file)[1]
+        target = self.artifact(name)
+        shutil.move(audio_file, target)
+        shutil.rmtree(os.path.dirname(audio_file), ignore_errors=True)
+        self.complete("audio", file=name, bytes=os.path.getsize(target))
+        return target
+
+    def audio_file(self):
+        """已下載的音訊路徑（沒有或已刪除時為 None）"""
+        stage = self.stage("audio")
+        if stage and os.path.exists(self.artifact(stage["file"])):
+            return self.artifact(stage["file"])
+        return None
+
+    def discard_audio(self):
+        """逐字稿已保存後刪除音訊（以及中斷的轉錄留下的解碼暫存檔）"""
+        stage = self.stage("audio")
+        if not stage:
+            return
+        path = self.artifact(stage["file"])
+        for leftover in (path, os.path.splitext(path)[0] + ".pcm.f32"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    # 逐字稿
+
+    def save_transcript(self, store, transcriber=None, options=None):
+        """保存逐字稿；transcriber / options 為轉錄模型與參數（與逐字稿快取鍵相同）"""
+        atomic_write(self.artifact("transcript.json"), json.dumps(store.to_columns(), ensure_ascii=False))
+        self.complete("transcript", file="transcript.json", segments=len(store), language=store.language,
+                      transcriber=transcriber, options=options or {})
+
+    def load_transcript(self, transcriber=None, options=None):
+        """已保存的逐字稿（SegmentStore）；沒有或轉錄模型、參數不同時回傳 None"""
+        stage = self.stage("transcript")
+        if not stage:
+            return None
+        if stage.get("transcriber") != transcriber or stage.get("options") != (options or {}):
+            print("檢查點逐字稿的轉錄設定不同，重新轉錄")
+            return None
+        try:
+            with open(self.artifact("transcript.json"), encoding="utf-8") as f:
+                return SegmentStore.from_result(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"檢查點逐字稿讀取失敗: {e}")
+            return None
+
+    # LLM 輸出
+
+    def save_output(self, kind, index, key, text):
+        """保存第 index 段的 LLM 輸出（kind: process / partial）；key 為 LLM 快取鍵"""
+        relative = os.path.join(kind, f"{index:04d}.txt")
+        os.makedirs(self.artifact(kind), exist_ok=True)
+        atomic_write(self.artifact(relative), text)
+        with self.lock:
+            outputs = self.manifest["stages"].setdefault(kind, {})
+            outputs[str(index)] = {"file": relative, "key": key, "completed": time.time()}
+            self.save_manifest()
+
+    def load_output(self, kind, index, key):
+        """讀取第 index 段的 LLM 輸出；沒有或鍵（模型、prompt、參數）不同時回傳 None"""
+        entry = self.manifest["stages"].get(kind, {}).get(str(index))
+        if not entry or entry["key"] != key:
+            return None
+        try:
+            with open(self.artifact(entry["file"]), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def save_summary(self, key, summary):
+        """保存最終摘要；key 為摘要輸入與 LLM 設定的鍵（用來判斷是否仍然適用）"""
+        atomic_write(self.artifact("summary.txt"), summary)
+        self.complete("summary", file="summary.txt", key=key)
+
+    def load_summary(self, key):
+        stage = self.stage("summary")
+        if not stage or stage["key"] != key:
+            return None
+        try:
+            with open(self.artifact(stage["file"]), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def finish(self):
+        """標記工作完成並刪除工作目錄（逐字稿與 LLM 結果已在快取中）"""
+        with self.lock:
+            self.manifest["status"] = "done"
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+class JobStore:
+    def __init__(self, root=None, max_bytes=None, max_age=DEFAULT_MAX_AGE):
+        """root: 工作目錄的上層目錄（預設為快取目錄下的 jobs）
+
+        max_bytes: 保留的工作目錄總大小上限；max_age: 超過此秒數未更新的工作直接刪除
+        （None 表示不限制）
+        """
+        self.root = root or os.path.join(DEFAULT_CACHE_DIR, "jobs")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # 本行程開啟中的工作，淘汰時略過
+        self.open_ids = set()
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def job_id(video_id, url=None):
+        """以影片 ID 為工作 ID；非 YouTube 的 URL 改用 URL 的雜湊"""
+        return video_id or text_hash(url or "")[:16]
+
+    def job(self, video_id, url=None, max_bytes=None):
+        """開啟（或建立）影片的工作目錄；開啟前先淘汰超過上限的舊工作
+
+        max_bytes: 本次淘汰使用的大小上限（None 時為 self.max_bytes）
+        """
+        job_id = self.job_id(video_id, url)
+        with self.lock:
+            self.open_ids.add(job_id)
+        self.evict(max_bytes=max_bytes)
+        return Job(os.path.join(self.root, job_id), job_id, url)
+
+    def evict(self, max_bytes=None, older_than=None):
+        """依存放時間與總大小淘汰工作目錄（最久未更新的先刪除），回傳刪除數量
+
+        本行程開啟中的工作不會被刪除。
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        older_than = self.max_age if older_than is None else older_than
+        with self.lock:
+            open_ids = set(self.open_ids)
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name in open_ids or not os.path.isdir(path):
+                continue
+            try:
+                updated = os.path.getmtime(os.path.join(path, "manifest.json"))
+            except OSError:
+                updated = os.path.getmtime(path)
+            entries.append((updated, name, directory_size(path)))
+
+        removed = 0
+        total = sum(size for _, _, size in entries)
+        now = time.time()
+        for updated, name, size in sorted(entries):
+            expired = older_than is not None and now - updated > older_than
+            over_size = max_bytes is not None and total > max_bytes
+            if not (expired or over_size):
+                continue
+            removed += self.delete(name)
+            total -= size
+        return removed
+
+    def jobs(self):
+        """列出所有工作的 manifest"""
+        manifests = []
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name, "manifest.json")
+            try:
+                with open(path, encoding="utf-8") as f:
+                    manifests.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(manifests, key=lambda manifest: manifest.get("updated", 0), reverse=True)
+
+    def delete(self, job_id):
+        with self.lock:
+            self.open_ids.discard(job_id)
+        path = os.path.join(self.root, job_id)
+        if not os.path.isdir(path):
+            return False
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    def clear(self):
+        removed = 0
+        for name in os.listdir(self.root):
+            removed += self.delete(name)
+        return removed
+
+
+def main():
+    """工作檢查點管理命令列"""
+    parser = argparse.ArgumentParser(description="工作檢查點管理")
+    parser.add_argument("--job-dir", default=None, help="工作目錄（預設為快取目錄下的 jobs）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="列出工作")
+    show = subparsers.add_parser("show", help="顯示工作的 manifest")
+    show.add_argument("job_id")
+    prune = subparsers.add_parser("prune", help="淘汰舊的工作")
+    prune.add_argument("--max-mb", type=float, default=None, help="保留的總大小上限（MB）")
+    prune.add_argument("--older-than", type=float, default=None, help="刪除超過 N 天未更新的工作")
+    delete = subparsers.add_parser("delete", help="刪除工作")
+    delete.add_argument("job_id")
+    subparsers.add_parser("clear", help="刪除所有工作")
+    args = parser.parse_args()
+
+    store = JobStore(args.job_dir, max_age=None)
+    if args.command == "list":
+        for manifest in store.jobs():
+            stages = manifest.get("stages", {})
+            done = [name for name in ("audio", "transcript", "process", "partial", "summary") if name in stages]
+            updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(manifest.get("updated", 0)))
+            print(f"{manifest['job_id']}  {manifest.get('status', '?'):<8} 更新 {updated}  "
+                  f"已完成: {', '.join(done) or '-'}  {manifest.get('url') or ''}")
+    elif args.command == "show":
+        path = os.path.join(store.root, args.job_id, "manifest.json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                print(f.read())
+        except OSError:
+            print(f"找不到工作: {args.job_id}")
+    elif args.command == "prune":
+        max_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None
+        older_than = args.older_than * 86400 if args.older_than is not None else None
+        print(f"已刪除 {store.evict(max_bytes, older_than)} 個工作")
+    elif args.command == "delete":
+        print("已刪除" if store.delete(args.job_id) else f"找不到工作: {args.job_id}")
+    elif args.command == "clear":
+        print(f"已刪除 {store.clear()} 個工作")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐字稿語言檢測
+以 UTF-32 編碼把文字轉成 NumPy 碼位陣列，再用 65536 項的查表一次
+分類每個字元的文字系統並以 bincount 計數：只掃描一次，也不會為每個字元
+建立 Python 字串。很長的逐字稿只取均勻分布的數個片段計數。
+
+文字系統與語言的對應：
+- 假名（含漢字的日文）-> ja、諺文 -> ko、漢字 -> zh
+- 西里爾字母 -> ru、拉丁字母 -> en，其餘文字系統 -> other
+Whisper（或字幕）提供的語言與文字系統一致時優先採用，
+例如拉丁字母的法文逐字稿會回傳 fr 而不是 en。
+
+    language, counts = detect_script_language(text, whisper_language="fr")
+"""
+
+import numpy as np
+
+# 文字系統編號（查表的值）
+SCRIPTS = ("none", "latin", "han", "kana", "hangul", "cyrillic", "other")
+NONE, LATIN, HAN, KANA, HANGUL, CYRILLIC, OTHER = range(len(SCRIPTS))
+
+# 各文字系統的碼位範圍（含頭尾）
+SCRIPT_RANGES = {
+    LATIN: [(0x41, 0x5A), (0x61, 0x7A), (0xC0, 0xD6), (0xD8, 0xF6), (0xF8, 0x24F), (0x1E00, 0x1EFF)],
+    HAN: [(0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF)],
+    KANA: [(0x3040, 0x30FF), (0x31F0, 0x31FF), (0xFF66, 0xFF9F)],
+    HANGUL: [(0x1100, 0x11FF), (0x3130, 0x318F), (0xAC00, 0xD7AF)],
+    CYRILLIC: [(0x0400, 0x04FF), (0x0500, 0x052F)],
+    # 希臘、希伯來、阿拉伯、天城、泰文等其他字母
+    OTHER: [(0x0370, 0x03FF), (0x0590, 0x05FF), (0x0600, 0x06FF), (0x0900, 0x097F), (0x0E00, 0x0E7F)],
+}
+# BMP 以外的漢字（擴充 B 以後）
+SUPPLEMENTARY_HAN = (0x20000, 0x323AF)
+
+# 文字系統 -> 預設語言
+SCRIPT_LANGUAGES = {LATIN: "en", HAN: "zh", KANA: "ja", HANGUL: "ko", CYRILLIC: "ru", OTHER: "other"}
+# 以西里爾字母書寫的語言（其餘 Whisper 語言視為拉丁字母，zh/ja/ko 另外判斷）
+CYRILLIC_LANGUAGES = {"ru", "uk", "be", "bg", "mk", "sr", "kk", "ky", "tg", "tt", "ba", "mn"}
+OTHER_SCRIPT_LANGUAGES = {"el", "he", "yi", "ar", "fa", "ur", "ps", "sd", "hi", "mr", "ne", "sa", "th"}
+
+# 日文的漢字比例常高於假名，假名佔中日文字元超過此比例即視為日文
+KANA_SHARE = 0.1
+# 超過此字元數時只取樣計數
+SAMPLE_CHARS = 262144
+SAMPLE_WINDOWS = 16
+# 每次編碼與查表的字元數
+BLOCK_CHARS = 1 << 20
+
+
+def build_table():
+    table = np.zeros(0x10000, dtype=np.uint8)
+    for script, ranges in SCRIPT_RANGES.items():
+        for start, end in ranges:
+            table[start:end + 1] = script
+    return table
+
+
+_TABLE = build_table()
+
+
+def sample_text(text, sample_chars=SAMPLE_CHARS, windows=SAMPLE_WINDOWS):
+    """很長的文字取均勻分布的 windows 個片段（總長約 sample_chars），否則原樣回傳"""
+    if not sample_chars or len(text) <= sample_chars:
+        return text
+    size = sample_chars // windows
+    step = (len(text) - size) // (windows - 1)
+    return "".join(text[i * step:i * step + size] for i in range(windows))
+
+
+def count_scripts(text, sample_chars=SAMPLE_CHARS):
+    """計算各文字系統的字元數，回傳 {文字系統名稱: 字元數}（不含 none）"""
+    text = sample_text(text, sample_chars)
+    counts = np.zeros(len(SCRIPTS), dtype=np.int64)
+    # 分塊處理，記憶體用量與文字長度無關
+    for offset in range(0, len(text), BLOCK_CHARS):
+        codes = np.frombuffer(text[offset:offset + BLOCK_CHARS].encode("utf-32-le", "surrogatepass"),
+                              dtype="<u4")
+        if codes.max() < 0x10000:
+            counts += np.bincount(_TABLE[codes], minlength=len(SCRIPTS))
+            continue
+        counts += np.bincount(_TABLE[codes[codes < 0x10000]], minlength=len(SCRIPTS))
+        counts[HAN] += np.count_nonzero((codes >= SUPPLEMENTARY_HAN[0]) & (codes <= SUPPLEMENTARY_HAN[1]))
+    return {name: int(counts[index]) for index, name in enumerate(SCRIPTS) if index != NONE}
+
+
+def language_script(language):
+    """Whisper 語言代碼對應的文字系統編號"""
+    code = (language or "").lower().split("-")[0]
+    if code in ("zh", "yue"):
+        return HAN
+    if code == "ja":
+        return KANA
+    if code == "ko":
+        return HANGUL
+    if code in CYRILLIC_LANGUAGES:
+        return CYRILLIC
+    if code in OTHER_SCRIPT_LANGUAGES:
+        return OTHER
+    return LATIN
+
+
+def dominant_script(counts):
+    """字元數最多的文字系統；沒有任何文字時回傳 None"""
+    values = [counts[name] for name in SCRIPTS[1:]]
+    if not any(values):
+        return None
+    script = values.index(max(values)) + 1
+    # 日文的漢字常多於假名：有一定比例的假名就視為日文
+    if script == HAN and counts["kana"] > KANA_SHARE * (counts["han"] + counts["kana"]):
+        return KANA
+    return script
+
+
+def detect_script_language(text, whisper_language=None, sample_chars=SAMPLE_CHARS):
+    """檢測語言，回傳 (語言代碼, 各文字系統字元數)
+
+    whisper_language: Whisper 或字幕提供的語言；與文字的主要文字系統一致
+    （或文字中沒有可判斷的字元）時採用，否則以文字系統判斷。
+    """
+    counts = count_scripts(text, sample_chars)
+    script = dominant_script(counts)
+    whisper = (whisper_language or "").lower().split("-")[0]
+    if whisper and whisper != "unknown" and (script is None or language_script(whisper) == script):
+        return whisper, counts
+    if script is None:
+        return "unknown", counts
+    return SCRIPT_LANGUAGES[script], counts
+
+
+# 翻譯 prompt 與訊息中使用的語言名稱
+LANGUAGE_NAMES = {
+    "en": "英文", "ja": "日文", "ko": "韓文", "ru": "俄文", "fr": "法文", "de": "德文",
+    "es": "西班牙文", "pt": "葡萄牙文", "it": "義大利文", "vi": "越南文", "th": "泰文",
+    "id": "印尼文", "ar": "阿拉伯文", "hi": "印地文", "zh": "中文",
+}
+
+
+def language_name(language):
+    """語言代碼的中文名稱（未知的語言為「外語」）"""
+    return LANGUAGE_NAMES.get(language, "外語")
+
+
+def needs_translation(language):
+    """中文（或無法判斷語言）的逐字稿只加標點，其餘語言翻譯成繁體中文"""
+    return language not in ("zh", "unknown")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 回應快取
+以模型名稱 + prompt 雜湊 + 生成參數為鍵，避免重複分析同一部影片時
+重新呼叫 Ollama。分段處理時每段各自快取，中途失敗的長任務重跑時
+只需補上尚未完成的段落。
+
+任何具有 get(key) / set(key, value) 方法的物件都可以作為快取後端。
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from transcript_cache import DEFAULT_CACHE_DIR
+
+
+def make_cache_key(model, prompt, params=None):
+    """由模型名稱、prompt 與生成參數計算快取鍵"""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    payload = json.dumps([model, prompt_hash, params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryLRUCache:
+    """記憶體內的 LRU 快取"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SQLiteResponseCache:
+    """以 SQLite 持久化的回應快取"""
+
+    def __init__(self, cache_dir=None, max_entries=100000):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_entries = max_entries
+        self.db_path = os.path.join(self.cache_dir, "llm_responses.sqlite")
+        self.lock = threading.Lock()
+        self.conn = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self.lock, self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_access ON responses (last_access)")
+
+    def connect(self):
+        """資料庫連線（所有執行緒共用一個，第一次使用時開啟；呼叫端須持有 self.lock）
+
+        以 with 使用時為一個交易：成功時 commit，發生例外時 rollback
+        """
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        return self.conn
+
+    def close(self):
+        """關閉資料庫連線（之後再使用時會重新開啟）"""
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def get(self, key):
+        with self.lock, self.connect() as conn:
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock, self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if self.max_entries:
+                # 只保留最近使用的 max_entries 筆
+                conn.execute(
+                    """
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+
+
+class TieredCache:
+    """先查記憶體，再查持久化後端；持久化命中的項目會回填到記憶體"""
+
+    def __init__(self, memory=None, persistent=None):
+        self.memory = memory if memory is not None else MemoryLRUCache()
+        self.persistent = persistent
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.persistent is not None:
+            value = self.persistent.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            self.persistent.set(key, value)
+
+    def close(self):
+        """關閉持久化後端（記憶體中的項目保留）"""
+        if self.persistent is not None and hasattr(self.persistent, 'close'):
+            self.persistent.close()
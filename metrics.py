@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+階段計量
+以 span 記錄每個階段（取得格式、每次格式下載、轉錄、LLM 處理、摘要）的耗時與
+下載位元組數、音訊秒數、LLM token 數、重試次數等數值：
+
+    metrics = Metrics(sinks=[JsonLogSink("spans.jsonl")])
+    with metrics.span("download_audio_by_format", format_id="234") as span:
+        ...
+        span.set(bytes=os.path.getsize(path))
+
+每個 span 結束時：
+- 累加到 Prometheus 格式的計量（耗時直方圖、各數值的累計量），
+  可由 start_metrics_server() 啟動的本地 HTTP 服務在 /metrics 讀取
+- 以一行 JSON 寫入各個 sink（JsonLogSink）
+
+啟動計量服務：
+    server = start_metrics_server(metrics, port=9464)
+    curl http://127.0.0.1:9464/metrics
+"""
+
+import sys
+import json
+import time
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 所有計量名稱的前綴
+PREFIX = "youtube_analyzer"
+# 階段耗時直方圖的區間上限（秒）
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# span 中會累加成計量的數值：屬性名稱 -> (計量名稱, 說明, 額外標籤)
+SPAN_COUNTERS = {
+    "bytes": ("download_bytes_total", "下載的位元組數", {}),
+    "audio_seconds": ("audio_seconds_total", "轉錄的音訊秒數", {}),
+    "tokens_in": ("llm_tokens_total", "LLM 輸入與輸出的 token 數（估計值）", {"direction": "in"}),
+    "tokens_out": ("llm_tokens_total", "LLM 輸入與輸出的 token 數（估計值）", {"direction": "out"}),
+    "llm_calls": ("llm_calls_total", "LLM 呼叫次數", {}),
+    "cache_hits": ("llm_cache_hits_total", "LLM 回應快取命中次數", {}),
+    "retries": ("retries_total", "重試次數", {}),
+}
+
+
+def escape_label(value):
+    """Prometheus 標籤值的跳脫"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Span:
+    """一個階段的記錄；在 with 區塊中以 set()/add() 補上數值"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.span_id = next(self._ids)
+        self.attrs = dict(attrs)
+        self.error = None
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attrs):
+        """設定屬性（覆寫同名屬性）"""
+        with self.lock:
+            self.attrs.update(attrs)
+
+    def add(self, **counts):
+        """累加數值（可從多個執行緒呼叫，例如並行的 LLM 呼叫）"""
+        with self.lock:
+            for key, value in counts.items():
+                self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def fail(self, error):
+        """標記為失敗（用於函式內部已處理、不會拋出的例外）"""
+        self.error = str(error)
+
+    @property
+    def status(self):
+        return "error" if self.error is not None else "ok"
+
+    def to_dict(self):
+        record = {
+            "span": self.name,
+            "span_id": self.span_id,
+            "timestamp": self.started_at,
+            "duration": self.duration,
+            "status": self.status,
+        }
+        if self.error is not None:
+            record["error"] = self.error
+        with self.lock:
+            record.update(self.attrs)
+        return record
+
+
+class JsonLogSink:
+    def __init__(self, path):
+        """每個 span 結束時寫入一行 JSON；path 為 "-" 時寫到 stderr"""
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            if self.path == "-":
+                sys.stderr.write(line)
+                sys.stderr.flush()
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class Metrics:
+    def __init__(self, sinks=None, buckets=DEFAULT_BUCKETS, recent=200):
+        """sinks: 接收每個 span 的物件（具 write(record)）；buckets: 耗時直方圖區間；
+        recent: 保留最近幾個 span 供 /spans 查詢"""
+        self.sinks = list(sinks or [])
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # {計量名稱: {標籤 tuple: 值}}
+        self.counters = {}
+        self.gauges = {}
+        # {標籤 tuple: [各區間次數..., 總和, 次數]}
+        self.histogram = {}
+        self.help = {}
+        self.recent = deque(maxlen=recent)
+
+    def inc(self, name, value=1, help=None, **labels):
+        """累加計數器"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            if help:
+                self.help.setdefault(name, help)
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def gauge(self, name, delta, help=None, **labels):
+        """調整目前值（例如進行中的階段數）"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            if help:
+                self.help.setdefault(name, help)
+            series = self.gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + delta
+
+    def observe(self, seconds, **labels):
+        """記錄一次階段耗時"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.histogram.get(key)
+            if values is None:
+                values = self.histogram[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[index] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """以 with 區塊記錄一個階段；區塊中拋出的例外會標記為失敗後繼續拋出"""
+        span = Span(name, attrs)
+        self.gauge("stage_in_progress", 1, help="進行中的階段數", stage=name)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            self.gauge("stage_in_progress", -1, stage=name)
+            self.finish(span)
+
+    def finish(self, span):
+        """span 結束：更新計量並寫入各個 sink"""
+        self.observe(span.duration, stage=span.name)
+        self.inc("stage_total", help="各階段完成次數", stage=span.name, status=span.status)
+        record = span.to_dict()
+        for attr, (metric, help, labels) in SPAN_COUNTERS.items():
+            value = record.get(attr)
+            if isinstance(value, (int, float)) and value:
+                self.inc(metric, value, help=help, stage=span.name, **labels)
+        with self.lock:
+            self.recent.append(record)
+        for sink in self.sinks:
+            try:
+                sink.write(record)
+            except Exception as e:
+                print(f"計量記錄寫入失敗: {e}")
+
+    def render(self):
+        """Prometheus 文字格式"""
+        lines = []
+
+        def labels_text(key, extra=()):
+            pairs = list(key) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+        with self.lock:
+            name = f"{PREFIX}_stage_duration_seconds"
+            lines.append(f"# HELP {name} 各階段耗時（秒）")
+            lines.append(f"# TYPE {name} histogram")
+            for key, values in sorted(self.histogram.items()):
+                for bound, count in zip(self.buckets, values):
+                    lines.append(f"{name}_bucket{labels_text(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{labels_text(key, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{labels_text(key)} {values[-2]}")
+                lines.append(f"{name}_count{labels_text(key)} {values[-1]}")
+            for kind, table in (("counter", self.counters), ("gauge", self.gauges)):
+                for metric, series in sorted(table.items()):
+                    name = f"{PREFIX}_{metric}"
+                    if metric in self.help:
+                        lines.append(f"# HELP {name} {self.help[metric]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(series.items()):
+                        lines.append(f"{name}{labels_text(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def recent_spans(self):
+        with self.lock:
+            return list(self.recent)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            self.send_body(200, metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/spans":
+            self.send_body(200, json.dumps(metrics.recent_spans(), ensure_ascii=False, default=str),
+                           "application/json")
+        else:
+            self.send_body(404, "not found\n", "text/plain")
+
+
+def start_metrics_server(metrics, host="127.0.0.1", port=9464):
+    """在背景執行緒啟動計量服務：/metrics（Prometheus 格式）與 /spans（最近的 span JSON）"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
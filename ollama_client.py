@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+非同步 Ollama 客戶端
+以 asyncio + aiohttp 呼叫 Ollama 的 /api/generate 與 /api/chat：
+
+- 所有請求共用一個 keep-alive 連線池，不必每次重新建立 HTTP 連線
+- 以 Semaphore 限制同時送出的請求數（連線池大小相同）
+- 每個請求有連線與總時間的逾時，暫時性錯誤（連線失敗、逾時、429/5xx）
+  以指數退避加隨機抖動重試
+
+分析器的其餘部分是同步（多執行緒）程式，因此另外提供 OllamaLLM：
+在背景執行緒執行事件迴圈，對外提供與 langchain Ollama 相同的 invoke()、
+逐 token 產出的 stream()，以及一次並行送出多個 prompt 的 invoke_many()。
+
+可搭配 fake_ollama_server.py 在沒有 Ollama 的環境中測試。
+"""
+
+import json
+import time
+import queue
+import random
+import asyncio
+import threading
+
+import aiohttp
+
+# 會重試的 HTTP 狀態碼
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+# 放在 Ollama 請求 options 中的生成參數
+OPTION_NAMES = ("temperature", "top_k", "top_p", "num_ctx", "num_predict", "repeat_penalty", "seed", "stop")
+
+
+class OllamaError(RuntimeError):
+    """Ollama 回傳錯誤或重試後仍然失敗"""
+
+
+class AsyncOllamaClient:
+    def __init__(self, base_url="http://localhost:11434", model="gemma:7b", max_concurrency=4,
+                 timeout=300, connect_timeout=10, retries=3, backoff=0.5, options=None, keep_alive=None):
+        """初始化客戶端
+
+        max_concurrency: 同時送出的請求數上限（也是連線池大小）
+        timeout: 單一請求的總逾時秒數；connect_timeout: 建立連線的逾時秒數
+        retries: 暫時性錯誤的重試次數；backoff: 第一次重試前的基準等待秒數
+        options: 預設的生成參數（temperature、num_ctx 等）
+        keep_alive: 要求 Ollama 將模型留在記憶體中的時間（例如 "10m"）
+        """
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.options = dict(options or {})
+        self.keep_alive = keep_alive
+        self._session = None
+        self._semaphore = None
+        self.requests = 0
+        self.retried = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def session(self):
+        """共用的 HTTP session（第一次使用時在目前的事件迴圈中建立）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        """關閉連線池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def retry_delay(self, attempt):
+        """指數退避加上完全隨機抖動，避免多個請求同時重試"""
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    async def post(self, path, payload, stats=None):
+        """送出請求並回傳 JSON；暫時性錯誤會重試
+
+        stats: 提供時將本次呼叫的重試次數累加到 stats["retries"]
+        """
+        session = self.session
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                if stats is not None:
+                    stats["retries"] = stats.get("retries", 0) + 1
+                await asyncio.sleep(self.retry_delay(attempt - 1))
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    async with session.post(f"{self.base_url}{path}", json=payload) as response:
+                        if response.status == 200:
+                            return await response.json(content_type=None)
+                        body = await response.text()
+                        last_error = OllamaError(f"Ollama 回傳 {response.status}: {body[:200]}")
+                        if response.status not in RETRY_STATUS:
+                            raise last_error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = OllamaError(f"Ollama 請求失敗: {type(e).__name__} {e}")
+        raise last_error
+
+    def build_payload(self, options):
+        """合併預設與本次的生成參數"""
+        merged = dict(self.options)
+        merged.update({key: value for key, value in options.items() if value is not None})
+        payload = {"model": self.model, "stream": False}
+        for key in ("system", "template", "format"):
+            if key in merged:
+                payload[key] = merged.pop(key)
+        if merged:
+            payload["options"] = merged
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    async def generate(self, prompt, stats=None, **options):
+        """呼叫 /api/generate，回傳生成的文字"""
+        payload = self.build_payload(options)
+        payload["prompt"] = prompt
+        return (await self.post("/api/generate", payload, stats)).get("response", "")
+
+    async def chat(self, messages, stats=None, **options):
+        """呼叫 /api/chat，messages 為 [{'role', 'content'}]，回傳助理回覆的文字"""
+        payload = self.build_payload(options)
+        payload["messages"] = messages
+        return (await self.post("/api/chat", payload, stats)).get("message", {}).get("content", "")
+
+    async def stream_generate(self, prompt, on_token, stats=None, **options):
+        """以串流模式呼叫 /api/generate，每收到一段文字就呼叫 on_token(text)
+
+        回傳最後一筆（done 為 true）的訊息，包含 Ollama 的 eval_count 等統計。
+        尚未收到任何 token 前發生的暫時性錯誤會重試；開始輸出後失敗則直接拋出，
+        避免重複輸出已經顯示的內容。
+        """
+        payload = self.build_payload(options)
+        payload["prompt"] = prompt
+        payload["stream"] = True
+        session = self.session
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                if stats is not None:
+                    stats["retries"] = stats.get("retries", 0) + 1
+                await asyncio.sleep(self.retry_delay(attempt - 1))
+            received = False
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    async with session.post(f"{self.base_url}/api/generate", json=payload) as response:
+                        if response.status != 200:
+                            body = await response.text()
+                            last_error = OllamaError(f"Ollama 回傳 {response.status}: {body[:200]}")
+                            if response.status not in RETRY_STATUS:
+                                raise last_error
+                            continue
+                        # 每一行是一個 JSON 訊息
+                        async for line in response.content:
+                            if not line.strip():
+                                continue
+                            message = json.loads(line)
+                            if message.get("error"):
+                                raise OllamaError(f"Ollama 錯誤: {message['error']}")
+                            if message.get("response"):
+                                received = True
+                                on_token(message["response"])
+                            if message.get("done"):
+                                return message
+                        raise OllamaError("Ollama 串流提前結束")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = OllamaError(f"Ollama 請求失敗: {type(e).__name__} {e}")
+                if received:
+                    raise last_error
+        raise last_error
+
+    async def generate_many(self, prompts, stats=None, **options):
+        """並行送出多個 prompt（同時數量受 max_concurrency 限制）
+
+        依原順序回傳 [(回應或例外, 耗時秒數)]，單一 prompt 失敗不影響其他 prompt。
+        stats: 提供時累加所有 prompt 的重試次數
+        """
+        async def timed(prompt):
+            start = time.perf_counter()
+            try:
+                result = await self.generate(prompt, stats, **options)
+            except Exception as e:
+                result = e
+            return result, time.perf_counter() - start
+
+        return await asyncio.gather(*(timed(prompt) for prompt in prompts))
+
+
+class OllamaLLM:
+    """同步介面：在背景事件迴圈中使用 AsyncOllamaClient
+
+    提供與 langchain Ollama 相同的 invoke() 與生成參數屬性，可以直接替換 analyzer.llm。
+    每個執行緒上一次呼叫的重試次數可由 last_retries 取得。
+    """
+
+    def __init__(self, model="gemma:7b", base_url="http://localhost:11434", max_concurrency=4,
+                 timeout=300, retries=3, **options):
+        self.model = model
+        self.base_url = base_url
+        for name in OPTION_NAMES + ("system", "template"):
+            setattr(self, name, options.pop(name, None))
+        self.client = AsyncOllamaClient(base_url, model, max_concurrency=max_concurrency,
+                                        timeout=timeout, retries=retries, **options)
+        self.calls = threading.local()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def generation_options(self):
+        return {name: getattr(self, name) for name in OPTION_NAMES + ("system", "template")}
+
+    def run(self, coroutine):
+        """在背景事件迴圈中執行並等待結果（可從任何執行緒呼叫）"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    @property
+    def last_retries(self):
+        """目前執行緒上一次呼叫（invoke、chat、stream、invoke_many）的重試次數"""
+        return getattr(self.calls, "retries", 0)
+
+    def call(self, method, *args):
+        """執行一次客戶端呼叫，並記錄本執行緒這次呼叫的重試次數"""
+        stats = {"retries": 0}
+        try:
+            return self.run(method(*args, stats=stats, **self.generation_options()))
+        finally:
+            self.calls.retries = stats["retries"]
+
+    def invoke(self, prompt):
+        return self.call(self.client.generate, prompt)
+
+    def chat(self, messages):
+        return self.call(self.client.chat, messages)
+
+    def stream(self, prompt):
+        """逐段產出生成的文字（與 langchain Ollama.stream 相同的用法）"""
+        tokens = queue.Queue()
+        done = object()
+        stats = {"retries": 0}
+        self.calls.retries = 0
+
+        async def produce():
+            try:
+                await self.client.stream_generate(prompt, tokens.put, stats, **self.generation_options())
+            except Exception as e:
+                tokens.put(e)
+            finally:
+                tokens.put(done)
+
+        asyncio.run_coroutine_threadsafe(produce(), self.loop)
+        while True:
+            token = tokens.get()
+            if token is done:
+                self.calls.retries = stats["retries"]
+                return
+            if isinstance(token, Exception):
+                self.calls.retries = stats["retries"]
+                raise token
+            yield token
+
+    def invoke_many(self, prompts):
+        """並行送出多個 prompt，回傳 [(回應或例外, 耗時秒數)]"""
+        return self.call(self.client.generate_many, prompts)
+
+    def close(self):
+        """關閉連線池並停止事件迴圈"""
+        if self.loop.is_closed():
+            return
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
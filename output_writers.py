@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+結構化輸出
+將逐字稿、處理後（翻譯或加標點）的逐字稿與摘要寫成檔案，每部影片：
+
+    <輸出目錄>/<影片 ID>.srt / .vtt         原始逐字稿字幕（Whisper 片段的時間戳）
+    <輸出目錄>/<影片 ID>.zh.srt / .zh.vtt   處理後的逐字稿字幕
+    <輸出目錄>/<影片 ID>.md                 摘要與附影片時間的處理後逐字稿
+    <輸出目錄>/results.jsonl                每部影片一行 JSON（供下游建立索引，以 "id" 區分影片）
+
+LLM 以段為單位處理，處理後的每段只有整段的時間範圍；輸出字幕時依句子
+拆成較短的字幕，時間依字數在該段的時間範圍內分配（為估計值）。
+
+所有寫入器都逐段寫入檔案，不先組成完整字串：字幕與 Markdown 先寫到
+同目錄的 .part 暫存檔，完成後以 os.replace 取代，中斷時不會留下寫到一半的檔案；
+JSONL 以 iterencode 分塊寫入，同一部影片重新執行時取代舊的那一行（逐行複製其他記錄到
+.part 暫存檔後 os.replace），不會重複出現。
+
+    with SubtitleWriter("video.srt") as writer:
+        for seg in store:
+            writer.write(seg.start, seg.end, seg.text)
+"""
+
+import os
+import re
+import json
+import time
+import threading
+
+from job_store import JobStore
+from transcript_store import format_timestamp
+from language_detect import language_name
+
+OUTPUT_FORMATS = ("srt", "vtt", "md", "jsonl")
+# 處理後的字幕每則的字元數上限（約兩行）
+MAX_CUE_CHARS = 42
+# 句子結尾，以及句子過長時的逗號或空白
+SENTENCE_PATTERN = re.compile(r'.+?(?:[.!?。！？;；]+\s*|\n+|$)', re.S)
+PHRASE_PATTERN = re.compile(r'.+?(?:[,，、]\s*|\s+|$)', re.S)
+
+
+def subtitle_timestamp(seconds, separator=","):
+    """秒數格式化為字幕時間 HH:MM:SS,mmm（WebVTT 的毫秒分隔為 "."）"""
+    milliseconds = max(0, int(round(seconds * 1000)))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def split_cues(start, end, text, max_chars=MAX_CUE_CHARS):
+    """將一段文字依句子（過長時依逗號或空白）拆成不超過 max_chars 的字幕，
+    逐一產出 (起, 訖, 文字)，時間依字數在 [start, end] 內分配"""
+    pieces = []
+    for sentence in SENTENCE_PATTERN.findall(text):
+        if len(sentence.strip()) > max_chars:
+            pieces.extend(PHRASE_PATTERN.findall(sentence))
+        else:
+            pieces.append(sentence)
+
+    total = sum(len(piece) for piece in pieces) or 1
+    duration = max(end - start, 0.0)
+    consumed = 0
+    cue = ""
+    for piece in pieces:
+        if cue.strip() and len((cue + piece).strip()) > max_chars:
+            cue_start = start + duration * consumed / total
+            consumed += len(cue)
+            yield cue_start, start + duration * consumed / total, cue.strip()
+            cue = ""
+        cue += piece
+    if cue.strip():
+        yield start + duration * consumed / total, end, cue.strip()
+
+
+class StreamingFile:
+    """逐段寫入 <path>.part，close() 時以 os.replace 換成正式檔名"""
+
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = path + ".part"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.temp_path, "w", encoding="utf-8")
+
+    def write_text(self, text):
+        self.file.write(text)
+
+    def close(self):
+        """完成寫入並換成正式檔名"""
+        if self.file.closed:
+            return
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        """放棄寫入，刪除暫存檔"""
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SubtitleWriter(StreamingFile):
+    def __init__(self, path, format=None):
+        """format: srt 或 vtt（預設依副檔名判斷）"""
+        super().__init__(path)
+        self.format = format or ("vtt" if path.lower().endswith(".vtt") else "srt")
+        self.count = 0
+        if self.format == "vtt":
+            self.write_text("WEBVTT\n\n")
+
+    def write(self, start, end, text):
+        """寫入一則字幕（空白文字略過）"""
+        text = "\n".join(line.strip() for line in text.strip().splitlines() if line.strip())
+        if not text:
+            return
+        # "-->" 在字幕中是時間分隔符號，不能出現在內文
+        text = text.replace("-->", "->")
+        self.count += 1
+        separator = "." if self.format == "vtt" else ","
+        timing = f"{subtitle_timestamp(start, separator)} --> {subtitle_timestamp(max(end, start), separator)}"
+        if self.format == "srt":
+            self.write_text(f"{self.count}\n{timing}\n{text}\n\n")
+        else:
+            self.write_text(f"{timing}\n{text}\n\n")
+
+    def write_store(self, store, split=False):
+        """寫入 SegmentStore 的所有片段；split 時每個片段再依句子拆成較短的字幕"""
+        for seg in store:
+            if split:
+                for start, end, text in split_cues(seg.start, seg.end, seg.text):
+                    self.write(start, end, text)
+            else:
+                self.write(seg.start, seg.end, seg.text)
+
+
+class MarkdownWriter(StreamingFile):
+    def __init__(self, path, title):
+        super().__init__(path)
+        self.write_text(f"# {title}\n\n")
+
+    def section(self, title):
+        self.write_text(f"## {title}\n\n")
+
+    def write_fields(self, fields):
+        """寫入項目清單（略過沒有值的項目）"""
+        for name, value in fields:
+            if value:
+                self.write_text(f"- {name}：{value}\n")
+        self.write_text("\n")
+
+    def write_paragraph(self, text):
+        self.write_text(text.strip() + "\n\n")
+
+    def write_segment(self, start, end, text):
+        """寫入一段附影片時間的文字"""
+        text = text.strip()
+        if text:
+            self.write_text(f"**[{format_timestamp(start)} - {format_timestamp(end)}]** {text}\n\n")
+
+
+class JsonlWriter:
+    def __init__(self, path, key=None):
+        """每筆記錄寫成一行 JSON（可從多個執行緒呼叫）
+
+        key: 記錄的鍵欄位；提供時取代檔案中鍵相同的舊記錄，否則直接附加
+        """
+        self.path = path
+        self.key = key
+        self.lock = threading.Lock()
+        self.encoder = json.JSONEncoder(ensure_ascii=False, default=str)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, record):
+        with self.lock:
+            if self.key is None or not os.path.exists(self.path):
+                with open(self.path, "a", encoding="utf-8") as f:
+                    self.write_record(f, record)
+                return
+            # 複製鍵不同的記錄，再寫入新記錄，完成後取代原檔
+            with StreamingFile(self.path) as output, open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip() and not self.same_key(line, record):
+                        output.write_text(line if line.endswith("\n") else line + "\n")
+                self.write_record(output.file, record)
+
+    def same_key(self, line, record):
+        try:
+            existing = json.loads(line)
+        except ValueError:
+            return False
+        return isinstance(existing, dict) and existing.get(self.key) == record.get(self.key)
+
+    def write_record(self, f, record):
+        # 分塊編碼，長影片的片段列表不會先組成一個完整字串
+        for chunk in self.encoder.iterencode(record):
+            f.write(chunk)
+        f.write("\n")
+        f.flush()
+
+
+def segment_records(store):
+    return [{'start': seg.start, 'end': seg.end, 'text': seg.text.strip()} for seg in store]
+
+
+class OutputWriter:
+    def __init__(self, output_dir, formats=OUTPUT_FORMATS):
+        """output_dir: 輸出目錄；formats: 要輸出的格式（srt / vtt / md / jsonl）"""
+        self.output_dir = output_dir
+        self.formats = tuple(formats)
+        os.makedirs(output_dir, exist_ok=True)
+        self.index = None
+        if "jsonl" in self.formats:
+            self.index = JsonlWriter(os.path.join(output_dir, "results.jsonl"), key="id")
+
+    def write_video(self, url, transcript, processed, summary, language, video_id=None):
+        """寫入一部影片的所有輸出，回傳 {格式: 路徑}；寫入失敗時印出錯誤並回傳已完成的部分"""
+        name = JobStore.job_id(video_id, url)
+        base = os.path.join(self.output_dir, name)
+        # 處理後的字幕以處理後的語言標示（翻譯後為 zh）
+        processed_suffix = f".{processed.language or 'processed'}"
+        outputs = {}
+        try:
+            for fmt in ("srt", "vtt"):
+                if fmt not in self.formats:
+                    continue
+                with SubtitleWriter(f"{base}.{fmt}") as writer:
+                    writer.write_store(transcript)
+                outputs[fmt] = writer.path
+                # LLM 未連接時處理後的逐字稿就是原始逐字稿，不重複輸出
+                if processed is transcript:
+                    continue
+                with SubtitleWriter(f"{base}{processed_suffix}.{fmt}") as writer:
+                    writer.write_store(processed, split=True)
+                outputs[f"processed_{fmt}"] = writer.path
+            if "md" in self.formats:
+                outputs["md"] = self.write_markdown(f"{base}.md", url, transcript, processed, summary, language)
+            if self.index is not None:
+                self.index.write({
+                    "id": name,
+                    "url": url,
+                    "video_id": video_id,
+                    "language": language,
+                    "source": transcript.source,
+                    "duration": transcript.duration,
+                    "created": time.time(),
+                    "summary": summary,
+                    "segments": segment_records(transcript),
+                    "processed_language": processed.language,
+                    "processed_segments": segment_records(processed),
+                    "outputs": dict(outputs),
+                })
+                outputs["jsonl"] = self.index.path
+        except Exception as e:
+            print(f"輸出檔寫入失敗: {e}")
+        if outputs:
+            print(f"結果已寫入 {self.output_dir}: {', '.join(os.path.basename(path) for path in outputs.values())}")
+        return outputs
+
+    def write_markdown(self, path, url, transcript, processed, summary, language):
+        with MarkdownWriter(path, url) as writer:
+            writer.write_fields([
+                ("影片", url),
+                ("語言", f"{language_name(language)}（{language}）" if language else None),
+                ("長度", format_timestamp(transcript.duration) if transcript.duration else None),
+            ])
+            writer.section("摘要")
+            writer.write_paragraph(summary or "")
+            writer.section("處理後的逐字稿")
+            for seg in processed:
+                writer.write_segment(seg.start, seg.end, seg.text)
+        return path
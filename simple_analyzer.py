@@ -46,6 +46,13 @@ class SimpleYouTubeAnalyzer:
     def setup_whisper(self):
         """設置 Whisper 模型"""
         if self.whisper_model is None:
+            server = os.environ.get("WHISPER_SERVER")
+            if server:
+                # 使用共用的 Whisper 模型服務，不在本行程載入模型
+                from whisper_server import RemoteWhisperModel
+                print(f"使用 Whisper 模型服務: {server}")
+                self.whisper_model = RemoteWhisperModel(server)
+                return
             print("載入 Whisper 模型...")
             self.whisper_model = whisper.load_model("tiny")  # 使用最小模型節省記憶體
             print("Whisper 模型載入完成")
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+階段排程與時間軸
+StageScheduler 以 DAG 描述各階段的相依關係，任一階段的輸入全部完成時
+立即開始執行，不必等整個上一層結束。例如第 k 段翻譯完成後，
+第 k 段的分段摘要就可以與其他段的翻譯同時進行。
+
+StageTrace 記錄每個階段的開始與結束時間，可輸出為 Chrome trace JSON，
+在 chrome://tracing 或 https://ui.perfetto.dev 中檢視：
+
+    trace = StageTrace(pid=1, name="video")
+    scheduler = StageScheduler(max_workers=4, trace=trace)
+    scheduler.add("translate 1", translate, args=(chunk,))
+    scheduler.add("summary 1", summarize, deps=["translate 1"])
+    results = scheduler.run()
+    write_chrome_trace("trace.json", [trace])
+"""
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# 所有時間軸共用的時間原點，讓同一檔案中的多條時間軸可以對齊
+_ORIGIN = time.perf_counter()
+
+
+class StageTrace:
+    """一部影片（一個 Chrome trace 行程）的階段時間軸"""
+
+    def __init__(self, pid=1, name=None):
+        self.pid = pid
+        self.name = name
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def thread_id(self):
+        """以較小的編號代表執行緒，讓時間軸容易閱讀"""
+        ident = threading.get_ident()
+        with self.lock:
+            if ident not in self.threads:
+                self.threads[ident] = (len(self.threads) + 1, threading.current_thread().name)
+            return self.threads[ident][0]
+
+    def add(self, name, start, end, category="stage", args=None):
+        """記錄一個已完成的階段（start/end 為 time.perf_counter() 的值）"""
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - _ORIGIN) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self.pid,
+            "tid": self.thread_id(),
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category="stage", args=None):
+        """以 with 區塊記錄一個階段"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter(), category, args)
+
+    def trace_events(self):
+        """Chrome trace 事件（含行程與執行緒名稱）"""
+        events = []
+        if self.name:
+            events.append({"name": "process_name", "ph": "M", "pid": self.pid,
+                           "args": {"name": self.name}})
+        for tid, thread_name in self.threads.values():
+            events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                           "args": {"name": thread_name}})
+        return events + sorted(self.events, key=lambda event: event["ts"])
+
+
+def write_chrome_trace(path, traces):
+    """將多條時間軸寫成一個 Chrome trace JSON 檔"""
+    events = []
+    for trace in traces:
+        events.extend(trace.trace_events())
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+
+class StageScheduler:
+    def __init__(self, max_workers=4, trace=None):
+        """max_workers: 同時執行的階段數；trace: 記錄時間軸的 StageTrace"""
+        self.max_workers = max_workers
+        self.trace = trace
+        self.stages = {}
+        self.order = []
+        self.errors = {}
+
+    def add(self, name, func, deps=(), args=(), category="stage"):
+        """加入一個階段；執行時呼叫 func(*args, *相依階段的結果)"""
+        if name in self.stages:
+            raise ValueError(f"重複的階段名稱: {name}")
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"階段 {name} 的相依階段尚未加入: {', '.join(missing)}")
+        self.stages[name] = {"func": func, "deps": list(deps), "args": tuple(args), "category": category}
+        self.order.append(name)
+        return name
+
+    def execute(self, name):
+        stage = self.stages[name]
+        inputs = [self.results[dep] for dep in stage["deps"]]
+        start = time.perf_counter()
+        try:
+            return stage["func"](*stage["args"], *inputs)
+        finally:
+            if self.trace is not None:
+                self.trace.add(name, start, time.perf_counter(), stage["category"])
+
+    def run(self):
+        """執行所有階段，回傳 {階段名稱: 結果}
+
+        階段失敗時記錄於 self.errors，依賴它的階段不會執行（結果為 None）。
+        """
+        self.results = {}
+        self.errors = {}
+        remaining = {name: set(self.stages[name]["deps"]) for name in self.order}
+        dependents = {name: [] for name in self.order}
+        for name in self.order:
+            for dep in self.stages[name]["deps"]:
+                dependents[dep].append(name)
+
+        def skip(name):
+            # 失敗階段的下游全部略過
+            for child in dependents[name]:
+                if child in remaining:
+                    del remaining[child]
+                    self.results[child] = None
+                    self.errors[child] = f"相依階段 {name} 失敗"
+                    skip(child)
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while remaining or running:
+                # 依加入順序啟動輸入已就緒的階段；只在有空閒工作者時送出，
+                # 讓先加入的下游階段優先於後加入的上游階段
+                for name in [name for name in self.order if name in remaining and not remaining[name]]:
+                    if len(running) >= self.max_workers:
+                        break
+                    del remaining[name]
+                    running[executor.submit(self.execute, name)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        self.results[name] = None
+                        self.errors[name] = str(e)
+                        skip(name)
+                        continue
+                    for child in dependents[name]:
+                        if child in remaining:
+                            remaining[child].discard(name)
+        return self.results
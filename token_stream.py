@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 串流輸出
+多個分段同時生成時，依分段順序把 token 寫到終端機與輸出檔：
+目前輪到的分段收到 token 立即寫出，後面的分段先暫存，
+等前一段完成後一次補上，再接著即時輸出。
+"""
+
+import sys
+import threading
+
+
+class OrderedTokenWriter:
+    def __init__(self, count, sinks=None, separator=""):
+        """count: 分段數；sinks: 要寫入的檔案物件（預設只有 stdout）；
+        separator: 分段之間插入的文字"""
+        self.count = count
+        self.sinks = sinks if sinks is not None else [sys.stdout]
+        self.separator = separator
+        self.lock = threading.Lock()
+        self.buffers = [[] for _ in range(count)]
+        self.finished = [False] * count
+        self.received = [False] * count
+        self.current = 0
+
+    def emit(self, text):
+        for sink in self.sinks:
+            sink.write(text)
+            sink.flush()
+
+    def write(self, index, token):
+        """第 index 段收到新的 token"""
+        with self.lock:
+            self.received[index] = True
+            if index == self.current:
+                self.emit(token)
+            else:
+                self.buffers[index].append(token)
+
+    def finish(self, index, fallback=None):
+        """第 index 段生成結束；fallback 為該段沒有輸出任何 token 時改寫的文字（例如失敗時的原文）"""
+        with self.lock:
+            if fallback and not self.received[index]:
+                if index == self.current:
+                    self.emit(fallback)
+                else:
+                    self.buffers[index].append(fallback)
+            self.finished[index] = True
+            # 目前的段落完成後，依序補上已暫存（或已完成）的後續段落
+            while self.current < self.count and self.finished[self.current]:
+                self.current += 1
+                if self.current >= self.count:
+                    break
+                self.emit(self.separator)
+                self.emit("".join(self.buffers[self.current]))
+                self.buffers[self.current] = []
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐字稿快取
+以影片 ID + Whisper 模型 + 解碼參數為鍵，將逐字稿存入 SQLite，
+重複分析同一部影片時可以跳過下載與轉錄。
+
+命令列用法：
+    python transcript_cache.py stats
+    python transcript_cache.py list
+    python transcript_cache.py prune --max-mb 200
+    python transcript_cache.py prune --older-than 30
+    python transcript_cache.py delete VIDEO_ID
+    python transcript_cache.py clear
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "YTA_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "youtube_transcript_analyzer"),
+)
+
+
+class TranscriptCache:
+    def __init__(self, cache_dir=None, max_bytes=500 * 1024 * 1024, max_entries=None):
+        """初始化快取
+
+        cache_dir: 快取目錄（預設 ~/.cache/youtube_transcript_analyzer 或 YTA_CACHE_DIR）
+        max_bytes: 快取總大小上限，超過時依最近使用時間淘汰
+        max_entries: 筆數上限（None 表示不限制）
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.db_path = os.path.join(self.cache_dir, "transcripts.sqlite")
+        self.lock = threading.Lock()
+        self.conn = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self.lock, self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    key TEXT PRIMARY KEY,
+                    video_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON transcripts (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_video_id ON transcripts (video_id)")
+
+    def connect(self):
+        """資料庫連線（所有執行緒共用一個，第一次使用時開啟；呼叫端須持有 self.lock）
+
+        以 with 使用時為一個交易：成功時 commit，發生例外時 rollback
+        """
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        return self.conn
+
+    def close(self):
+        """關閉資料庫連線（之後再使用時會重新開啟）"""
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    @staticmethod
+    def make_key(video_id, model, options):
+        """由影片 ID、模型名稱與解碼參數計算快取鍵"""
+        payload = json.dumps([video_id, model, options or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, video_id, model, options=None):
+        """讀取快取，未命中時回傳 None"""
+        key = self.make_key(video_id, model, options)
+        with self.lock, self.connect() as conn:
+            row = conn.execute("SELECT data FROM transcripts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE transcripts SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                (time.time(), key),
+            )
+        return json.loads(row[0])
+
+    def put(self, video_id, model, options, data):
+        """寫入快取並視需要淘汰最久未使用的項目"""
+        key = self.make_key(video_id, model, options)
+        payload = json.dumps(data, ensure_ascii=False)
+        now = time.time()
+        with self.lock, self.connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO transcripts
+                    (key, video_id, model, options, data, size, created, last_access, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, video_id, model, json.dumps(options or {}, sort_keys=True),
+                 payload, len(payload.encode("utf-8")), now, now),
+            )
+        self.evict()
+
+    def evict(self, max_bytes=None, max_entries=None, older_than=None):
+        """依大小、筆數或存放時間淘汰項目，回傳刪除筆數
+
+        older_than: 刪除超過此秒數未使用的項目
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_entries = self.max_entries if max_entries is None else max_entries
+        removed = 0
+        with self.lock, self.connect() as conn:
+            if older_than is not None:
+                cursor = conn.execute(
+                    "DELETE FROM transcripts WHERE last_access < ?", (time.time() - older_than,)
+                )
+                removed += cursor.rowcount
+
+            rows = conn.execute(
+                "SELECT key, size FROM transcripts ORDER BY last_access DESC"
+            ).fetchall()
+            total = 0
+            stale = []
+            for index, (key, size) in enumerate(rows):
+                total += size
+                over_size = max_bytes is not None and total > max_bytes
+                over_count = max_entries is not None and index >= max_entries
+                if over_size or over_count:
+                    stale.append((key,))
+            if stale:
+                conn.executemany("DELETE FROM transcripts WHERE key = ?", stale)
+                removed += len(stale)
+        return removed
+
+    def delete(self, video_id):
+        """刪除某部影片的所有快取，回傳刪除筆數"""
+        with self.lock, self.connect() as conn:
+            return conn.execute("DELETE FROM transcripts WHERE video_id = ?", (video_id,)).rowcount
+
+    def clear(self):
+        """清空快取"""
+        with self.lock, self.connect() as conn:
+            return conn.execute("DELETE FROM transcripts").rowcount
+
+    def entries(self):
+        """列出所有項目（依最近使用時間排序）"""
+        with self.lock, self.connect() as conn:
+            return conn.execute(
+                """
+                SELECT video_id, model, options, size, created, last_access, hits
+                FROM transcripts ORDER BY last_access DESC
+                """
+            ).fetchall()
+
+    def stats(self):
+        """回傳快取統計"""
+        with self.lock, self.connect() as conn:
+            count, total, hits = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM transcripts"
+            ).fetchone()
+        return {
+            "path": self.db_path,
+            "entries": count,
+            "bytes": total,
+            "hits": hits,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def format_time(timestamp):
+    """格式化時間戳"""
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
+
+
+def main():
+    """快取管理命令列"""
+    parser = argparse.ArgumentParser(description="逐字稿快取管理")
+    parser.add_argument("--cache-dir", default=None, help="快取目錄")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="顯示快取統計")
+    subparsers.add_parser("list", help="列出快取項目")
+    prune = subparsers.add_parser("prune", help="淘汰快取項目")
+    prune.add_argument("--max-mb", type=float, default=None, help="保留的總大小上限（MB）")
+    prune.add_argument("--max-entries", type=int, default=None, help="保留的筆數上限")
+    prune.add_argument("--older-than", type=float, default=None, help="刪除超過 N 天未使用的項目")
+    delete = subparsers.add_parser("delete", help="刪除指定影片的快取")
+    delete.add_argument("video_id")
+    subparsers.add_parser("clear", help="清空快取")
+    args = parser.parse_args()
+
+    cache = TranscriptCache(args.cache_dir, max_bytes=None)
+    try:
+        run_command(cache, args)
+    finally:
+        cache.close()
+
+
+def run_command(cache, args):
+    """執行快取管理命令"""
+    if args.command == "stats":
+        stats = cache.stats()
+        print(f"快取位置: {stats['path']}")
+        print(f"項目數: {stats['entries']}")
+        print(f"總大小: {stats['bytes'] / 1024 / 1024:.2f} MB")
+        print(f"命中次數: {stats['hits']}")
+    elif args.command == "list":
+        for video_id, model, options, size, created, last_access, hits in cache.entries():
+            print(f"{video_id}  {model:<8} {size / 1024:>8.1f} KB  "
+                  f"建立 {format_time(created)}  最近使用 {format_time(last_access)}  "
+                  f"命中 {hits}  {options}")
+    elif args.command == "prune":
+        max_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None
+        older_than = args.older_than * 86400 if args.older_than is not None else None
+        removed = cache.evict(max_bytes=max_bytes, max_entries=args.max_entries, older_than=older_than)
+        print(f"已刪除 {removed} 筆快取")
+    elif args.command == "delete":
+        print(f"已刪除 {cache.delete(args.video_id)} 筆快取")
+    elif args.command == "clear":
+        print(f"已刪除 {cache.clear()} 筆快取")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+片段逐字稿
+保留 Whisper／字幕的每個片段（時間戳、avg_logprob、no_speech_prob），
+而不是只留下一整段文字。
+
+所有片段的文字串接在同一個字串中，每個片段只記錄起訖偏移量；
+時間與信心分數以 array 欄位保存，長影片的數千個片段也不會
+產生數千個 dict，記憶體用量與純文字相近。
+
+    store = SegmentStore(language="zh")
+    store.append(0.0, 2.5, "大家好")
+    store.text                       # 全文
+    store[0]                         # Segment(start, end, text, ...)
+    store.time_range(0, 10)          # 全文第 0~10 個字元對應的 (起, 訖) 秒數
+"""
+
+from array import array
+from bisect import bisect_right
+
+
+class Segment:
+    """單一片段（只在需要時由 SegmentStore 產生）"""
+
+    __slots__ = ('start', 'end', 'text', 'avg_logprob', 'no_speech_prob')
+
+    def __init__(self, start, end, text, avg_logprob=None, no_speech_prob=None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.avg_logprob = avg_logprob
+        self.no_speech_prob = no_speech_prob
+
+    def to_dict(self):
+        return {
+            'start': self.start,
+            'end': self.end,
+            'text': self.text,
+            'avg_logprob': self.avg_logprob,
+            'no_speech_prob': self.no_speech_prob,
+        }
+
+    def __repr__(self):
+        return f"Segment({self.start:.2f}-{self.end:.2f}, {self.text!r})"
+
+
+# 沒有信心分數時（例如字幕）在 float 欄位中使用的值
+MISSING = float('nan')
+
+
+def _optional(value):
+    """float 欄位的值轉回 Python 值，NaN 表示沒有資料"""
+    return None if value != value else value
+
+
+class SegmentStore:
+    """以欄位儲存的片段集合，所有片段文字共用一個緩衝區"""
+
+    __slots__ = ('language', 'source', 'language_probs', 'starts', 'ends', 'offsets',
+                 'avg_logprobs', 'no_speech_probs', 'separator', '_parts', '_buffer')
+
+    def __init__(self, language=None, source=None, separator=""):
+        """separator: 片段之間的分隔字元（字幕片段的文字已去除前後空白，需要補上空格）"""
+        self.language = language
+        self.source = source
+        # Whisper 對前 30 秒的語言機率 {語言: 機率}（字幕或未檢測時為 None）
+        self.language_probs = None
+        self.separator = separator
+        self.starts = array('d')
+        self.ends = array('d')
+        # offsets[i] 與 offsets[i + 1] 為第 i 個片段在緩衝區中的起訖位置
+        self.offsets = array('q', [0])
+        self.avg_logprobs = array('d')
+        self.no_speech_probs = array('d')
+        self._parts = []
+        self._buffer = ""
+
+    @classmethod
+    def from_segments(cls, segments, language=None, source=None, separator=""):
+        """由 [{'start', 'end', 'text', ...}] 建立"""
+        store = cls(language, source, separator)
+        for seg in segments:
+            store.append(seg['start'], seg['end'], seg['text'],
+                         seg.get('avg_logprob'), seg.get('no_speech_prob'))
+        return store
+
+    @classmethod
+    def from_result(cls, result):
+        """由轉錄結果或快取內容建立（支援欄位格式與舊的 segments 列表）"""
+        if result is None or isinstance(result, SegmentStore):
+            return result
+        # 字幕片段的文字已去除前後空白，中日韓以外的語言需要以空格分隔
+        captions = result.get('source') == "captions"
+        separator = " " if captions and result.get('language') not in ('zh', 'ja', 'ko') else ""
+        columns = result.get('columns')
+        if columns:
+            # 較舊的快取沒有 separator 欄位，依來源與語言推定
+            store = cls(result.get('language'), result.get('source'), result.get('separator', separator))
+            store._buffer = result['buffer']
+            store.starts.extend(columns['start'])
+            store.ends.extend(columns['end'])
+            store.offsets = array('q', columns['offset'])
+            store.avg_logprobs.extend(MISSING if v is None else v for v in columns['avg_logprob'])
+            store.no_speech_probs.extend(MISSING if v is None else v for v in columns['no_speech_prob'])
+            store.language_probs = result.get('language_probs')
+            return store
+
+        segments = result.get('segments') or []
+        store = cls.from_segments(segments, result.get('language'), result.get('source'), separator)
+        if not segments and result.get('text'):
+            # 沒有片段資訊的舊結果：整段文字視為一個沒有時間戳的片段
+            store.append(0.0, 0.0, result['text'])
+        store.language_probs = result.get('language_probs')
+        return store
+
+    def append(self, start, end, text, avg_logprob=None, no_speech_prob=None):
+        """加入一個片段"""
+        if self.separator and len(self.starts):
+            text = self.separator + text
+        self._parts.append(text)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.offsets.append(self.offsets[-1] + len(text))
+        self.avg_logprobs.append(MISSING if avg_logprob is None else avg_logprob)
+        self.no_speech_probs.append(MISSING if no_speech_prob is None else no_speech_prob)
+
+    @property
+    def buffer(self):
+        """所有片段文字串接後的緩衝區（新加入的片段在讀取時才合併）"""
+        if self._parts:
+            self._buffer += "".join(self._parts)
+            self._parts = []
+        return self._buffer
+
+    @property
+    def text(self):
+        """全文（去除前後空白）"""
+        return self.buffer.strip()
+
+    @property
+    def text_offset(self):
+        """全文在緩衝區中的起始位置（即被去除的前導空白長度）"""
+        buffer = self.buffer
+        return len(buffer) - len(buffer.lstrip())
+
+    @property
+    def duration(self):
+        return self.ends[-1] if len(self.ends) else 0.0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __bool__(self):
+        return bool(self.text)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        buffer = self.buffer
+        return Segment(self.starts[index], self.ends[index],
+                       buffer[self.offsets[index]:self.offsets[index + 1]],
+                       _optional(self.avg_logprobs[index]), _optional(self.no_speech_probs[index]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def segment_at(self, offset):
+        """緩衝區中某個字元位置所屬的片段索引"""
+        index = bisect_right(self.offsets, offset) - 1
+        return min(max(index, 0), len(self) - 1)
+
+    def time_range(self, start_offset, end_offset):
+        """全文（text）中 [start_offset, end_offset) 的文字對應的 (起, 訖) 秒數"""
+        if not len(self):
+            return 0.0, 0.0
+        buffer = self.buffer
+        shift = self.text_offset
+        start, end = start_offset + shift, end_offset + shift
+        # 範圍兩端的空白屬於相鄰片段（Whisper 片段以空白開頭），不計入
+        while end - 1 > start and buffer[end - 1].isspace():
+            end -= 1
+        while start < end - 1 and buffer[start].isspace():
+            start += 1
+        first = self.segment_at(start)
+        last = self.segment_at(max(end - 1, start))
+        return self.starts[first], self.ends[last]
+
+    def to_dict(self):
+        """轉為一般的結果結構 {'text', 'language', 'source', 'segments'}（供輸出）"""
+        return {
+            'text': self.text,
+            'language': self.language,
+            'language_probs': self.language_probs,
+            'source': self.source,
+            'segments': [seg.to_dict() for seg in self],
+        }
+
+    def to_columns(self):
+        """轉為可 JSON 序列化的欄位格式（供快取，比 segments 列表精簡）"""
+        return {
+            'language': self.language,
+            'language_probs': self.language_probs,
+            'source': self.source,
+            'separator': self.separator,
+            'buffer': self.buffer,
+            'columns': {
+                'start': self.starts.tolist(),
+                'end': self.ends.tolist(),
+                'offset': self.offsets.tolist(),
+                'avg_logprob': [_optional(v) for v in self.avg_logprobs],
+                'no_speech_prob': [_optional(v) for v in self.no_speech_probs],
+            },
+        }
+
+
+def format_timestamp(seconds):
+    """秒數格式化為 HH:MM:SS"""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+轉錄引擎
+所有引擎都提供相同的 transcribe(audio, **options) 介面，回傳相同結構：
+
+    {
+        'text': 全文,
+        'language': 語言代碼,
+        'segments': [{'start', 'end', 'text', 'avg_logprob', 'no_speech_prob'}],
+        'language_probs': {語言: 機率}（引擎有提供時）,
+    }
+
+load_audio(path) 以引擎自己的解碼器將音訊檔解碼為 16 kHz 單聲道 float32 陣列；
+detect_language(audio) 以音訊前 30 秒檢測語言，回傳 (語言, {語言: 機率})；
+先檢測再把語言傳給 transcribe()，引擎就不會在轉錄時再檢測一次。
+
+- openai-whisper：openai-whisper 的 PyTorch 實作（預設）
+- faster-whisper：CTranslate2 實作，預設 int8 量化，CPU 上通常快數倍
+  （需另外安裝：pip install faster-whisper）
+"""
+
+# 兩個引擎的取樣率（16 kHz）與一次解碼的音訊長度（30 秒）
+SAMPLE_RATE = 16000
+N_SAMPLES = 30 * SAMPLE_RATE
+
+# 兩個引擎都支援的轉錄參數，其餘參數（如 verbose、fp16）只傳給支援的引擎
+COMMON_OPTIONS = {"language", "task", "initial_prompt", "temperature", "beam_size", "best_of"}
+
+
+# 語言機率只保留機率最高的幾個
+TOP_LANGUAGES = 5
+
+
+def top_languages(probs, limit=TOP_LANGUAGES):
+    """{語言: 機率} 只保留機率最高的 limit 個，回傳 (最可能的語言, 機率 dict)"""
+    items = sorted(((language, float(prob)) for language, prob in probs), key=lambda item: item[1], reverse=True)
+    items = items[:limit]
+    return (items[0][0] if items else None), dict(items)
+
+
+def normalize_segment(start, end, text, avg_logprob=None, no_speech_prob=None):
+    """統一的片段結構"""
+    return {
+        'start': float(start),
+        'end': float(end),
+        'text': text,
+        'avg_logprob': avg_logprob,
+        'no_speech_prob': no_speech_prob,
+    }
+
+
+class TranscriptionBackend:
+    """轉錄引擎介面"""
+
+    name = None
+
+    def __init__(self, model_name="base", **kwargs):
+        self.model_name = model_name
+
+    def transcribe(self, audio, **options):
+        """轉錄音訊（檔案路徑或 16 kHz float32 陣列）"""
+        raise NotImplementedError
+
+    def load_audio(self, path):
+        """將音訊檔解碼為 16 kHz 單聲道 float32 陣列"""
+        raise NotImplementedError
+
+    def detect_language(self, audio):
+        """以前 30 秒檢測語言，回傳 (語言, {語言: 機率})；不支援時回傳 (None, None)"""
+        return None, None
+
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """openai-whisper（PyTorch）"""
+
+    name = "openai-whisper"
+
+    def __init__(self, model_name="base", **kwargs):
+        super().__init__(model_name)
+        import whisper
+        self.model = whisper.load_model(model_name)
+
+    def load_audio(self, path):
+        import whisper
+        return whisper.load_audio(path, sr=SAMPLE_RATE)
+
+    def detect_language(self, audio):
+        import whisper
+        if not self.model.is_multilingual:
+            # 僅英文的模型（如 base.en）不做語言檢測
+            return "en", {"en": 1.0}
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=self.model.dims.n_mels)
+        _, probs = self.model.detect_language(mel.to(self.model.device))
+        return top_languages(probs.items())
+
+    def transcribe(self, audio, **options):
+        result = self.model.transcribe(audio, **options)
+        return {
+            'text': result["text"].strip(),
+            'language': result.get("language"),
+            'segments': [
+                normalize_segment(seg['start'], seg['end'], seg['text'],
+                                  seg.get('avg_logprob'), seg.get('no_speech_prob'))
+                for seg in result.get("segments", [])
+            ],
+        }
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """faster-whisper（CTranslate2，int8 量化）"""
+
+    name = "faster-whisper"
+
+    def __init__(self, model_name="base", compute_type="int8", device="cpu", cpu_threads=0, **kwargs):
+        super().__init__(model_name)
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise RuntimeError("未安裝 faster-whisper，請執行: pip install faster-whisper")
+        self.model = WhisperModel(model_name, device=device, compute_type=compute_type,
+                                  cpu_threads=cpu_threads)
+
+    def load_audio(self, path):
+        # faster-whisper 以 PyAV 解碼，不需要 openai-whisper 或 FFmpeg 執行檔
+        from faster_whisper import decode_audio
+        return decode_audio(path, sampling_rate=SAMPLE_RATE)
+
+    def transcribe(self, audio, **options):
+        options = {key: value for key, value in options.items() if key in COMMON_OPTIONS}
+        segments, info = self.model.transcribe(audio, **options)
+        # faster-whisper 回傳的是產生器，逐段取出時才實際解碼
+        segments = [
+            normalize_segment(seg.start, seg.end, seg.text, seg.avg_logprob, seg.no_speech_prob)
+            for seg in segments
+        ]
+        result = {
+            'text': "".join(seg['text'] for seg in segments).strip(),
+            'language': info.language,
+            'segments': segments,
+        }
+        if getattr(info, 'all_language_probs', None):
+            result['language_probs'] = top_languages(info.all_language_probs)[1]
+        return result
+
+    def detect_language(self, audio):
+        if not hasattr(self.model, "detect_language"):
+            # 舊版 faster-whisper 沒有單獨的語言檢測，改由 transcribe() 的結果提供機率
+            return None, None
+        _, _, probs = self.model.detect_language(audio)
+        return top_languages(probs)
+
+
+BACKENDS = {
+    OpenAIWhisperBackend.name: OpenAIWhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def create_backend(name="openai-whisper", model_name="base", **kwargs):
+    """依名稱建立轉錄引擎"""
+    if name not in BACKENDS:
+        raise ValueError(f"未知的轉錄引擎: {name}（可用: {', '.join(BACKENDS)}）")
+    return BACKENDS[name](model_name, **kwargs)
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Whisper 模型服務
+常駐行程只載入一次 Whisper 模型，透過 Unix socket（或 TCP）接受多個
+分析器的轉錄請求，避免每個分析器各自載入一份模型權重。
+
+- 使用 openai-whisper 引擎時，不超過 30 秒的音訊片段會合併成批次，一次送入 whisper.decode
+  （結果依時間戳 token 分段；壓縮率或 log 機率超過門檻、需要溫度回退的片段改為逐一 transcribe）
+- 較長的音訊依序使用 transcribe 處理
+- stats 請求回傳佇列深度與處理統計
+- 模型執行緒異常停止或請求等待超過 --request-timeout 秒時，回覆錯誤給客戶端而不會一直等待
+
+啟動服務：
+    python whisper_server.py --model base --address /tmp/whisper_server.sock
+查詢狀態：
+    python whisper_server.py --address /tmp/whisper_server.sock --stats
+
+分析器端設定 --whisper-server /tmp/whisper_server.sock（或環境變數 WHISPER_SERVER）即可使用。
+
+請求以 multiprocessing.connection 傳送（pickle），能通過驗證的客戶端就能在服務上執行程式碼：
+- Unix socket（預設）建立時權限為 0600，只有同一使用者可以連線，可使用內建金鑰
+- TCP（host:port）必須以環境變數 WHISPER_SERVER_AUTHKEY 設定金鑰（服務與客戶端相同），
+  否則拒絕啟動；未指定主機（":9000"）時只監聽 127.0.0.1
+"""
+
+import os
+import time
+import queue
+import argparse
+import threading
+from multiprocessing.connection import Listener, Client
+
+from transcription_backends import BACKENDS, N_SAMPLES, SAMPLE_RATE, OpenAIWhisperBackend, create_backend
+
+DEFAULT_ADDRESS = "/tmp/whisper_server.sock"
+# 只用於 Unix socket（由檔案權限保護）；TCP 必須另外設定 WHISPER_SERVER_AUTHKEY
+DEFAULT_AUTHKEY = b"youtube-transcript"
+# 可以用批次 decode 處理的轉錄參數
+BATCHABLE_OPTIONS = {"language", "task", "verbose", "fp16"}
+# 等待轉錄結果時檢查模型執行緒是否仍在執行的間隔秒數
+WORKER_CHECK_SECONDS = 1.0
+# 時間戳 token 的間隔秒數（與 whisper.transcribe 相同）
+TIME_PRECISION = 0.02
+# whisper.transcribe 的預設門檻：超過時以較高的溫度重試，或視為無語音
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+
+def parse_address(address):
+    """將 "host:port" 轉為 TCP 位址（未指定主機時為 127.0.0.1），其餘視為 Unix socket 路徑"""
+    if ":" in address and not address.startswith("/"):
+        host, port = address.rsplit(":", 1)
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def split_timestamp_segments(tokens, timestamp_begin, duration):
+    """依時間戳 token 將一次解碼的 token 切成片段，回傳 [(起, 訖, tokens)]（切分方式與 whisper.transcribe 相同）"""
+    is_timestamp = [token >= timestamp_begin for token in tokens]
+    # 連續兩個時間戳是前一段的結束與下一段的開始
+    slices = [i + 1 for i in range(len(tokens) - 1) if is_timestamp[i] and is_timestamp[i + 1]]
+    segments = []
+    if slices:
+        if is_timestamp[-2:] == [False, True]:
+            slices.append(len(tokens))
+        last = 0
+        for current in slices:
+            sliced = tokens[last:current]
+            start = (sliced[0] - timestamp_begin) * TIME_PRECISION
+            end = (sliced[-1] - timestamp_begin) * TIME_PRECISION
+            segments.append((start, min(end, duration), sliced))
+            last = current
+        if last < len(tokens):
+            # whisper.transcribe 會從最後的時間戳重新解碼剩下的部分；單一片段沒有下一個視窗，
+            # 剩下的 token 直接延續到片段結尾
+            start = (tokens[last] - timestamp_begin) * TIME_PRECISION if is_timestamp[last] else segments[-1][1]
+            segments.append((min(start, duration), duration, tokens[last:]))
+        return segments
+    end = duration
+    timestamps = [token for token in tokens if token >= timestamp_begin]
+    if timestamps and timestamps[-1] != timestamp_begin:
+        end = min((timestamps[-1] - timestamp_begin) * TIME_PRECISION, duration)
+    return [(0.0, end, tokens)]
+
+
+def resolve_authkey(address, authkey=None):
+    """連線驗證金鑰：明確指定或 WHISPER_SERVER_AUTHKEY；都沒有時只有 Unix socket 可使用內建金鑰"""
+    if authkey:
+        return authkey
+    env_key = os.environ.get("WHISPER_SERVER_AUTHKEY")
+    if env_key:
+        return env_key.encode("utf-8")
+    if isinstance(address, tuple):
+        raise ValueError("TCP 位址需要以環境變數 WHISPER_SERVER_AUTHKEY 設定金鑰"
+                         "（請求以 pickle 傳送，公開的內建金鑰會讓任何連得到的人在服務上執行程式碼）")
+    return DEFAULT_AUTHKEY
+
+
+class WhisperServer:
+    def __init__(self, model_name="base", address=DEFAULT_ADDRESS, authkey=None,
+                 max_batch=8, batch_window=0.05, backend="openai-whisper", request_timeout=3600):
+        """初始化服務
+
+        authkey: 連線驗證金鑰（None 時見 resolve_authkey；TCP 位址必須設定）
+        backend: 轉錄引擎（見 transcription_backends.py）
+        max_batch: 一次批次 decode 的最大片段數
+        batch_window: 收到第一個請求後等待更多請求加入批次的秒數
+        request_timeout: 單一請求（含排隊）等待結果的秒數上限，None 表示不限制
+        """
+        self.model_name = model_name
+        self.backend = backend
+        self.address = parse_address(address)
+        self.authkey = resolve_authkey(self.address, authkey)
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.request_timeout = request_timeout
+        self.requests = queue.Queue()
+        self.model = None
+        self.worker = None
+        self.worker_error = None
+        self.started = time.time()
+        self.stats_lock = threading.Lock()
+        self.processed = 0
+        self.batches = 0
+        self.batched_items = 0
+        self.busy_seconds = 0.0
+
+    def load_model(self):
+        """載入 Whisper 模型"""
+        print(f"正在載入 Whisper 模型 {self.model_name}（引擎: {self.backend}）...")
+        self.model = create_backend(self.backend, self.model_name)
+        print("Whisper 模型載入完成")
+
+    def serve_forever(self):
+        """啟動服務並持續接受連線"""
+        self.load_model()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        self.worker = threading.Thread(target=self.run_model_worker, daemon=True)
+        self.worker.start()
+
+        # Unix socket 建立時即為 0600，其他使用者無法連線
+        unix = isinstance(self.address, str)
+        old_umask = os.umask(0o177) if unix else None
+        try:
+            listener = Listener(self.address, authkey=self.authkey)
+        finally:
+            if unix:
+                os.umask(old_umask)
+
+        with listener:
+            print(f"Whisper 服務已啟動: {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"連線失敗: {e}")
+                    continue
+                threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
+
+    def handle_client(self, conn):
+        """處理單一客戶端連線上的請求"""
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    break
+
+                op = request.get("op")
+                if op == "stats":
+                    conn.send({"ok": True, "stats": self.get_stats()})
+                elif op == "transcribe":
+                    conn.send(self.wait_transcribe(request))
+                else:
+                    conn.send({"ok": False, "error": f"未知的請求類型: {op}"})
+        finally:
+            conn.close()
+
+    def wait_transcribe(self, request):
+        """將轉錄請求排入佇列並等待結果；模型執行緒停止或逾時時回傳錯誤"""
+        job = {"request": request, "done": threading.Event(), "response": None,
+               "enqueued": time.time()}
+        self.requests.put(job)
+        deadline = job["enqueued"] + self.request_timeout if self.request_timeout else None
+        while not job["done"].wait(WORKER_CHECK_SECONDS):
+            if not self.worker.is_alive():
+                return {"ok": False, "error": f"模型執行緒已停止: {self.worker_error}"}
+            if deadline is not None and time.time() >= deadline:
+                return {"ok": False, "error": f"轉錄逾時（等待超過 {self.request_timeout} 秒）"}
+        return job["response"]
+
+    def get_stats(self):
+        """服務統計"""
+        with self.stats_lock:
+            return {
+                "model": self.model_name,
+                "backend": self.backend,
+                "queue_depth": self.requests.qsize(),
+                "processed": self.processed,
+                "batches": self.batches,
+                "avg_batch_size": self.batched_items / self.batches if self.batches else 0.0,
+                "busy_seconds": self.busy_seconds,
+                "worker_alive": self.worker is not None and self.worker.is_alive(),
+                "worker_error": self.worker_error,
+                "uptime": time.time() - self.started,
+            }
+
+    def collect_batch(self):
+        """取出一批請求：阻塞等待第一個，再於 batch_window 內收集更多"""
+        jobs = [self.requests.get()]
+        deadline = time.time() + self.batch_window
+        while len(jobs) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return jobs
+
+    def run_model_worker(self):
+        """執行模型執行緒，異常停止時記錄錯誤（等待中的請求會收到此錯誤）"""
+        try:
+            self.model_worker()
+        except BaseException as e:
+            self.worker_error = f"{type(e).__name__}: {e}"
+            print(f"模型執行緒異常停止: {self.worker_error}")
+
+    def model_worker(self):
+        """唯一使用模型的執行緒：依序處理每一批請求"""
+        # 只有 openai-whisper 引擎能直接以 whisper.decode 批次解碼
+        batchable = isinstance(self.model, OpenAIWhisperBackend)
+        while True:
+            jobs = self.collect_batch()
+            start = time.time()
+
+            # 短片段且參數相同的請求合併成一次批次 decode
+            groups = {}
+            singles = []
+            for job in jobs:
+                try:
+                    request = job["request"]
+                    audio = request["audio"]
+                    if isinstance(audio, str):
+                        # 以引擎自己的解碼器讀取（faster-whisper 不需要 openai-whisper）
+                        audio = self.model.load_audio(audio)
+                    job["audio"] = audio
+                    options = request.get("options") or {}
+                    short = len(audio) <= N_SAMPLES
+                    if batchable and short and set(options) <= BATCHABLE_OPTIONS:
+                        key = (options.get("language"), options.get("task", "transcribe"))
+                        groups.setdefault(key, []).append(job)
+                    else:
+                        singles.append(job)
+                except Exception as e:
+                    self.finish(job, {"ok": False, "error": str(e)})
+
+            for (language, task), group in groups.items():
+                if len(group) == 1:
+                    singles.extend(group)
+                    continue
+                try:
+                    results = self.decode_batch([job["audio"] for job in group], language, task)
+                    decoded = 0
+                    for job, result in zip(group, results):
+                        if result is None:
+                            # 需要以較高溫度重試的片段改為逐一轉錄（whisper.transcribe 的回退）
+                            singles.append(job)
+                            continue
+                        self.finish(job, {"ok": True, "result": result})
+                        decoded += 1
+                    with self.stats_lock:
+                        self.batches += 1
+                        self.batched_items += decoded
+                except Exception:
+                    # 批次失敗時改為逐一轉錄
+                    singles.extend(group)
+
+            for job in singles:
+                try:
+                    options = dict(job["request"].get("options") or {})
+                    if batchable:
+                        options.setdefault("verbose", None)
+                    result = self.model.transcribe(job["audio"], **options)
+                    self.finish(job, {"ok": True, "result": result})
+                except Exception as e:
+                    self.finish(job, {"ok": False, "error": str(e)})
+                with self.stats_lock:
+                    self.batches += 1
+                    self.batched_items += 1
+
+            with self.stats_lock:
+                self.busy_seconds += time.time() - start
+
+    def decode_batch(self, audios, language, task):
+        """將多個 30 秒內的片段合併為一個 mel 批次解碼（溫度 0）
+
+        回傳與 whisper.transcribe 相同格式的結果（依時間戳 token 分段）；
+        壓縮率或平均 log 機率超過門檻、需要以較高溫度重試的片段回傳 None，由呼叫端逐一轉錄。
+        """
+        import torch
+        import whisper
+        from whisper.tokenizer import get_tokenizer
+        model = self.model.model
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels)
+            for audio in audios
+        ]).to(model.device)
+        options = whisper.DecodingOptions(
+            language=language, task=task, fp16=model.device.type == "cuda"
+        )
+        decoded = whisper.decode(model, mels, options)
+        tokenizer_options = {"num_languages": model.num_languages} if hasattr(model, "num_languages") else {}
+        tokenizer = get_tokenizer(model.is_multilingual, **tokenizer_options)
+        results = []
+        for audio, result in zip(audios, decoded):
+            no_speech = result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD
+            if not no_speech and (result.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                                  or result.avg_logprob < LOGPROB_THRESHOLD):
+                results.append(None)
+                continue
+            segments = []
+            if not no_speech:
+                duration = len(audio) / SAMPLE_RATE
+                for start, end, tokens in split_timestamp_segments(list(result.tokens),
+                                                                   tokenizer.timestamp_begin, duration):
+                    text = tokenizer.decode([token for token in tokens if token < tokenizer.eot])
+                    if not text.strip():
+                        continue
+                    segments.append({
+                        "id": len(segments),
+                        "seek": 0,
+                        "start": start,
+                        "end": end,
+                        "text": text,
+                        "tokens": tokens,
+                        "temperature": 0.0,
+                        "avg_logprob": result.avg_logprob,
+                        "compression_ratio": result.compression_ratio,
+                        "no_speech_prob": result.no_speech_prob,
+                    })
+            results.append({
+                "text": "".join(segment["text"] for segment in segments),
+                "language": result.language,
+                "segments": segments,
+            })
+        return results
+
+    def finish(self, job, response):
+        """回覆請求並更新統計"""
+        job["response"] = response
+        with self.stats_lock:
+            self.processed += 1
+        job["done"].set()
+
+
+class RemoteWhisperModel:
+    """Whisper 服務的客戶端，提供與 whisper 模型相同的 transcribe 介面"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        self.address = parse_address(address)
+        self.authkey = resolve_authkey(self.address, authkey)
+
+    def request(self, payload):
+        """送出請求並等待回覆（每次請求各自連線，可安全地跨執行緒使用）"""
+        with Client(self.address, authkey=self.authkey) as conn:
+            conn.send(payload)
+            response = conn.recv()
+        if not response.get("ok"):
+            raise RuntimeError(f"Whisper 服務錯誤: {response.get('error')}")
+        return response
+
+    def transcribe(self, audio, **options):
+        """轉錄音訊（檔案路徑或 16 kHz float32 陣列）"""
+        return self.request({"op": "transcribe", "audio": audio, "options": options})["result"]
+
+    def stats(self):
+        """查詢服務統計（包含佇列深度）"""
+        return self.request({"op": "stats"})["stats"]
+
+
+def main():
+    """啟動服務或查詢狀態"""
+    parser = argparse.ArgumentParser(description="Whisper 模型服務")
+    parser.add_argument("--model", default="base", help="Whisper 模型名稱（預設 base）")
+    parser.add_argument("--address", default=os.environ.get("WHISPER_SERVER", DEFAULT_ADDRESS),
+                        help="Unix socket 路徑或 host:port（TCP 需設定 WHISPER_SERVER_AUTHKEY）")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="openai-whisper",
+                        help="轉錄引擎（預設 openai-whisper；faster-whisper 不支援批次 decode）")
+    parser.add_argument("--max-batch", type=int, default=8, help="批次 decode 的最大片段數")
+    parser.add_argument("--batch-window", type=float, default=0.05, help="收集批次的等待秒數")
+    parser.add_argument("--request-timeout", type=float, default=3600,
+                        help="單一請求（含排隊）等待結果的秒數上限（預設 3600，0 表示不限制）")
+    parser.add_argument("--stats", action="store_true", help="查詢執行中服務的狀態")
+    args = parser.parse_args()
+
+    try:
+        if args.stats:
+            stats = RemoteWhisperModel(args.address).stats()
+            for key, value in stats.items():
+                print(f"{key}: {value}")
+            return
+
+        server = WhisperServer(args.model, args.address, max_batch=args.max_batch,
+                               batch_window=args.batch_window, backend=args.backend,
+                               request_timeout=args.request_timeout or None)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nWhisper 服務已停止")
+
+
+if __name__ == "__main__":
+    main()
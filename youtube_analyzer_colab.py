@@ -23,9 +23,25 @@ import whisper
 import torch
 from langchain_community.llms import Ollama
 import tempfile
+import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
+# 語言檢測用的文字系統查表（碼位 -> 1 拉丁、2 漢字、3 假名、4 諺文）
+SCRIPT_TABLE = np.zeros(0x10000, dtype=np.uint8)
+for script, ranges in enumerate([
+    [(0x41, 0x5A), (0x61, 0x7A), (0xC0, 0x24F)],
+    [(0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF)],
+    [(0x3040, 0x30FF), (0x31F0, 0x31FF)],
+    [(0x1100, 0x11FF), (0x3130, 0x318F), (0xAC00, 0xD7AF)],
+], 1):
+    for start, end in ranges:
+        SCRIPT_TABLE[start:end + 1] = script
+
+# 翻譯時使用的語言名稱
+LANGUAGE_NAMES = {"en": "英文", "ja": "日文", "ko": "韓文", "fr": "法文", "de": "德文", "es": "西班牙文"}
+
+
 class YouTubeTranscriptAnalyzer:
     def __init__(self):
         """初始化分析器"""
@@ -118,24 +134,31 @@ class YouTubeTranscriptAnalyzer:
             print(f"逐字稿提取失敗: {e}")
             return None, None
     
-    def detect_language(self, text):
-        """檢測文本語言"""
-        # 簡單的中英文檢測
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
-        english_chars = len(re.findall(r'[a-zA-Z]', text))
+    def detect_language(self, text, sample_chars=262144):
+        """檢測文本語言（zh / en / ja / ko）
+
+        以 UTF-32 碼位陣列查表計數，一次掃描且不為每個字元建立字串；長文只取樣。
+        """
+        if len(text) > sample_chars:
+            step = len(text) // 16
+            text = "".join(text[i * step:i * step + sample_chars // 16] for i in range(16))
+        codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype="<u4")
+        latin, han, kana, hangul = np.bincount(SCRIPT_TABLE[codes[codes < 0x10000]], minlength=5)[1:]
         
-        if chinese_chars > english_chars:
-            return "zh"
-        else:
-            return "en"
+        if hangul > max(latin, han + kana):
+            return "ko"
+        if han + kana > latin:
+            # 日文的漢字常多於假名，有一定比例的假名就是日文
+            return "ja" if kana > 0.1 * (han + kana) else "zh"
+        return "en"
     
     def process_transcript_with_llm(self, transcript, language):
         """使用 LLM 處理逐字稿"""
         print(f"正在使用 LLM 處理逐字稿（語言: {language}）...")
         
-        if language == "en":
-            # 英文逐字稿翻譯成中文
-            prompt = f"""請將以下英文逐字稿翻譯成繁體中文，保持原意並使用自然的中文表達：
+        if language != "zh":
+            # 外語逐字稿翻譯成中文
+            prompt = f"""請將以下{LANGUAGE_NAMES.get(language, "外語")}逐字稿翻譯成繁體中文，保持原意並使用自然的中文表達：
 
 {transcript}
 
@@ -222,7 +245,7 @@ class YouTubeTranscriptAnalyzer:
             processed_transcript = self.process_transcript_with_llm(transcript, language)
             
             print("\n" + "="*50)
-            if language == "en":
+            if language != "zh":
                 print("翻譯結果:")
             else:
                 print("加標點符號後的結果:")
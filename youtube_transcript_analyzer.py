@@ -9,39 +9,330 @@ YouTube 逐字稿分析器 - 更新版
 4. 生成摘要
 """
 
+import time
+_IMPORT_START = time.perf_counter()
+
 import os
 import re
-import yt_dlp
-import whisper
-import torch
-from langchain_community.llms import Ollama
+from transcript_cache import TranscriptCache
+from llm_cache import make_cache_key, MemoryLRUCache, SQLiteResponseCache, TieredCache
+from whisper_server import RemoteWhisperModel
+from transcription_backends import BACKENDS, create_backend
+from transcript_store import SegmentStore, format_timestamp
+from token_stream import OrderedTokenWriter
+from stage_scheduler import StageScheduler, StageTrace, write_chrome_trace
+from metrics import Metrics, JsonLogSink, start_metrics_server
+from language_detect import detect_script_language, language_name, needs_translation
+from job_store import JobStore
+from output_writers import OutputWriter, OUTPUT_FORMATS, segment_records
+import sys
 import tempfile
+import copy
+import json
+import queue
+import shutil
+import subprocess
+import argparse
+import bisect
+import threading
+import urllib.request
+import xml.etree.ElementTree as ET
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
+# yt_dlp、whisper、torch、langchain 匯入較慢，改在第一次使用時才匯入
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
+# 分片轉錄工作行程中的轉錄引擎（每個行程一份）
+_SHARD_MODEL = None
+
+
+def _init_shard_worker(backend, model_name, threads):
+    """分片轉錄工作行程初始化：限制 torch 執行緒數並載入模型"""
+    global _SHARD_MODEL
+    if backend == "openai-whisper":
+        import torch
+        torch.set_num_threads(threads)
+        _SHARD_MODEL = create_backend(backend, model_name)
+    else:
+        _SHARD_MODEL = create_backend(backend, model_name, cpu_threads=threads)
+
+
+def _detect_shard_language(audio):
+    """在工作行程中檢測語言（分片前先統一語言，各分片不必各自檢測）"""
+    return _SHARD_MODEL.detect_language(audio)
+
+
+def _transcribe_shard(npy_path, start, end, options):
+    """在工作行程中轉錄一個分片（從記憶體映射的 .npy 讀取）"""
+    audio = np.array(np.load(npy_path, mmap_mode="r")[start:end], dtype=np.float32)
+    result = _SHARD_MODEL.transcribe(audio, **options)
+    return {
+        'language': result.get("language"),
+        'segments': [
+            {'start': seg['start'], 'end': seg['end'], 'text': seg['text'],
+             'avg_logprob': seg.get('avg_logprob'), 'no_speech_prob': seg.get('no_speech_prob')}
+            for seg in result.get("segments", [])
+        ],
+    }
+
+
 class YouTubeTranscriptAnalyzer:
-    def __init__(self):
-        """初始化分析器"""
-        self.whisper_model = None
-        self.llm = None
-        self.setup_models()
-    
-    def setup_models(self):
-        """設置模型"""
-        print("正在載入 Whisper 模型...")
-        # 載入 Whisper 模型
-        self.whisper_model = whisper.load_model("base")
-        
+    # 句子結尾（含結尾標點後的空白）
+    SENTENCE_PATTERN = re.compile(r'.+?(?:[.!?。！？;；]+\s*|\n+|$)', re.S)
+    # 句子過長時改以逗號或空白切分
+    PHRASE_PATTERN = re.compile(r'.+?(?:[,，、]\s*|\s+|$)', re.S)
+    # YouTube URL，第 6 個群組為 11 字元的影片 ID
+    YOUTUBE_REGEX = re.compile(
+        r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
+        r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
+    )
+    # Whisper 使用的取樣率
+    SAMPLE_RATE = 16000
+    # Whisper 最可能語言的機率達到此值時直接採用，不再以文字判斷
+    LANGUAGE_CONFIDENCE = 0.6
+    # 分層摘要無法收斂時，截斷後每個部分摘要至少保留的 token 數
+    MIN_PARTIAL_TOKENS = 20
+    # LLM 連接失敗後重新嘗試的間隔（秒），每次失敗加倍，最多 LLM_RETRY_MAX_SECONDS
+    LLM_RETRY_SECONDS = 5
+    LLM_RETRY_MAX_SECONDS = 300
+    # 中日韓字元（粗估時每字約 1 token）
+    CJK_PATTERN = re.compile(r'[^\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+
+    def __init__(self, chunk_tokens=1500, chunk_overlap=100, llm_workers=4,
+                 summary_mode="auto", whisper_model_name="base", use_cache=True,
+                 cache_dir=None, cache_max_bytes=500 * 1024 * 1024,
+                 llm_model_name="gemma:7b", llm_cache=None, whisper_server=None,
+                 llm_base_url=None, warmup=False, streaming=False, stream_window=30,
+                 caption_mode="off", caption_min_coverage=0.5, memmap_seconds=1800,
+                 vad=False, shards=1, shard_threads=None, shard_min_seconds=120,
+                 backend="openai-whisper", llm_client="langchain", llm_timeout=300, llm_retries=3,
+                 stream_llm=False, output_file=None, trace_file=None, metrics=None, language=None,
+                 resume=True, job_dir=None, output_dir=None, output_formats=OUTPUT_FORMATS):
+        """初始化分析器
+
+        chunk_tokens: 每段送給 LLM 的逐字稿 token 上限
+        chunk_overlap: 每段附帶的前文 token 數（僅供參考，不翻譯）
+        llm_workers: 同時送出的 LLM 請求數
+        summary_mode: 摘要模式（auto / single / hierarchical）
+        whisper_model_name: Whisper 模型名稱
+        use_cache: 是否使用逐字稿快取（命中時跳過下載與轉錄）
+        cache_dir / cache_max_bytes: 快取目錄與大小上限
+        llm_model_name: Ollama 模型名稱
+        llm_cache: LLM 回應快取（具 get/set 的物件）；None 時依 use_cache
+            使用記憶體 LRU + SQLite，False 表示不快取
+        whisper_server: Whisper 模型服務位址（Unix socket 路徑或 host:port），
+            設定後不在本行程載入模型，改由服務轉錄
+        llm_base_url: Ollama 服務位址（預設讀取 OLLAMA_HOST 或 http://localhost:11434）
+        warmup: 是否在初始化時就載入 Whisper 並連接 LLM（預設第一次使用時才載入）
+        streaming: 邊下載邊轉錄（不等待整個音訊下載完成）
+        stream_window: 串流轉錄每個視窗的秒數
+        caption_mode: 字幕優先模式：off 一律使用 Whisper、manual 使用人工字幕、
+            auto 人工字幕不存在時也使用自動字幕；字幕不可用時才使用 Whisper
+        caption_min_coverage: 字幕涵蓋影片長度的最低比例，低於此值視為品質不足
+        memmap_seconds: 解碼後的音訊超過此秒數時改用記憶體映射檔（0 表示停用）
+        vad: 轉錄前先偵測語音區段，只把有聲音的部分送入 Whisper
+        shards: 長音訊在靜音處切成幾個分片，以多個行程並行轉錄（1 表示不分片）
+        shard_threads: 每個分片行程的 torch 執行緒數（預設 CPU 核心數 / shards）
+        shard_min_seconds: 每個分片的最短秒數，音訊較短時自動減少分片數
+        backend: 轉錄引擎（openai-whisper / faster-whisper，見 transcription_backends.py）
+        llm_client: LLM 客戶端：langchain 使用 langchain 的同步 Ollama；async 使用
+            ollama_client.py 的非同步客戶端（共用連線池，llm_workers 為全域並行上限）
+        llm_timeout / llm_retries: 非同步客戶端每個請求的逾時秒數與重試次數
+        stream_llm: 單一影片模式中，翻譯與摘要的 token 一產生就寫到終端機與輸出檔
+        output_file: 處理後的逐字稿與摘要的輸出檔
+        trace_file: 將每部影片各階段的時間軸寫成 Chrome trace JSON
+        metrics: 記錄各階段 span 的 Metrics（見 metrics.py），None 時只在記憶體中累計
+        language: 指定逐字稿語言（如 en、zh），Whisper 不再檢測語言，也不再以文字判斷
+        resume: 每部影片保存各階段的檢查點（見 job_store.py），中斷後重新執行時從上次完成處繼續
+            （完成的工作目錄會刪除；失敗或未完成的與逐字稿快取共用 cache_max_bytes 上限，保留 7 天）
+        job_dir: 檢查點目錄（預設為快取目錄下的 jobs）
+        output_dir: 每部影片的字幕（SRT/WebVTT）、Markdown 與 results.jsonl 的輸出目錄（見 output_writers.py）
+        output_formats: 要輸出的格式（srt / vtt / md / jsonl）
+        """
+        init_start = time.perf_counter()
+        self.startup_timings = {'模組匯入': _IMPORT_SECONDS}
+        self._whisper_model = None
+        self._llm = None
+        self._llm_checked = False
+        self._llm_lock = threading.Lock()
+        # 連接失敗的次數與下次可重新連接的時間
+        self._llm_failures = 0
+        self._llm_retry_at = 0.0
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        self.llm_workers = llm_workers
+        self.summary_mode = summary_mode
+        self.summary_timings = []
+        self.whisper_model_name = whisper_model_name
+        self.backend = backend
+        # Whisper 解碼參數，同時作為快取鍵的一部分
+        self.language = language
+        self.transcribe_options = {'language': language, 'task': 'transcribe'}
+        self.cache_max_bytes = cache_max_bytes
+        self.transcript_cache = TranscriptCache(cache_dir, max_bytes=cache_max_bytes) if use_cache else None
+        self.llm_model_name = llm_model_name
+        if llm_cache is None and use_cache:
+            llm_cache = TieredCache(MemoryLRUCache(), SQLiteResponseCache(cache_dir))
+        self.llm_cache = llm_cache or None
+        self.whisper_server = whisper_server
+        base_url = llm_base_url or os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+        if not base_url.startswith(("http://", "https://")):
+            base_url = f"http://{base_url}"
+        self.llm_base_url = base_url.rstrip("/")
+        self.llm_client = llm_client
+        self.llm_timeout = llm_timeout
+        self.llm_retries = llm_retries
+        self.stream_llm = stream_llm
+        self.output_file = output_file
+        # 串流輸出的目的地（run() 執行期間設定）與每次串流呼叫的統計
+        self._stream_sinks = None
+        self.llm_stream_stats = []
+        self.trace_file = trace_file
+        self.traces = []
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.jobs = None
+        if resume:
+            self.jobs = JobStore(job_dir or (os.path.join(cache_dir, "jobs") if cache_dir else None),
+                                 max_bytes=cache_max_bytes)
+        self.outputs = OutputWriter(output_dir, output_formats) if output_dir else None
+        self.streaming = streaming
+        self.stream_window = stream_window
+        self.caption_mode = caption_mode
+        self.caption_min_coverage = caption_min_coverage
+        self.memmap_seconds = memmap_seconds
+        self.vad = vad
+        self.shards = shards
+        self.shard_threads = shard_threads or max(1, (os.cpu_count() or 1) // max(shards, 1))
+        self.shard_min_seconds = shard_min_seconds
+        self._shard_pool = None
+        # 每個執行緒各自的 YoutubeDL session，以及每部影片的網路解析次數
+        self._ydl_local = threading.local()
+        self._extraction_lock = threading.Lock()
+        self.extraction_counts = {}
+        self.startup_timings['初始化分析器'] = time.perf_counter() - init_start
+        if warmup:
+            self.setup_models()
+
+    @property
+    def whisper_model(self):
+        """Whisper 模型（第一次使用時才載入）"""
+        if self._whisper_model is None:
+            if self.whisper_server:
+                # 使用共用的 Whisper 模型服務
+                print(f"使用 Whisper 模型服務: {self.whisper_server}")
+                self._whisper_model = RemoteWhisperModel(self.whisper_server)
+            else:
+                self._whisper_model = self.create_whisper_model()
+        return self._whisper_model
+
+    @whisper_model.setter
+    def whisper_model(self, model):
+        self._whisper_model = model
+
+    @property
+    def llm(self):
+        """Ollama LLM（第一次使用時才連接，連接失敗時為 None）
+
+        批次模式與 API 服務的多個工作者可能同時第一次使用，
+        連接完成前其他執行緒會等待，而不是看到尚未連接的 None。
+        連接失敗後以指數退避的間隔重新嘗試，Ollama 晚於服務啟動或重新啟動時仍可恢復
+        """
+        if self._llm is None and not self._llm_checked and time.time() >= self._llm_retry_at:
+            with self._llm_lock:
+                if self._llm is None and not self._llm_checked and time.time() >= self._llm_retry_at:
+                    if self.connect_llm() is None:
+                        self._llm_failures += 1
+                        delay = min(self.LLM_RETRY_SECONDS * 2 ** (self._llm_failures - 1),
+                                    self.LLM_RETRY_MAX_SECONDS)
+                        self._llm_retry_at = time.time() + delay
+                        print(f"將於 {delay} 秒後再嘗試連接 LLM")
+                    else:
+                        self._llm_failures = 0
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+        self._llm_checked = True
+
+    def record_startup(self, name, start):
+        """記錄一個啟動步驟的耗時"""
+        self.startup_timings[name] = self.startup_timings.get(name, 0.0) + time.perf_counter() - start
+
+    def create_whisper_model(self):
+        """建立一份轉錄引擎（含匯入 whisper/torch 與載入模型）"""
+        print(f"正在載入 Whisper 模型 {self.whisper_model_name}（引擎: {self.backend}）...")
+        start = time.perf_counter()
+        model = create_backend(self.backend, self.whisper_model_name)
+        self.record_startup('載入 Whisper 模型', start)
+        return model
+
+    @property
+    def transcriber_name(self):
+        """快取鍵中的模型名稱；非預設引擎時附上引擎名稱"""
+        if self.backend == "openai-whisper":
+            return self.whisper_model_name
+        return f"{self.whisper_model_name}@{self.backend}"
+
+    def check_llm_health(self, timeout=3):
+        """不產生文字的健康檢查：查詢 /api/tags 確認服務運行且模型已下載"""
+        try:
+            with urllib.request.urlopen(f"{self.llm_base_url}/api/tags", timeout=timeout) as response:
+                tags = json.loads(response.read().decode("utf-8"))
+        except Exception as e:
+            print(f"無法連接 Ollama 服務 ({self.llm_base_url}): {e}")
+            return False
+
+        names = {model.get("name") for model in tags.get("models", [])}
+        wanted = self.llm_model_name if ":" in self.llm_model_name else f"{self.llm_model_name}:latest"
+        if wanted not in names:
+            print(f"Ollama 尚未下載模型 {self.llm_model_name}，請執行: ollama pull {self.llm_model_name}")
+            return False
+        return True
+
+    def connect_llm(self):
+        """連接 Ollama LLM"""
         print("正在連接 LLM...")
-        # 連接 Ollama LLM
+        start = time.perf_counter()
+        healthy = self.check_llm_health()
+        self.record_startup('Ollama 健康檢查', start)
+        if not healthy:
+            print(f"LLM 連接失敗，請確保 Ollama 已安裝並運行 {self.llm_model_name} 模型")
+            return None
+
         try:
-            self.llm = Ollama(model="gemma:7b")
-            # 測試連接
-            test_response = self.llm.invoke("Hello")
+            start = time.perf_counter()
+            if self.llm_client == "async":
+                from ollama_client import OllamaLLM
+                self._llm = OllamaLLM(self.llm_model_name, self.llm_base_url, max_concurrency=self.llm_workers,
+                                      timeout=self.llm_timeout, retries=self.llm_retries)
+                self.record_startup('建立非同步 Ollama 客戶端', start)
+            else:
+                from langchain_community.llms import Ollama
+                self._llm = Ollama(model=self.llm_model_name, base_url=self.llm_base_url)
+                self.record_startup('匯入 langchain', start)
             print("LLM 連接成功！")
         except Exception as e:
             print(f"LLM 連接失敗: {e}")
-            print("請確保 Ollama 已安裝並運行 gemma:7b 模型")
+        return self._llm
+
+    def setup_models(self):
+        """預先載入 Whisper 模型並連接 LLM（--warmup）"""
+        self.whisper_model
+        self.llm
+        self.print_startup_report()
+
+    def print_startup_report(self):
+        """印出啟動時間分析"""
+        print("\n=== 啟動時間分析 ===")
+        for name, seconds in self.startup_timings.items():
+            print(f"  {name}: {seconds:.2f} 秒")
+        print(f"  合計: {sum(self.startup_timings.values()):.2f} 秒")
 
     def get_youtube_url(self):
         """詢問使用者輸入 YouTube URL"""
@@ -54,11 +345,272 @@ class YouTubeTranscriptAnalyzer:
     
     def validate_youtube_url(self, url):
         """驗證 YouTube URL"""
-        youtube_regex = re.compile(
-            r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
-            r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
-        )
-        return youtube_regex.match(url) is not None
+        return self.YOUTUBE_REGEX.match(url) is not None
+
+    def extract_video_id(self, url):
+        """從 URL 取出 11 字元的影片 ID，無法辨識時回傳 None"""
+        match = self.YOUTUBE_REGEX.match(url)
+        return match.group(6) if match else None
+
+    def get_transcript(self, url, job=None):
+        """取得逐字稿結果 {'text', 'language', 'segments'}
+
+        先查詢快取，命中時跳過下載與轉錄；否則下載音訊並轉錄後寫入快取。
+        job: 工作檢查點，已有逐字稿或音訊時直接沿用；下載的音訊保存到
+        工作目錄，逐字稿保存後才刪除
+        """
+        video_id = self.extract_video_id(url)
+        cached = self.get_cached_transcript(video_id)
+        if cached:
+            return cached
+        saved = self.load_checkpoint_transcript(job)
+        if saved:
+            print("從檢查點讀取逐字稿，跳過下載與轉錄")
+            return saved
+
+        # 字幕優先：有可用字幕時完全跳過下載與轉錄
+        result, formats = self.get_caption_transcript(url)
+        if result:
+            return result
+
+        if self.streaming:
+            result = self.transcribe_stream(url, formats=formats)
+            self.store_transcript(video_id, result)
+            if job is not None and result:
+                self.save_checkpoint_transcript(job, result)
+            return result
+
+        audio_file = job.audio_file() if job is not None else None
+        if audio_file:
+            print(f"使用檢查點中已下載的音訊: {audio_file}")
+        else:
+            # 下載音訊
+            audio_file = self.download_audio(url, formats=formats)
+            if not audio_file:
+                print("音訊下載失敗")
+                return None
+            if job is not None:
+                audio_file = job.save_audio(audio_file)
+
+        try:
+            # 提取逐字稿
+            result = self.transcribe_audio(audio_file)
+        finally:
+            # 清理暫存檔案（檢查點中的音訊保留到逐字稿保存後）
+            if job is None:
+                self.cleanup_temp_files(audio_file)
+
+        if job is not None and result:
+            self.save_checkpoint_transcript(job, result)
+        self.store_transcript(video_id, result)
+        return result
+
+    def load_checkpoint_transcript(self, job, language=None):
+        """檢查點中轉錄設定相同的逐字稿；--no-cache 時不沿用（重新轉錄）"""
+        if job is None or self.transcript_cache is None:
+            return None
+        return job.load_transcript(self.transcriber_name, self.cache_options(language))
+
+    def save_checkpoint_transcript(self, job, result, language=None):
+        """保存逐字稿與其轉錄設定，並刪除已不需要的音訊"""
+        job.save_transcript(result, self.transcriber_name, self.cache_options(language))
+        job.discard_audio()
+
+    def checkpoint_key(self, prompt):
+        """檢查點中 LLM 輸出的鍵（與 LLM 快取鍵相同：模型、prompt 與生成參數）"""
+        return make_cache_key(self.llm_model_name, prompt, self.llm_params())
+
+    def open_job(self, url):
+        """開啟影片的工作檢查點（停用續跑或無法建立時為 None）"""
+        if self.jobs is None:
+            return None
+        try:
+            # 未完成的工作目錄與逐字稿快取共用 --cache-max-mb 的上限
+            budget = self.cache_max_bytes
+            if budget is not None and self.transcript_cache is not None:
+                budget = max(0, budget - self.transcript_cache.stats()["bytes"])
+            return self.jobs.job(self.extract_video_id(url), url, max_bytes=budget)
+        except Exception as e:
+            print(f"無法建立工作檢查點: {e}")
+            return None
+
+    def transcription_options(self, language=None):
+        """Whisper 的解碼參數；language 為單一工作指定的語言（API 工作的 language），優先於 --language"""
+        options = dict(self.transcribe_options)
+        if language:
+            options['language'] = language
+        return options
+
+    def cache_options(self, language=None):
+        """逐字稿快取鍵中的轉錄參數（解碼參數加上會影響結果的前處理設定）"""
+        options = self.transcription_options(language)
+        if self.vad:
+            options['vad'] = True
+        return options
+
+    def get_cached_transcript(self, video_id, language=None):
+        """查詢逐字稿快取（字幕優先模式會先查字幕快取），未命中時回傳 None"""
+        if not self.transcript_cache or not video_id:
+            return None
+        keys = [(self.transcriber_name, self.cache_options(language))]
+        if self.caption_mode != "off":
+            keys.insert(0, (f"captions-{self.caption_mode}", {}))
+        for model, options in keys:
+            cached = self.transcript_cache.get(video_id, model, options)
+            if cached:
+                print(f"使用快取的逐字稿（影片 ID: {video_id}，模型: {model}）")
+                return SegmentStore.from_result(cached)
+        return None
+
+    def store_transcript(self, video_id, result, language=None):
+        """將轉錄結果寫入快取"""
+        if result and self.transcript_cache and video_id:
+            if result.source == "captions":
+                self.transcript_cache.put(video_id, f"captions-{self.caption_mode}", {}, result.to_columns())
+            else:
+                self.transcript_cache.put(video_id, self.transcriber_name, self.cache_options(language),
+                                          result.to_columns())
+
+    def get_caption_transcript(self, url):
+        """字幕優先模式：取得並解析 YouTube 字幕
+
+        回傳 (逐字稿結果或 None, (audio_formats, info))；
+        格式資訊會交給後續的下載步驟，避免重複解析影片頁面。
+        """
+        if self.caption_mode == "off":
+            return None, None
+        formats = self.get_available_formats(url)
+        info = formats[1]
+        if not info:
+            return None, formats
+
+        try:
+            result = self.fetch_captions(info)
+        except Exception as e:
+            print(f"字幕取得失敗: {e}")
+            result = None
+        if result:
+            self.store_transcript(self.extract_video_id(url), result)
+            return result, formats
+        print("沒有可用的字幕，改用 Whisper 轉錄")
+        return None, formats
+
+    def select_caption_track(self, info):
+        """選擇字幕軌：人工字幕優先，自動字幕只使用原始語言（不使用機器翻譯的字幕）
+
+        回傳 (語言代碼, 字幕格式清單, 是否為自動字幕)
+        """
+        video_language = (info.get('language') or '').split('-')[0]
+        preferred = [video_language, 'zh', 'en']
+
+        def pick(tracks):
+            if not tracks:
+                return None
+            for prefix in preferred:
+                if not prefix:
+                    continue
+                for code in tracks:
+                    if code.split('-')[0] == prefix:
+                        return code
+            return next(iter(tracks))
+
+        manual = {code: tracks for code, tracks in (info.get('subtitles') or {}).items()
+                  if code != 'live_chat'}
+        code = pick(manual)
+        if code:
+            return code, manual[code], False
+
+        if self.caption_mode == "auto":
+            automatic = info.get('automatic_captions') or {}
+            originals = {code: tracks for code, tracks in automatic.items() if code.endswith('-orig')}
+            if not originals and video_language:
+                originals = {code: tracks for code, tracks in automatic.items() if code == video_language}
+            code = pick(originals)
+            if code:
+                return code, originals[code], True
+        return None, None, False
+
+    def fetch_captions(self, info):
+        """下載並解析字幕（json3 > srv3 > vtt），通過品質門檻時回傳逐字稿結果"""
+        code, tracks, automatic = self.select_caption_track(info)
+        if not code:
+            return None
+
+        by_ext = {track.get('ext'): track for track in tracks if track.get('url')}
+        for ext, parser in (('json3', self.parse_json3_captions),
+                            ('srv3', self.parse_srv3_captions),
+                            ('vtt', self.parse_vtt_captions)):
+            if ext in by_ext:
+                break
+        else:
+            return None
+
+        kind = "自動字幕" if automatic else "人工字幕"
+        print(f"正在下載{kind}（語言: {code}，格式: {ext}）...")
+        content = self.get_ydl_session().urlopen(by_ext[ext]['url']).read().decode('utf-8')
+        segments = [seg for seg in parser(content) if seg['text'].strip()]
+
+        # 品質門檻：字幕需涵蓋足夠比例的影片長度
+        duration = info.get('duration') or 0
+        covered = sum(seg['end'] - seg['start'] for seg in segments)
+        coverage = covered / duration if duration else (1.0 if segments else 0.0)
+        if not segments or coverage < self.caption_min_coverage:
+            print(f"字幕品質不足（涵蓋率 {coverage:.0%}，門檻 {self.caption_min_coverage:.0%}）")
+            return None
+
+        language = code.split('-')[0]
+        separator = "" if language in ('zh', 'ja', 'ko') else " "
+        store = SegmentStore(language, "captions", separator)
+        for seg in segments:
+            store.append(seg['start'], seg['end'], seg['text'].strip())
+        print(f"使用{kind}作為逐字稿（涵蓋率 {coverage:.0%}，{len(store.text)} 個字符）")
+        return store
+
+    def parse_json3_captions(self, content):
+        """解析 YouTube json3 字幕"""
+        segments = []
+        for event in json.loads(content).get('events', []):
+            if 'segs' not in event:
+                continue
+            text = "".join(seg.get('utf8', '') for seg in event['segs']).replace("\n", " ").strip()
+            if not text:
+                continue
+            start = event.get('tStartMs', 0) / 1000
+            segments.append({'start': start, 'end': start + event.get('dDurationMs', 0) / 1000, 'text': text})
+        return segments
+
+    def parse_srv3_captions(self, content):
+        """解析 YouTube srv3（timedtext XML）字幕"""
+        segments = []
+        for p in ET.fromstring(content).iter('p'):
+            text = " ".join("".join(p.itertext()).split())
+            if not text:
+                continue
+            start = int(p.get('t', 0)) / 1000
+            segments.append({'start': start, 'end': start + int(p.get('d', 0)) / 1000, 'text': text})
+        return segments
+
+    def parse_vtt_captions(self, content):
+        """解析 WebVTT 字幕；自動字幕的捲動重複行只保留第一次出現"""
+        def to_seconds(stamp):
+            parts = stamp.replace(',', '.').split(':')
+            return sum(float(part) * 60 ** i for i, part in enumerate(reversed(parts)))
+
+        segments = []
+        previous_lines = set()
+        for block in re.split(r'\n\s*\n', content.replace('\r\n', '\n')):
+            lines = block.strip().split('\n')
+            timing = next((i for i, line in enumerate(lines) if '-->' in line), None)
+            if timing is None:
+                continue
+            start, end = [part.strip().split(' ')[0] for part in lines[timing].split('-->')]
+            cue_lines = [re.sub(r'<[^>]+>', '', line).strip() for line in lines[timing + 1:]]
+            cue_lines = [line for line in cue_lines if line]
+            new_lines = [line for line in cue_lines if line not in previous_lines]
+            previous_lines = set(cue_lines)
+            if new_lines:
+                segments.append({'start': to_seconds(start), 'end': to_seconds(end), 'text': " ".join(new_lines)})
+        return segments
     
     def run(self):
         """主執行方法"""
@@ -73,40 +625,65 @@ class YouTubeTranscriptAnalyzer:
         try:
             # 獲取 YouTube URL
             url = self.get_youtube_url()
+            trace = StageTrace(pid=1, name=url)
+            self.traces.append(trace)
+            job = self.open_job(url)
             
-            # 下載音訊
-            audio_file = self.download_audio(url)
-            if not audio_file:
-                print("音訊下載失敗，程式結束")
-                return
-            
-            # 提取逐字稿
-            transcript = self.extract_transcript(audio_file)
-            if not transcript:
+            # 取得逐字稿（快取或檢查點命中時跳過下載與轉錄）
+            with trace.span("取得逐字稿", category="transcript"):
+                result = self.get_transcript(url, job=job)
+            if not result:
                 print("逐字稿提取失敗，程式結束")
                 return
+            transcript = result.text
             
             print("\n=== 原始逐字稿 ===")
             print(transcript[:500] + "..." if len(transcript) > 500 else transcript)
             
             # 語言檢測
-            is_english = self.detect_language(transcript)
-            
-            # 處理逐字稿
-            processed_transcript = self.process_transcript_with_llm(transcript, is_english)
-            
-            print("\n=== 處理後的逐字稿 ===")
-            print(processed_transcript[:500] + "..." if len(processed_transcript) > 500 else processed_transcript)
-            
-            # 生成摘要
-            summary = self.generate_summary(processed_transcript)
-            
-            print("\n=== 摘要 ===")
-            print(summary)
-            
-            # 清理暫存檔案
-            self.cleanup_temp_files(audio_file)
+            language = self.detect_language(transcript, result.language, result.language_probs)
             
+            output = open(self.output_file, "w", encoding="utf-8") if self.output_file else None
+            # LLM 未連接時沒有 token 可以串流，改為一般輸出
+            streaming = self.stream_llm and self.llm is not None
+            try:
+                if streaming:
+                    # 串流模式：token 一產生就寫到終端機與輸出檔
+                    self._stream_sinks = [sys.stdout] + ([output] if output else [])
+                    self.write_heading("處理後的逐字稿", output)
+
+                # 處理逐字稿與生成摘要（各段處理完成就開始該段的摘要，每段保留對應的影片時間）
+                processed_transcript, summary = self.process_and_summarize(
+                    result, language, trace=trace,
+                    on_summary_start=(lambda: self.write_heading("摘要", output)) if streaming else None,
+                    job=job,
+                )
+
+                if not streaming:
+                    print("\n=== 處理後的逐字稿 ===")
+                    self.print_outline(processed_transcript)
+                    if output:
+                        output.write("=== 處理後的逐字稿 ===\n")
+                        output.write(processed_transcript.text + "\n")
+
+                    print("\n=== 摘要 ===")
+                    print(summary)
+                    if output:
+                        output.write("\n=== 摘要 ===\n")
+                        output.write(summary + "\n")
+                if self.outputs is not None:
+                    self.outputs.write_video(url, result, processed_transcript, summary, language,
+                                             self.extract_video_id(url))
+            finally:
+                self._stream_sinks = None
+                if output:
+                    output.close()
+                    print(f"\n結果已寫入: {self.output_file}")
+
+            if job is not None and job.stage("summary"):
+                job.finish()
+            self.print_stream_stats()
+            self.write_trace()
             print("\n分析完成！")
             
         except KeyboardInterrupt:
@@ -116,112 +693,1452 @@ class YouTubeTranscriptAnalyzer:
         finally:
             print("清理資源...")
     
+    def write_trace(self):
+        """將各影片的階段時間軸寫成 Chrome trace JSON（--trace）"""
+        if not self.trace_file or not self.traces:
+            return
+        try:
+            write_chrome_trace(self.trace_file, self.traces)
+            print(f"階段時間軸已寫入: {self.trace_file}（可用 chrome://tracing 或 ui.perfetto.dev 開啟）")
+        except Exception as e:
+            print(f"時間軸寫入失敗: {e}")
+
+    def write_heading(self, title, output=None):
+        """串流輸出前先寫出段落標題"""
+        print(f"\n=== {title} ===")
+        if output:
+            output.write(f"\n=== {title} ===\n")
+            output.flush()
+
+    def expand_urls(self, sources):
+        """展開批次輸入：URL 清單檔案、播放清單或單一影片 URL"""
+        urls = []
+        for source in sources:
+            if os.path.isfile(source):
+                with open(source, encoding="utf-8") as f:
+                    lines = [line.strip() for line in f]
+                urls.extend(self.expand_urls([line for line in lines if line and not line.startswith('#')]))
+            elif 'list=' in source or '/playlist' in source or '/@' in source or '/channel/' in source:
+                urls.extend(self.expand_playlist(source))
+            else:
+                urls.append(source)
+
+        # 去除重複的 URL，保留原順序
+        seen = set()
+        unique_urls = []
+        for url in urls:
+            key = self.extract_video_id(url) or url
+            if key not in seen:
+                seen.add(key)
+                unique_urls.append(url)
+        return unique_urls
+
+    def expand_playlist(self, url):
+        """使用 yt_dlp 的 flat extraction 展開播放清單（不解析每部影片）"""
+        print(f"正在展開播放清單: {url}")
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': 'in_playlist',
+        }
+        try:
+            import yt_dlp
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+        except Exception as e:
+            print(f"播放清單展開失敗: {e}")
+            return []
+
+        entries = info.get('entries') or [info]
+        urls = []
+        for entry in entries:
+            if not entry:
+                continue
+            if entry.get('id') and len(entry['id']) == 11:
+                urls.append(f"https://www.youtube.com/watch?v={entry['id']}")
+            elif entry.get('url') or entry.get('webpage_url'):
+                urls.append(entry.get('url') or entry.get('webpage_url'))
+        print(f"播放清單共 {len(urls)} 部影片")
+        return urls
+
+    def fetch_stage(self, url, video_id, trace, job=None, language=None):
+        """下載階段（批次模式與 API 服務共用）
+
+        依序查詢逐字稿快取、檢查點與字幕，都沒有時下載音訊（保存到檢查點）。
+        回傳 (逐字稿, 音訊檔)，其中一個為 None；兩者皆為 None 表示下載失敗
+        """
+        transcript = self.get_cached_transcript(video_id, language)
+        if not transcript:
+            transcript = self.load_checkpoint_transcript(job, language)
+        formats = None
+        if not transcript:
+            with trace.span("字幕", category="download"):
+                transcript, formats = self.get_caption_transcript(url)
+        if transcript:
+            return transcript, None
+        audio_file = job.audio_file() if job is not None else None
+        if not audio_file:
+            with trace.span("下載", category="download"):
+                audio_file = self.download_audio(url, formats=formats)
+            if audio_file and job is not None:
+                audio_file = job.save_audio(audio_file)
+        return None, audio_file
+
+    def transcribe_stage(self, video_id, audio_file, trace, model=None, job=None, language=None):
+        """轉錄階段（批次模式與 API 服務共用）：轉錄並寫入快取與檢查點
+
+        回傳 SegmentStore，失敗時為 None。不在檢查點中的音訊轉錄後即刪除
+        """
+        try:
+            with trace.span("轉錄", category="transcribe"):
+                result = self.transcribe_audio(audio_file, model=model, language=language)
+            if not result:
+                return None
+            self.store_transcript(video_id, result, language)
+            if job is not None:
+                self.save_checkpoint_transcript(job, result, language)
+            return result
+        finally:
+            # 檢查點中的音訊保留到逐字稿保存後
+            if job is None:
+                self.cleanup_temp_files(audio_file)
+
+    def analyze_stage(self, url, video_id, transcript, trace, job=None, language=None, on_start=None):
+        """LLM 階段（批次模式與 API 服務共用）：決定語言、處理與摘要，完成檢查點並寫出輸出檔
+
+        回傳 {'language', 'transcript', 'processed', 'processed_segments', 'summary'}，
+        有 --output-dir 時另含 'outputs'。
+        on_start(逐字稿, 語言): LLM 處理開始前呼叫（API 服務以此送出進度事件）
+        """
+        if not isinstance(transcript, SegmentStore):
+            transcript = SegmentStore.from_result(transcript)
+        language = language or self.detect_language(transcript.text, transcript.language,
+                                                    transcript.language_probs)
+        if on_start:
+            on_start(transcript, language)
+        processed, summary = self.process_and_summarize(transcript, language, trace=trace, job=job)
+        if job is not None and job.stage("summary"):
+            job.finish()
+        result = {
+            'language': language,
+            'transcript': transcript,
+            'processed': processed.text,
+            'processed_segments': segment_records(processed),
+            'summary': summary,
+        }
+        if self.outputs is not None:
+            result['outputs'] = self.outputs.write_video(url, transcript, processed, summary, language, video_id)
+        return result
+
+    def run_batch(self, sources, download_workers=2, transcribe_workers=1,
+                  batch_llm_workers=2, queue_size=4, results_file=None):
+        """批次模式：下載、轉錄、LLM 三個階段以有界佇列串接，各自限制並行數
+
+        Whisper 的 CPU 運算可以與下一部影片的下載、前一部影片的 LLM 等待重疊。
+        results_file: 每完成一部影片即寫入一行 JSON
+        """
+        urls = self.expand_urls(sources)
+        print(f"=== 批次模式：共 {len(urls)} 部影片 ===")
+        print(f"下載 {download_workers} / 轉錄 {transcribe_workers} / LLM {batch_llm_workers} 個工作者")
+        if not urls:
+            return []
+
+        # 每部影片一條時間軸（Chrome trace 中的一個行程）
+        traces = {url: StageTrace(pid=index + 1, name=url) for index, url in enumerate(urls)}
+        self.traces.extend(traces.values())
+
+        transcribe_queue = queue.Queue(maxsize=queue_size)
+        llm_queue = queue.Queue(maxsize=queue_size)
+        results = []
+        results_lock = threading.Lock()
+        batch_start = time.time()
+
+        def record(item, status, error=None):
+            item['status'] = status
+            item['error'] = error
+            item['seconds'] = time.time() - item.pop('started')
+            item.pop('trace', None)
+            item.pop('job', None)
+            if isinstance(item.get('transcript'), SegmentStore):
+                item['transcript'] = item['transcript'].to_dict()
+            with results_lock:
+                results.append(item)
+                done = len(results)
+                if results_file:
+                    with open(results_file, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            print(f"[{done}/{len(urls)}] {item['url']} {status} ({item['seconds']:.1f} 秒)")
+
+        def download_worker(worker_urls):
+            for url in worker_urls:
+                item = {'url': url, 'video_id': self.extract_video_id(url), 'started': time.time(),
+                        'trace': traces[url], 'job': self.open_job(url)}
+                try:
+                    transcript, audio_file = self.fetch_stage(url, item['video_id'], item['trace'], item['job'])
+                    if transcript:
+                        item['transcript'] = transcript
+                        llm_queue.put(item)
+                    elif audio_file:
+                        item['audio_file'] = audio_file
+                        transcribe_queue.put(item)
+                    else:
+                        record(item, "failed", "音訊下載失敗")
+                except Exception as e:
+                    record(item, "failed", f"下載失敗: {e}")
+
+        def transcribe_worker(model):
+            while True:
+                item = transcribe_queue.get()
+                if item is None:
+                    break
+                try:
+                    result = self.transcribe_stage(item['video_id'], item.pop('audio_file'), item['trace'],
+                                                   model=model, job=item['job'])
+                    if not result:
+                        record(item, "failed", "逐字稿提取失敗")
+                        continue
+                    item['transcript'] = result
+                    llm_queue.put(item)
+                except Exception as e:
+                    record(item, "failed", f"轉錄失敗: {e}")
+
+        def llm_worker():
+            while True:
+                item = llm_queue.get()
+                if item is None:
+                    break
+                try:
+                    item.update(self.analyze_stage(item['url'], item['video_id'], item['transcript'],
+                                                   item['trace'], job=item['job']))
+                    record(item, "done")
+                except Exception as e:
+                    record(item, "failed", f"LLM 處理失敗: {e}")
+
+        models = self.create_transcribe_models(transcribe_workers)
+
+        download_threads = [
+            threading.Thread(target=download_worker, args=(urls[i::download_workers],), daemon=True)
+            for i in range(download_workers)
+        ]
+        transcribe_threads = [
+            threading.Thread(target=transcribe_worker, args=(model,), daemon=True) for model in models
+        ]
+        llm_threads = [threading.Thread(target=llm_worker, daemon=True) for _ in range(batch_llm_workers)]
+        for thread in download_threads + transcribe_threads + llm_threads:
+            thread.start()
+
+        # 依序關閉各階段：上游結束後送出結束訊號給下游
+        for thread in download_threads:
+            thread.join()
+        for _ in transcribe_threads:
+            transcribe_queue.put(None)
+        for thread in transcribe_threads:
+            thread.join()
+        for _ in llm_threads:
+            llm_queue.put(None)
+        for thread in llm_threads:
+            thread.join()
+
+        succeeded = sum(1 for item in results if item['status'] == "done")
+        print(f"\n=== 批次完成：成功 {succeeded} / {len(urls)}，總耗時 {time.time() - batch_start:.1f} 秒 ===")
+        for item in results:
+            if item['status'] != "done":
+                print(f"失敗: {item['url']} - {item['error']}")
+        self.write_trace()
+        return results
+
+    def create_transcribe_models(self, count):
+        """每個轉錄工作者的 Whisper 模型
+
+        同一模型不能同時轉錄，每個工作者各自載入一份；
+        使用模型服務時則共用同一個客戶端，由服務排隊處理；
+        分片轉錄時第一個工作者使用分析器的模型（None，不分片時才載入）
+        """
+        models = [None if self.shards > 1 else self.whisper_model]
+        for _ in range(1, count):
+            if self.whisper_server:
+                models.append(self.whisper_model)
+            else:
+                models.append(self.create_whisper_model())
+        return models
+
+    def get_stream_source(self, url, formats=None):
+        """取得最佳音訊格式的直接連結與 HTTP 標頭，供 FFmpeg 串流讀取"""
+        audio_formats, info = formats or self.get_available_formats(url)
+        if not info:
+            return None, None
+        formats = {f.get('format_id'): f for f in info.get('formats', [])}
+        for fmt in audio_formats:
+            source = formats.get(fmt['format_id'])
+            if source and source.get('url'):
+                return source['url'], source.get('http_headers', {})
+        return info.get('url'), info.get('http_headers', {})
+
+    def ffmpeg_pcm_command(self, source, headers=None):
+        """FFmpeg 指令：將檔案或網址解碼為 16 kHz 單聲道 16-bit PCM 並輸出到 stdout"""
+        command = ["ffmpeg", "-nostdin", "-loglevel", "error"]
+        if headers:
+            command += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+        command += ["-i", source, "-vn", "-f", "s16le", "-ac", "1", "-ar", str(self.SAMPLE_RATE), "-"]
+        return command
+
+    def load_audio_array(self, audio_file, memmap_seconds=None):
+        """以 FFmpeg 將下載的容器檔一次解碼為 16 kHz 單聲道 float32 陣列
+
+        取代「先轉成 WAV 檔、Whisper 再解碼一次」的流程。音訊超過
+        memmap_seconds 時改寫入同目錄的暫存檔並以記憶體映射讀取，
+        避免長音訊在記憶體中同時存在多份副本。
+        """
+        memmap_seconds = self.memmap_seconds if memmap_seconds is None else memmap_seconds
+        memmap_samples = int(memmap_seconds * self.SAMPLE_RATE) if memmap_seconds else None
+        block_bytes = self.SAMPLE_RATE * 2 * 10
+
+        process = subprocess.Popen(
+            self.ffmpeg_pcm_command(audio_file), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        blocks = []
+        total = 0
+        spill_path = None
+        spill = None
+        leftover = b""
+        try:
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                data = leftover + data
+                leftover = data[len(data) - len(data) % 2:]
+                block = np.frombuffer(data[:len(data) - len(leftover)], dtype=np.int16)
+                block = block.astype(np.float32) / 32768.0
+                total += len(block)
+
+                if spill is None and memmap_samples and total > memmap_samples:
+                    # 超過門檻：已解碼的部分與之後的區塊都寫入暫存檔
+                    spill_path = os.path.splitext(audio_file)[0] + ".pcm.f32"
+                    spill = open(spill_path, "wb")
+                    for previous in blocks:
+                        previous.tofile(spill)
+                    blocks = []
+                if spill is not None:
+                    block.tofile(spill)
+                else:
+                    blocks.append(block)
+        finally:
+            if spill is not None:
+                spill.close()
+            stderr = process.stderr.read().decode("utf-8", errors="ignore")
+            process.wait()
+
+        if process.returncode != 0:
+            raise RuntimeError(f"FFmpeg 解碼失敗: {stderr.strip()}")
+        if spill_path:
+            return np.memmap(spill_path, dtype=np.float32, mode="c", shape=(total,))
+        return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+    def detect_speech_regions(self, audio, frame_seconds=0.03, margin_db=12.0, floor_db=-50.0,
+                              min_speech=0.25, min_silence=0.5, padding=0.2):
+        """以能量門檻偵測語音區段，回傳 [(起始樣本, 結束樣本)]
+
+        門檻為「背景噪音（能量第 10 百分位）+ margin_db」，且不低於 floor_db。
+        短於 min_silence 的靜音視為同一段，短於 min_speech 的聲音視為雜訊，
+        每段前後各保留 padding 秒。全部以 NumPy 向量運算完成。
+        """
+        frame = int(frame_seconds * self.SAMPLE_RATE)
+        count = len(audio) // frame
+        if count == 0:
+            return []
+        frames = np.asarray(audio[:count * frame], dtype=np.float32).reshape(count, frame)
+        # einsum 直接計算每個音框的平方和，不另外建立平方後的整段副本
+        energy_db = 10 * np.log10(np.einsum('ij,ij->i', frames, frames) / frame + 1e-10)
+        threshold = max(np.percentile(energy_db, 10) + margin_db, floor_db)
+        speech = energy_db > threshold
+
+        edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        if len(starts) == 0:
+            return []
+
+        def merge(starts, ends, max_gap):
+            keep = (starts[1:] - ends[:-1]) > max_gap
+            return (np.concatenate((starts[:1], starts[1:][keep])),
+                    np.concatenate((ends[:-1][keep], ends[-1:])))
+
+        # 合併短暫停頓、去除過短的聲音、加上前後緩衝後再合併重疊的區段
+        starts, ends = merge(starts, ends, int(min_silence / frame_seconds))
+        keep = (ends - starts) >= int(min_speech / frame_seconds)
+        starts, ends = starts[keep], ends[keep]
+        if len(starts) == 0:
+            return []
+        pad = int(padding / frame_seconds)
+        starts = np.maximum(starts - pad, 0)
+        ends = np.minimum(ends + pad, count)
+        starts, ends = merge(starts, ends, 0)
+        return [(int(start) * frame, int(end) * frame) for start, end in zip(starts, ends)]
+
+    def compact_speech(self, audio, regions, gap_seconds=0.3):
+        """將語音區段串接成較短的音訊（區段間保留短暫靜音）
+
+        回傳 (串接後的音訊, 對照表 [(串接後起始秒, 原始起始秒, 長度秒)])
+        """
+        gap = np.zeros(int(gap_seconds * self.SAMPLE_RATE), dtype=np.float32)
+        pieces = []
+        mapping = []
+        position = 0
+        for start, end in regions:
+            if pieces:
+                pieces.append(gap)
+                position += len(gap)
+            pieces.append(np.asarray(audio[start:end], dtype=np.float32))
+            mapping.append((position / self.SAMPLE_RATE, start / self.SAMPLE_RATE,
+                            (end - start) / self.SAMPLE_RATE))
+            position += end - start
+        return np.concatenate(pieces), mapping
+
+    def remap_timestamp(self, seconds, mapping, compact_starts=None):
+        """將串接後音訊的時間換回原始時間軸
+
+        compact_starts: 對照表中各區段的串接後起始秒（重複呼叫時可先算好傳入）
+        """
+        if compact_starts is None:
+            compact_starts = [item[0] for item in mapping]
+        index = max(bisect.bisect_right(compact_starts, seconds) - 1, 0)
+        compact_start, original_start, length = mapping[index]
+        return original_start + min(max(seconds - compact_start, 0.0), length)
+
+    def transcribe_array(self, audio, model=None, **options):
+        """轉錄音訊陣列
+
+        啟用 VAD 時只送入語音區段；長音訊可切成分片以多個行程並行轉錄。
+        時間戳都會換回原始時間軸。
+        """
+        if isinstance(audio, str):
+            return (model or self.whisper_model).transcribe(audio, **options)
+
+        mapping = None
+        skipped = None
+        if self.vad:
+            regions = self.detect_speech_regions(audio)
+            speech_samples = sum(end - start for start, end in regions)
+            skipped = 1 - speech_samples / len(audio) if len(audio) else 0.0
+            print(f"VAD：{len(regions)} 個語音區段，略過 {skipped:.1%} 的音訊")
+            if not regions:
+                return {'text': "", 'language': options.get('language'), 'segments': [], 'vad_skipped': skipped}
+            audio, mapping = self.compact_speech(audio, regions)
+
+        shard_count = self.plan_shard_count(audio, model)
+        language_probs = None
+        if not options.get('language'):
+            # 先檢測一次語言再指定給轉錄，Whisper 不必在轉錄（或每個分片）中再檢測
+            options['language'], language_probs = self.detect_audio_language(audio, model, shard_count > 1)
+        if shard_count > 1:
+            result = self.transcribe_sharded(audio, shard_count, **options)
+        else:
+            result = (model or self.whisper_model).transcribe(audio, **options)
+        if language_probs:
+            result['language_probs'] = language_probs
+
+        if mapping:
+            compact_starts = [item[0] for item in mapping]
+            for seg in result.get("segments", []):
+                seg['start'] = self.remap_timestamp(seg['start'], mapping, compact_starts)
+                seg['end'] = self.remap_timestamp(seg['end'], mapping, compact_starts)
+            result['vad_skipped'] = skipped
+        return result
+
+    def detect_audio_language(self, audio, model=None, sharded=False):
+        """以 Whisper 檢測音訊前 30 秒的語言，回傳 (語言, {語言: 機率})
+
+        sharded: 在分片行程中檢測（主行程不必載入模型）；
+        引擎不支援或檢測失敗時回傳 (None, None)，由轉錄時自行檢測。
+        """
+        head = np.asarray(audio[:30 * self.SAMPLE_RATE], dtype=np.float32)
+        try:
+            if sharded:
+                language, probs = self.get_shard_pool().submit(_detect_shard_language, head).result()
+            else:
+                model = model or self.whisper_model
+                if not hasattr(model, 'detect_language'):
+                    return None, None
+                language, probs = model.detect_language(head)
+        except Exception as e:
+            print(f"Whisper 語言檢測失敗: {e}")
+            return None, None
+        if language:
+            print(f"Whisper 語言檢測: {language}（{probs[language]:.0%}）")
+        return language, probs
+
+    def plan_shard_count(self, audio, model=None):
+        """決定分片數：使用模型服務或音訊太短時不分片"""
+        if self.shards <= 1 or self.whisper_server or isinstance(model, RemoteWhisperModel):
+            return 1
+        duration = len(audio) / self.SAMPLE_RATE
+        return max(1, min(self.shards, int(duration // self.shard_min_seconds)))
+
+    def find_shard_boundaries(self, audio, shard_count, search_seconds=10.0):
+        """在每個等分點前後 search_seconds 內找能量最低的 0.1 秒作為切點"""
+        frame = self.SAMPLE_RATE // 10
+        count = len(audio) // frame
+        frames = np.asarray(audio[:count * frame], dtype=np.float32).reshape(count, frame)
+        energy = np.einsum('ij,ij->i', frames, frames)
+        search = int(search_seconds * 10)
+
+        boundaries = [0]
+        for k in range(1, shard_count):
+            ideal = count * k // shard_count
+            low = max(ideal - search, boundaries[-1] // frame + 1)
+            high = min(ideal + search, count - 1)
+            cut = low + int(np.argmin(energy[low:high])) if high > low else ideal
+            boundaries.append(cut * frame + frame // 2)
+        boundaries.append(len(audio))
+        return boundaries
+
+    def get_shard_pool(self):
+        """取得分片轉錄的行程池（第一次使用時建立，之後重複使用已載入的模型）"""
+        if self._shard_pool is None:
+            print(f"正在啟動 {self.shards} 個轉錄行程（每個 {self.shard_threads} 個執行緒）...")
+            self._shard_pool = ProcessPoolExecutor(
+                max_workers=self.shards,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_shard_worker,
+                initargs=(self.backend, self.whisper_model_name, self.shard_threads),
+            )
+        return self._shard_pool
+
+    def close(self):
+        """關閉分片轉錄的行程池、LLM 連線池與快取資料庫連線"""
+        if self._shard_pool is not None:
+            self._shard_pool.shutdown()
+            self._shard_pool = None
+        if self._llm is not None and hasattr(self._llm, 'close'):
+            self._llm.close()
+        if self.transcript_cache is not None:
+            self.transcript_cache.close()
+        if self.llm_cache is not None and hasattr(self.llm_cache, 'close'):
+            self.llm_cache.close()
+
+    def transcribe_sharded(self, audio, shard_count, **options):
+        """將音訊在靜音處切成分片，以行程池並行轉錄後依時間合併"""
+        boundaries = self.find_shard_boundaries(audio, shard_count)
+        print(f"音訊切成 {shard_count} 個分片並行轉錄")
+
+        temp_dir = tempfile.mkdtemp()
+        npy_path = os.path.join(temp_dir, "audio.npy")
+        try:
+            # 分片透過記憶體映射的 .npy 傳給工作行程，不必序列化整段音訊
+            np.save(npy_path, np.asarray(audio, dtype=np.float32))
+            shard_options = dict(options, verbose=None)
+            pool = self.get_shard_pool()
+            futures = [
+                pool.submit(_transcribe_shard, npy_path, start, end, shard_options)
+                for start, end in zip(boundaries[:-1], boundaries[1:])
+            ]
+            shard_results = [future.result() for future in futures]
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        offsets = [start / self.SAMPLE_RATE for start in boundaries[:-1]]
+        return self.merge_shard_results(shard_results, offsets)
+
+    def merge_shard_results(self, shard_results, offsets, boundary_seconds=2.0):
+        """合併分片結果：加上時間偏移，並去除分片交界處重複的片段"""
+        def normalize(text):
+            return re.sub(r'\W+', '', text).lower()
+
+        segments = []
+        durations = Counter()
+        for shard, (result, offset) in enumerate(zip(shard_results, offsets)):
+            for seg in result['segments']:
+                seg = dict(seg, start=seg['start'] + offset, end=seg['end'] + offset)
+                near_boundary = shard > 0 and segments and seg['start'] < offset + boundary_seconds
+                if near_boundary:
+                    previous = segments[-1]
+                    # 完全落在前一段之內，或與前一段文字相同，視為交界處的重複
+                    if seg['end'] <= previous['end'] + 0.05:
+                        continue
+                    if normalize(seg['text']) and normalize(seg['text']) == normalize(previous['text']):
+                        continue
+                segments.append(seg)
+            if result.get('language'):
+                durations[result['language']] += sum(seg['end'] - seg['start'] for seg in result['segments'])
+
+        language = durations.most_common(1)[0][0] if durations else None
+        return {
+            'text': "".join(seg['text'] for seg in segments).strip(),
+            'language': language,
+            'segments': segments,
+        }
+
+    def stream_audio_windows(self, media_url, headers=None, window_seconds=None):
+        """以 FFmpeg 將音訊解碼為 16 kHz 單聲道 PCM，逐個視窗產出 (起始秒數, float32 陣列)
+
+        視窗在結尾 2 秒內最安靜的位置切開，切點之後的音訊併入下一個視窗，
+        盡量避免把一個字切成兩半。
+        """
+        window_seconds = window_seconds or self.stream_window
+        window_samples = int(window_seconds * self.SAMPLE_RATE)
+        search_samples = min(2 * self.SAMPLE_RATE, window_samples // 2)
+        frame = self.SAMPLE_RATE // 10
+
+        command = self.ffmpeg_pcm_command(media_url, headers)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        pending = np.zeros(0, dtype=np.float32)
+        offset = 0.0
+        try:
+            while True:
+                needed = (window_samples - len(pending)) * 2
+                data = process.stdout.read(needed) if needed > 0 else b""
+                finished = needed > 0 and len(data) < needed
+                samples = np.frombuffer(data[:len(data) - len(data) % 2], dtype=np.int16)
+                pending = np.concatenate([pending, samples.astype(np.float32) / 32768.0])
+
+                if finished:
+                    if len(pending):
+                        yield offset, pending
+                    break
+
+                # 在視窗結尾 2 秒內找能量最低的 0.1 秒作為切點
+                tail = pending[-search_samples:]
+                energy = np.square(tail[:len(tail) // frame * frame]).reshape(-1, frame).mean(axis=1)
+                cut = len(pending) - len(tail) + int(np.argmin(energy)) * frame + frame // 2
+                yield offset, pending[:cut]
+                offset += cut / self.SAMPLE_RATE
+                pending = pending[cut:]
+        finally:
+            process.kill()
+            process.wait()
+
+    def iter_stream_segments(self, url, window_seconds=None, formats=None):
+        """邊下載邊轉錄：每個視窗解碼完成就送入 Whisper，逐段產出片段"""
+        if not shutil.which("ffmpeg"):
+            raise RuntimeError("找不到 FFmpeg，無法使用串流轉錄")
+        media_url, headers = self.get_stream_source(url, formats)
+        if not media_url:
+            raise RuntimeError("找不到可串流的音訊格式")
+
+        options = dict(self.transcribe_options)
+        language_probs = None
+        previous_text = ""
+        for offset, audio in self.stream_audio_windows(media_url, headers, window_seconds):
+            if len(audio) < self.SAMPLE_RATE // 2:
+                continue
+            result = self.transcribe_array(
+                audio,
+                verbose=None,
+                # 以前一個視窗的結尾作為提示，保持上下文連貫
+                initial_prompt=previous_text[-200:] or None,
+                **options
+            )
+            # 第一個視窗偵測到的語言沿用到後續視窗，省去重複偵測
+            if not options.get('language') and result.get('language'):
+                options['language'] = result['language']
+                language_probs = result.get('language_probs')
+            for seg in result.get("segments", []):
+                text = seg['text'].strip()
+                if not text:
+                    continue
+                previous_text += text + " "
+                yield {
+                    'start': offset + seg['start'],
+                    'end': offset + seg['end'],
+                    'text': seg['text'],
+                    'avg_logprob': seg.get('avg_logprob'),
+                    'no_speech_prob': seg.get('no_speech_prob'),
+                    'language': options.get('language'),
+                    'language_probs': language_probs,
+                }
+
+    def transcribe_stream(self, url, window_seconds=None, formats=None):
+        """串流轉錄並即時印出片段，回傳 SegmentStore"""
+        print("正在以串流方式轉錄（邊下載邊轉錄）...")
+        start = time.time()
+        store = SegmentStore()
+        try:
+            for seg in self.iter_stream_segments(url, window_seconds, formats):
+                if not len(store):
+                    print(f"第一個片段耗時 {time.time() - start:.1f} 秒")
+                store.language = seg['language']
+                store.language_probs = seg['language_probs']
+                store.append(seg['start'], seg['end'], seg['text'],
+                             seg.get('avg_logprob'), seg.get('no_speech_prob'))
+                minutes, seconds = divmod(int(seg['start']), 60)
+                print(f"[{minutes:02d}:{seconds:02d}] {seg['text'].strip()}")
+        except Exception as e:
+            print(f"串流轉錄失敗: {e}")
+            if not len(store):
+                return None
+
+        print(f"串流轉錄完成！檢測到的語言: {store.language}（{time.time() - start:.1f} 秒）")
+        print(f"逐字稿長度: {len(store.text)} 個字符")
+        return store
+
     def extract_transcript(self, audio_file):
         """使用 Whisper 提取逐字稿"""
+        result = self.transcribe_audio(audio_file)
+        return result.text if result else None
+
+    def transcribe_audio(self, audio_file, model=None, language=None):
+        """使用 Whisper 轉錄音訊，回傳 SegmentStore（保留每個片段的時間戳與信心分數）
+
+        model: 指定使用的 Whisper 模型（批次模式中每個轉錄工作者各自一份）
+        language: 已知的語言，指定時 Whisper 不再檢測語言
+        """
         print("正在使用 Whisper 提取逐字稿...")
-        
+        with self.metrics.span("extract_transcript", backend=self.backend,
+                               model=self.whisper_model_name) as span:
+            return self.transcribe_file(audio_file, model, span, language)
+
+    def transcribe_file(self, audio_file, model, span, language=None):
+        """transcribe_audio 的實作；音訊秒數、片段數與語言記錄於 span"""
+        audio = None
         try:
             # 檢查檔案是否存在
             if not os.path.exists(audio_file):
                 print(f"音訊檔案不存在: {audio_file}")
+                span.fail("音訊檔案不存在")
                 return None
             
-            # 使用 Whisper 轉錄
-            result = self.whisper_model.transcribe(
-                audio_file,
-                language=None,  # 自動檢測語言
-                task="transcribe",
-                verbose=False
+            # 模型在 transcribe_array 不分片時才載入，分片轉錄由各分片行程載入
+            remote = isinstance(model, RemoteWhisperModel) or (model is None and self.whisper_server)
+            if remote and not self.vad:
+                # 模型服務在同一台機器上，直接傳路徑由服務解碼
+                # （啟用 VAD 時在本行程解碼，只把語音區段送給服務）
+                audio = audio_file
+            else:
+                # 只用 FFmpeg 解碼一次，直接把陣列交給 Whisper
+                audio = self.load_audio_array(audio_file)
+                span.set(audio_seconds=len(audio) / self.SAMPLE_RATE)
+                print(f"音訊長度: {len(audio) / self.SAMPLE_RATE:.1f} 秒")
+
+            # 使用 Whisper 轉錄（language=None 表示自動檢測語言）
+            result = self.transcribe_array(
+                audio,
+                model=model,
+                verbose=False,
+                **self.transcription_options(language)
             )
             
-            transcript = result["text"].strip()
-            detected_language = result.get("language", "unknown")
+            store = SegmentStore.from_result({
+                'text': result["text"],
+                'language': result.get("language", "unknown"),
+                'language_probs': result.get("language_probs"),
+                'segments': result.get("segments", []),
+            })
             
-            print(f"逐字稿提取完成！檢測到的語言: {detected_language}")
-            print(f"逐字稿長度: {len(transcript)} 個字符")
+            if 'audio_seconds' not in span.attrs:
+                span.set(audio_seconds=store.duration)
+            span.set(segments=len(store), language=store.language)
+            print(f"逐字稿提取完成！檢測到的語言: {store.language}")
+            print(f"逐字稿長度: {len(store.text)} 個字符")
             
-            return transcript
+            return store
             
         except Exception as e:
             print(f"逐字稿提取失敗: {e}")
+            span.fail(e)
             return None
+        finally:
+            # 長音訊解碼時寫入的記憶體映射暫存檔，轉錄完成即刪除
+            # （檢查點中的音訊位於快取目錄，不會隨暫存目錄一起清理）
+            if isinstance(audio, np.memmap) and audio.filename:
+                spill_path = audio.filename
+                del audio
+                try:
+                    os.remove(spill_path)
+                except OSError as e:
+                    print(f"無法刪除解碼暫存檔 {spill_path}: {e}")
     
-    def detect_language(self, text):
-        """簡單的語言檢測"""
-        # 檢查是否包含中文字符
-        chinese_chars = re.findall(r'[\u4e00-\u9fff]', text)
-        english_chars = re.findall(r'[a-zA-Z]', text)
-        
-        chinese_ratio = len(chinese_chars) / len(text) if text else 0
-        english_ratio = len(english_chars) / len(text) if text else 0
-        
-        print(f"語言檢測 - 中文比例: {chinese_ratio:.2%}, 英文比例: {english_ratio:.2%}")
-        # 如果英文字符比例較高，認為是英文
-        return english_ratio > chinese_ratio and english_ratio > 0.3
+    def detect_language(self, text, whisper_language=None, language_probs=None):
+        """決定逐字稿語言，回傳語言代碼（zh、en、ja、ko 等，見 language_detect.py）
 
-    def process_transcript_with_llm(self, transcript, is_english):
-        """使用 LLM 處理逐字稿"""
-        if not self.llm:
-            print("LLM 未連接，跳過處理")
-            return transcript
-        
+        依序使用：--language 指定的語言；Whisper 對前 30 秒的語言機率
+        （language_probs，最可能的語言達 LANGUAGE_CONFIDENCE 時直接採用）；
+        最後以文字系統計數判斷（一次掃描、長文只取樣），whisper_language 為
+        Whisper 或字幕提供的語言，與文字系統一致時優先採用。
+        """
+        if self.language:
+            print(f"使用指定的語言: {self.language}")
+            return self.language
+        if language_probs:
+            language = max(language_probs, key=language_probs.get)
+            if language_probs[language] >= self.LANGUAGE_CONFIDENCE:
+                print(f"語言: {language}（Whisper 機率 {language_probs[language]:.0%}）")
+                return language
+        language, counts = detect_script_language(text, whisper_language)
+        total = sum(counts.values())
+        ratios = "，".join(f"{name} {count / total:.0%}" for name, count in counts.items() if count) if total else "無文字"
+        print(f"語言檢測: {language}（{ratios}）")
+        return language
+
+    def estimate_tokens(self, text):
+        """粗估 token 數：中日韓字元約 1 token，其餘約 4 個字元 1 token"""
+        cjk_count = len(self.CJK_PATTERN.sub('', text))
+        return cjk_count + (len(text) - cjk_count + 3) // 4
+
+    def split_sentences(self, text, max_tokens=None):
+        """將文本切成句子；過長的句子再依逗號、空白或字數切開"""
+        max_tokens = max_tokens or self.chunk_tokens
+        units = []
+        for sentence in self.SENTENCE_PATTERN.findall(text):
+            if not sentence.strip():
+                continue
+            if self.estimate_tokens(sentence) <= max_tokens:
+                units.append(sentence)
+                continue
+            # 沒有標點的中文逐字稿常是一整句，改用空白切分
+            for phrase in self.PHRASE_PATTERN.findall(sentence):
+                if self.estimate_tokens(phrase) <= max_tokens:
+                    units.append(phrase)
+                    continue
+                # 仍然過長就依字數硬切（以最保守的每字 1 token 計算）
+                for start in range(0, len(phrase), max_tokens):
+                    units.append(phrase[start:start + max_tokens])
+        return units
+
+    def build_chunks(self, text, max_tokens=None, overlap_tokens=None, store=None):
+        """依 token 預算將逐字稿分段
+
+        回傳 [{'index', 'text', 'context'}]，context 為前一段結尾的句子，
+        讓 LLM 保持上下文連貫，但不會重複輸出。
+        store: text 對應的 SegmentStore，提供時每段另外附上影片中的 'start'/'end' 秒數
+        """
+        max_tokens = max_tokens or self.chunk_tokens
+        overlap_tokens = self.chunk_overlap if overlap_tokens is None else overlap_tokens
+
+        groups = []
+        spans = []
+        current, current_tokens = [], 0
+        position = 0
+        span_start = 0
+        for unit in self.split_sentences(text, max_tokens):
+            unit_tokens = self.estimate_tokens(unit)
+            # 句子依序出現在原文中，記錄每段在原文中的字元範圍
+            offset = text.find(unit, position)
+            if offset < 0:
+                offset = position
+            if current and current_tokens + unit_tokens > max_tokens:
+                groups.append(current)
+                spans.append((span_start, position))
+                current, current_tokens = [], 0
+            if not current:
+                span_start = offset
+            current.append((unit, unit_tokens))
+            current_tokens += unit_tokens
+            position = offset + len(unit)
+        if current:
+            groups.append(current)
+            spans.append((span_start, position))
+
+        chunks = []
+        for index, group in enumerate(groups):
+            context_units = []
+            if index > 0 and overlap_tokens > 0:
+                budget = overlap_tokens
+                for unit, unit_tokens in reversed(groups[index - 1]):
+                    if unit_tokens > budget:
+                        break
+                    context_units.insert(0, unit)
+                    budget -= unit_tokens
+            chunk = {
+                'index': index,
+                'text': ''.join(unit for unit, _ in group).strip(),
+                'context': ''.join(context_units).strip(),
+            }
+            if store is not None:
+                chunk['start'], chunk['end'] = store.time_range(*spans[index])
+            chunks.append(chunk)
+        return chunks
+
+    def llm_params(self):
+        """目前的生成參數（作為快取鍵的一部分）"""
+        names = ("temperature", "top_k", "top_p", "num_ctx", "num_predict",
+                 "repeat_penalty", "seed", "stop", "system", "template")
+        return {name: getattr(self.llm, name, None) for name in names}
+
+    def record_llm_usage(self, span, prompt, response, cached=False):
+        """將一次 LLM 呼叫的估計 token 數與重試次數累加到 span（response 為 None 表示失敗）"""
+        if span is None:
+            return
+        span.add(
+            llm_calls=1,
+            tokens_in=self.estimate_tokens(prompt),
+            tokens_out=self.estimate_tokens(response) if response else 0,
+            cache_hits=1 if cached else 0,
+            retries=0 if cached else getattr(self.llm, 'last_retries', 0),
+            llm_errors=1 if response is None else 0,
+        )
+
+    def invoke_llm(self, prompt, span=None):
+        """呼叫 LLM；相同模型、prompt 與參數的回應會從快取取得
+
+        span: 提供時將 token 數與重試次數記錄於此
+        """
+        key = None
+        if self.llm_cache is not None:
+            key = make_cache_key(self.llm_model_name, prompt, self.llm_params())
+            cached = self.llm_cache.get(key)
+            if cached is not None:
+                self.record_llm_usage(span, prompt, cached, cached=True)
+                return cached
+
+        try:
+            response = self.llm.invoke(prompt)
+        except Exception:
+            self.record_llm_usage(span, prompt, None)
+            raise
+        self.record_llm_usage(span, prompt, response)
+        # 只快取成功的回應，失敗的段落重跑時會重新呼叫
+        if self.llm_cache is not None:
+            self.llm_cache.set(key, response)
+        return response
+
+    def stream_llm_response(self, prompt, on_token, label="LLM", span=None):
+        """以串流方式呼叫 LLM，每段文字產生時交給 on_token，回傳完整回應
+
+        記錄首個 token 延遲（TTFT）與每秒 token 數於 self.llm_stream_stats；
+        快取命中時一次輸出整段回應。span: 提供時將 token 數與重試次數記錄於此
+        """
+        key = None
+        if self.llm_cache is not None:
+            key = make_cache_key(self.llm_model_name, prompt, self.llm_params())
+            cached = self.llm_cache.get(key)
+            if cached is not None:
+                self.record_llm_usage(span, prompt, cached, cached=True)
+                on_token(cached)
+                return cached
+
+        start = time.perf_counter()
+        first = None
+        parts = []
+        # Ollama 串流時每個訊息約為一個 token
+        try:
+            for token in self.llm.stream(prompt):
+                if first is None:
+                    first = time.perf_counter()
+                parts.append(token)
+                on_token(token)
+        except Exception:
+            self.record_llm_usage(span, prompt, None)
+            raise
+        end = time.perf_counter()
+        response = "".join(parts)
+        self.record_llm_usage(span, prompt, response)
+
+        generating = end - first if first is not None else 0.0
+        self.llm_stream_stats.append({
+            'label': label,
+            'ttft': first - start if first is not None else None,
+            'tokens': len(parts),
+            'seconds': end - start,
+            'tokens_per_second': (len(parts) - 1) / generating if generating > 0 else None,
+        })
+        if self.llm_cache is not None:
+            self.llm_cache.set(key, response)
+        return response
+
+    def run_llm_tasks(self, prompts, label="LLM", writer=None, fallbacks=None, span=None, indices=None):
+        """並行送出多個 prompt，依原順序回傳結果（失敗的項目為 None）
+
+        writer: OrderedTokenWriter，提供時以串流方式依序輸出各段的 token；
+        fallbacks: 各段失敗時改為輸出的文字；span: 累計所有呼叫的 token 數與重試次數
+        indices: 各 prompt 的段落編號（只送出部分段落時，writer 與訊息中使用的編號）
+        """
+        results = [None] * len(prompts)
+        if not prompts:
+            return results
+        indices = indices or list(range(len(prompts)))
+        if writer is None and hasattr(self.llm, 'invoke_many'):
+            return self.run_llm_tasks_async(prompts, label, span, indices)
+
+        def invoke(index):
+            start = time.time()
+            if writer is None:
+                response = self.invoke_llm(prompts[index], span)
+                return response.strip(), time.time() - start
+            slot = indices[index]
+            try:
+                response = self.stream_llm_response(
+                    prompts[index], lambda token: writer.write(slot, token), f"{label} 第 {slot + 1} 段", span
+                )
+            finally:
+                writer.finish(slot, fallbacks[index] if fallbacks else None)
+            return response.strip(), time.time() - start
+
+        workers = max(1, min(self.llm_workers, len(prompts)))
+        # 在主執行緒先完成 LLM 連接，避免多個工作者同時連接
+        self.llm
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(invoke, i) for i in range(len(prompts))]
+            for index, future in enumerate(futures):
+                try:
+                    response, elapsed = future.result()
+                    results[index] = response
+                    if len(prompts) > 1 and writer is None:
+                        print(f"{label} 第 {indices[index] + 1} 段完成 ({elapsed:.1f} 秒)")
+                except Exception as e:
+                    print(f"{label} 第 {indices[index] + 1} 段失敗: {e}")
+        return results
+
+    def complete(self, prompt, label="LLM", span=None):
+        """送出單一 prompt；串流輸出啟用時逐 token 寫出"""
+        if self._stream_sinks is None:
+            return self.invoke_llm(prompt, span).strip()
+        writer = OrderedTokenWriter(1, self._stream_sinks)
         try:
-            if is_english:
-                print("正在將英文逐字稿翻譯成中文...")
-                prompt = f"""
-請將以下英文逐字稿翻譯成繁體中文，保持原意和語調：
+            return self.stream_llm_response(prompt, lambda token: writer.write(0, token), label, span).strip()
+        finally:
+            writer.emit("\n")
 
-{transcript}
+    def print_stream_stats(self):
+        """印出每次串流呼叫的首個 token 延遲與生成速度"""
+        if not self.llm_stream_stats:
+            return
+        print("\n=== LLM 串流統計 ===")
+        for stats in self.llm_stream_stats:
+            ttft = f"{stats['ttft']:.2f} 秒" if stats['ttft'] is not None else "-"
+            rate = f"{stats['tokens_per_second']:.1f}" if stats['tokens_per_second'] is not None else "-"
+            print(f"{stats['label']}: 首個 token {ttft}，{stats['tokens']} tokens，"
+                  f"{rate} tokens/秒，共 {stats['seconds']:.1f} 秒")
+
+    def run_llm_tasks_async(self, prompts, label="LLM", span=None, indices=None):
+        """非同步客戶端：快取未命中的 prompt 一次交給事件迴圈並行送出"""
+        indices = indices or list(range(len(prompts)))
+        results = [None] * len(prompts)
+        keys = [None] * len(prompts)
+        pending = []
+        for index, prompt in enumerate(prompts):
+            if self.llm_cache is not None:
+                keys[index] = make_cache_key(self.llm_model_name, prompt, self.llm_params())
+                cached = self.llm_cache.get(keys[index])
+                if cached is not None:
+                    self.record_llm_usage(span, prompt, cached, cached=True)
+                    results[index] = cached.strip()
+                    continue
+            pending.append(index)
+
+        responses = self.llm.invoke_many([prompts[index] for index in pending]) if pending else []
+        if span is not None and pending:
+            # 重試次數為整批的總數
+            span.add(retries=self.llm.last_retries)
+        for index, (response, elapsed) in zip(pending, responses):
+            if span is not None:
+                failed = isinstance(response, Exception)
+                span.add(llm_calls=1, tokens_in=self.estimate_tokens(prompts[index]),
+                         tokens_out=0 if failed else self.estimate_tokens(response),
+                         llm_errors=1 if failed else 0)
+            if isinstance(response, Exception):
+                print(f"{label} 第 {indices[index] + 1} 段失敗: {response}")
+                continue
+            if self.llm_cache is not None:
+                self.llm_cache.set(keys[index], response)
+            results[index] = response.strip()
+            if len(prompts) > 1:
+                print(f"{label} 第 {indices[index] + 1} 段完成 ({elapsed:.1f} 秒)")
+        return results
+
+    def build_process_prompt(self, chunk, language):
+        """建立翻譯或加標點的 prompt（language 為 detect_language 回傳的語言代碼）"""
+        context = ""
+        if chunk.get('context'):
+            context = f"""
+（以下為前文，僅供理解上下文，請勿輸出）
+{chunk['context']}
+
+（以下為需要處理的內容）
+"""
+        if needs_translation(language):
+            return f"""
+請將以下{language_name(language)}逐字稿翻譯成繁體中文，保持原意和語調：
+{context}
+{chunk['text']}
 
 請只回傳翻譯結果，不要其他說明：
 """
-            else:
-                print("正在為中文逐字稿添加標點符號...")
-                prompt = f"""
+        return f"""
 請為以下中文逐字稿添加適當的標點符號和段落分隔，讓文本更容易閱讀：
-
-{transcript}
+{context}
+{chunk['text']}
 
 請只回傳處理後的文本，不要其他說明：
 """
+
+    def load_checkpoint_outputs(self, job, kind, chunks, prompts):
+        """檢查點中各段已完成（且 prompt 相同）的 LLM 輸出，沒有的段落為 None；
+        --no-cache / --no-llm-cache 時不沿用（結果仍寫入檢查點）"""
+        if job is None or self.llm_cache is None:
+            return [None] * len(chunks)
+        return [job.load_output(kind, chunk['index'], self.checkpoint_key(prompt))
+                for chunk, prompt in zip(chunks, prompts)]
+
+    def run_chunk_tasks(self, kind, chunks, prompts, label, writer=None, span=None, job=None, keep_source=True):
+        """送出各段的 prompt，依順序回傳結果
+
+        job: 工作檢查點，已完成的段落直接沿用，新完成的段落立即保存（失敗的不保存，下次重試）
+        keep_source: 失敗的段落保留原文；False 時失敗的段落為 None
+        """
+        texts = self.load_checkpoint_outputs(job, kind, chunks, prompts)
+        pending = [index for index, text in enumerate(texts) if text is None]
+        if writer is not None:
+            for chunk, text in zip(chunks, texts):
+                if text is not None:
+                    writer.write(chunk['index'], text)
+                    writer.finish(chunk['index'])
+        responses = self.run_llm_tasks([prompts[index] for index in pending], label=label, writer=writer,
+                                       fallbacks=[chunks[index]['text'] for index in pending], span=span,
+                                       indices=[chunks[index]['index'] for index in pending])
+        for index, response in zip(pending, responses):
+            if not response:
+                texts[index] = chunks[index]['text'] if keep_source else None
+                continue
+            texts[index] = response
+            if job is not None:
+                job.save_output(kind, chunks[index]['index'], self.checkpoint_key(prompts[index]), response)
+        return texts
+
+    def process_chunks(self, chunks, language, writer=None, span=None, job=None):
+        """翻譯或加標點各段（chunk 由 build_chunks 產生），依順序回傳處理後的文字"""
+        prompts = [self.build_process_prompt(chunk, language) for chunk in chunks]
+        return self.run_chunk_tasks("process", chunks, prompts, "LLM 處理", writer, span, job)
+
+    def build_partial_prompts(self, chunks):
+        """各段的部分摘要 prompt（有起訖時間的段落會標註影片時間）"""
+        return [
+            self.build_summary_prompt(chunk['text'], partial=True,
+                                      time_range=(chunk['start'], chunk['end']) if 'start' in chunk else None)
+            for chunk in chunks
+        ]
+
+    def summarize_chunks(self, chunks, label="分段摘要", span=None, job=None, prompts=None):
+        """各段的部分摘要，依順序回傳（失敗的段落為 None，不以原文代替）"""
+        prompts = prompts or self.build_partial_prompts(chunks)
+        return self.run_chunk_tasks("partial", chunks, prompts, label, span=span, job=job, keep_source=False)
+
+    def truncate_tokens(self, text, max_tokens):
+        """依句子截斷文字，使估計的 token 數不超過 max_tokens"""
+        if self.estimate_tokens(text) <= max_tokens:
+            return text
+        kept, tokens = [], 0
+        for unit in self.split_sentences(text, max_tokens):
+            unit_tokens = self.estimate_tokens(unit)
+            if tokens + unit_tokens > max_tokens:
+                break
+            kept.append(unit)
+            tokens += unit_tokens
+        return "".join(kept).strip()
+
+    def merge_partials(self, chunks, partials, level):
+        """整理一層的部分摘要：失敗的段落捨棄，比原段落還長的部分摘要截斷為原段落長度"""
+        kept = []
+        for chunk, partial in zip(chunks, partials):
+            if not partial:
+                print(f"第 {level} 層摘要 第 {chunk['index'] + 1} 段失敗，略過該段")
+                continue
+            kept.append(self.truncate_tokens(partial, self.estimate_tokens(chunk['text'])))
+        if not kept:
+            raise RuntimeError(f"第 {level} 層摘要全部失敗")
+        return kept
+
+    def fit_partials(self, partials):
+        """將各部分摘要截斷為相同長度，合起來不超過 chunk_tokens；每段剩太少時拋出 RuntimeError"""
+        share = self.chunk_tokens // len(partials) - 1
+        if share < self.MIN_PARTIAL_TOKENS:
+            raise RuntimeError(f"{len(partials)} 段部分摘要無法放進 {self.chunk_tokens} tokens 的最終摘要")
+        return "\n".join(self.truncate_tokens(partial, share) for partial in partials)
+
+    def process_transcript_with_llm(self, transcript, language, job=None):
+        """使用 LLM 處理逐字稿（長逐字稿會分段並行處理）
+
+        transcript 為 SegmentStore 時，回傳的 SegmentStore 每段對應一個處理後的分段，
+        並保留該段在影片中的起訖時間；傳入字串時回傳字串。
+        job: 工作檢查點，上次已完成的段落直接沿用
+        """
+        if not self.llm:
+            print("LLM 未連接，跳過處理")
+            return transcript
+        
+        with self.metrics.span("process_transcript_with_llm", language=language) as span:
+            try:
+                if needs_translation(language):
+                    print(f"正在將{language_name(language)}逐字稿翻譯成中文...")
+                else:
+                    print("正在為中文逐字稿添加標點符號...")
+
+                store = transcript if isinstance(transcript, SegmentStore) else None
+                text = store.text if store is not None else transcript
+                chunks = self.build_chunks(text, store=store)
+                span.set(chunks=len(chunks))
+                if len(chunks) > 1:
+                    print(f"逐字稿分為 {len(chunks)} 段，最多同時處理 {self.llm_workers} 段")
+
+                # 調用 LLM
+                start = time.time()
+                separator = "\n\n" if len(chunks) > 1 else ""
+                if self._stream_sinks is not None:
+                    # 各段並行生成，依順序串流輸出；失敗的段落輸出原文
+                    writer = OrderedTokenWriter(len(chunks), self._stream_sinks, separator)
+                    texts = self.process_chunks(chunks, language, writer, span, job)
+                    writer.emit("\n")
+                else:
+                    texts = self.process_chunks(chunks, language, span=span, job=job)
             
-            # 調用 LLM
-            response = self.llm.invoke(prompt)
-            processed_text = response.strip()
-            
-            print("LLM 處理完成！")
-            return processed_text
+                print(f"LLM 處理完成！({time.time() - start:.1f} 秒)")
+                if store is None:
+                    return separator.join(texts)
+                processed = SegmentStore("zh" if needs_translation(language) else store.language, "llm", separator)
+                for chunk, processed_text in zip(chunks, texts):
+                    processed.append(chunk['start'], chunk['end'], processed_text)
+                return processed
             
-        except Exception as e:
-            print(f"LLM 處理失敗: {e}")
-            return transcript
-    
-    def generate_summary(self, transcript):
-        """生成摘要"""
+            except Exception as e:
+                print(f"LLM 處理失敗: {e}")
+                span.fail(e)
+                return transcript
+
+    def build_summary_prompt(self, text, partial=False, time_range=None):
+        """建立摘要 prompt；partial 為分段摘要或合併中的部分摘要
+
+        time_range: 片段在影片中的 (起, 訖) 秒數，提供時標註於 prompt 中
+        """
+        if partial:
+            heading = ""
+            if time_range:
+                heading = f"（影片 {format_timestamp(time_range[0])} - {format_timestamp(time_range[1])}）\n"
+            return f"""
+請為以下文本片段整理出重點，用繁體中文回應：
+
+{heading}{text}
+
+請以條列式格式回應，每個要點以「•」開頭，只列出最重要的要點：
+"""
+        return f"""
+請為以下文本生成條列式摘要，用繁體中文回應：
+
+{text}
+
+請以條列式格式回應，每個要點以「•」開頭：
+"""
+
+    def generate_summary(self, transcript, mode=None, job=None, partials=None):
+        """生成摘要
+
+        mode: "single" 一次送出全文；"hierarchical" 分段摘要後再合併；
+        None 依 summary_mode 設定，auto 時超過分段上限才使用分層摘要。
+        transcript 可以是字串或 SegmentStore（分層摘要的各段會標註影片時間）。
+        job: 工作檢查點，上次（以相同輸入與 LLM 設定）完成的摘要直接沿用
+        partials: 已完成的第一層部分摘要（依順序）；提供時忽略 transcript，從第二層開始合併
+        """
         if not self.llm:
             print("LLM 未連接，無法生成摘要")
             return "無法生成摘要：LLM 未連接"
+
+        if partials is not None:
+            transcript = "\n".join(partials)
+            mode = "hierarchical"
+        store = transcript if isinstance(transcript, SegmentStore) else None
+        if store is not None:
+            transcript = store.text
         
-        try:
-            print("正在生成摘要...")
-            prompt = f"""
-請為以下文本生成條列式摘要，用繁體中文回應：
+        mode = mode or self.summary_mode
+        if mode == "auto":
+            mode = "hierarchical" if self.estimate_tokens(transcript) > self.chunk_tokens else "single"
 
-{transcript}
+        key = self.checkpoint_key(self.build_summary_prompt(transcript)) if job is not None else None
+        saved = job.load_summary(key) if job is not None and self.llm_cache is not None else None
+        if saved is not None:
+            print("從檢查點讀取摘要")
+            if self._stream_sinks is not None:
+                OrderedTokenWriter(1, self._stream_sinks).emit(saved + "\n")
+            return saved
 
-請以條列式格式回應，每個要點以「•」開頭：
-"""
-            
-            response = self.llm.invoke(prompt)
-            summary = response.strip()
-            
-            print("摘要生成完成！")
-            return summary
-            
-        except Exception as e:
-            print(f"摘要生成失敗: {e}")
-            return "摘要生成失敗"
+        with self.metrics.span("generate_summary", mode=mode) as span:
+            try:
+                print("正在生成摘要...")
+                if mode == "hierarchical":
+                    summary = self.generate_hierarchical_summary(transcript, store=store, span=span,
+                                                                 partials=partials)
+                else:
+                    summary = self.complete(self.build_summary_prompt(transcript), label="摘要", span=span)
+
+                print("摘要生成完成！")
+                if job is not None:
+                    job.save_summary(key, summary)
+                return summary
+
+            except Exception as e:
+                print(f"摘要生成失敗: {e}")
+                span.fail(e)
+                return "摘要生成失敗"
+
+    def generate_hierarchical_summary(self, transcript, max_levels=5, store=None, span=None, partials=None):
+        """分層摘要：各段並行摘要，部分摘要仍超過上限時再遞迴合併
+
+        每個 prompt 的內容都不超過 chunk_tokens，與影片長度無關：失敗的部分摘要直接捨棄，
+        過長的部分摘要會截斷；某一層沒有縮短內容或超過 max_levels 仍超過上限時，
+        將最後一層的各部分摘要平均截斷到上限內，仍放不下則摘要失敗（拋出 RuntimeError）。
+        每層耗時記錄於 self.summary_timings。
+        store: transcript 對應的 SegmentStore，第一層各段會標註影片時間
+        span: 累計所有 LLM 呼叫的 token 數與重試次數
+        partials: 已完成的第一層部分摘要（transcript 為其合併結果），從第二層開始
+        """
+        self.summary_timings = []
+        text = transcript
+        tokens = self.estimate_tokens(text)
+        level = 0
+        kept = [text]
+        if partials is not None:
+            level = 1
+            kept = list(partials)
+        while level < max_levels and tokens > self.chunk_tokens:
+            level += 1
+            start = time.time()
+            chunks = self.build_chunks(text, overlap_tokens=0, store=store if level == 1 else None)
+            prompts = self.build_partial_prompts(chunks)
+            partials = self.summarize_chunks(chunks, f"第 {level} 層摘要", span, prompts=prompts)
+            kept = self.merge_partials(chunks, partials, level)
+            merged = "\n".join(kept)
+            merged_tokens = self.estimate_tokens(merged)
+            elapsed = time.time() - start
+            self.summary_timings.append({
+                'level': level,
+                'prompts': len(prompts),
+                'max_prompt_tokens': max(self.estimate_tokens(p) for p in prompts),
+                'seconds': elapsed,
+            })
+            print(f"第 {level} 層摘要：{len(prompts)} 段 -> {merged_tokens} tokens ({elapsed:.1f} 秒)")
+            shrunk = merged_tokens < tokens
+            text, tokens = merged, merged_tokens
+            if not shrunk:
+                # LLM 沒有縮短內容，再分層也不會收斂
+                print(f"第 {level} 層摘要沒有縮短內容，停止分層")
+                break
+        if span is not None:
+            span.set(levels=level + 1)
+
+        if tokens > self.chunk_tokens:
+            print(f"部分摘要仍超過 {self.chunk_tokens} tokens（{tokens} tokens），各段截斷後再做最終摘要")
+            text = self.fit_partials(kept)
+
+        # 最後一層合併成最終摘要
+        start = time.time()
+        prompt = self.build_summary_prompt(text)
+        summary = self.complete(prompt, label="最終摘要", span=span)
+        elapsed = time.time() - start
+        self.summary_timings.append({
+            'level': level + 1,
+            'prompts': 1,
+            'max_prompt_tokens': self.estimate_tokens(prompt),
+            'seconds': elapsed,
+        })
+        print(f"最終摘要合併完成 ({elapsed:.1f} 秒)")
+        return summary
     
+    def print_outline(self, store, limit=500):
+        """印出逐字稿，每段前標註影片時間；超過 limit 個字元的部分省略"""
+        if not isinstance(store, SegmentStore):
+            print(store[:limit] + "..." if len(store) > limit else store)
+            return
+        printed = 0
+        for seg in store:
+            text = seg.text.strip()
+            if not text:
+                continue
+            if printed >= limit:
+                print("...")
+                break
+            print(f"[{format_timestamp(seg.start)} - {format_timestamp(seg.end)}] {text[:limit - printed]}")
+            printed += len(text)
+
+    def process_and_summarize(self, transcript, language, trace=None, on_summary_start=None, job=None):
+        """以 DAG 排程處理逐字稿與摘要，回傳 (處理後的 SegmentStore, 摘要)
+
+        分層摘要時，第 k 段翻譯（或加標點）完成後立即開始第 k 段的分段摘要，
+        所有分段摘要完成後（即分層摘要的第一層）從第二層開始合併為最終摘要，不必等全部翻譯結束。
+        單次摘要（summary_mode 為 single，或 auto 時逐字稿未超過分段上限）則以
+        process_transcript_with_llm 處理全文後，再以 generate_summary 做一次摘要。
+        trace: 記錄各階段時間的 StageTrace；on_summary_start: 最終摘要開始前呼叫（串流輸出標題用）
+        job: 工作檢查點，每段完成即保存，上次已完成（且 prompt 相同）的段落與摘要直接沿用
+        """
+        if not self.llm:
+            return self.process_transcript_with_llm(transcript, language), self.generate_summary(transcript)
+
+        store = transcript
+        mode = self.summary_mode
+        if mode == "auto":
+            mode = "hierarchical" if self.estimate_tokens(store.text) > self.chunk_tokens else "single"
+        start = time.time()
+        scheduler = StageScheduler(max_workers=max(1, self.llm_workers), trace=trace)
+
+        if mode == "single":
+            def summarize(processed):
+                if on_summary_start:
+                    on_summary_start()
+                return self.generate_summary(processed, mode="single", job=job)
+
+            scheduler.add("處理", self.process_transcript_with_llm, args=(store, language, job), category="process")
+            scheduler.add("摘要", summarize, deps=["處理"], category="summary")
+            results = scheduler.run()
+            processed = results["處理"] or store
+            summary = results["摘要"]
+            if summary is None:
+                print(f"摘要生成失敗: {scheduler.errors.get('摘要')}")
+                summary = "摘要生成失敗"
+            print(f"LLM 處理與摘要完成！({time.time() - start:.1f} 秒)")
+            return processed, summary
+
+        chunks = self.build_chunks(store.text, store=store)
+        separator = "\n\n" if len(chunks) > 1 else ""
+        if needs_translation(language):
+            print(f"正在將{language_name(language)}逐字稿翻譯成中文並生成摘要...")
+        else:
+            print("正在為中文逐字稿添加標點符號並生成摘要...")
+        if len(chunks) > 1:
+            print(f"逐字稿分為 {len(chunks)} 段，最多同時執行 {self.llm_workers} 個 LLM 階段")
+
+        writer = None
+        if self._stream_sinks is not None:
+            writer = OrderedTokenWriter(len(chunks), self._stream_sinks, separator)
+
+        def process(chunk):
+            with self.metrics.span("process_transcript_with_llm", language=language, chunk=chunk['index'] + 1) as span:
+                return self.process_chunks([chunk], language, writer, span, job)[0]
+
+        def partial(chunk, processed_text):
+            with self.metrics.span("generate_summary", mode="partial", chunk=chunk['index'] + 1) as span:
+                text = self.summarize_chunks([dict(chunk, text=processed_text)], span=span, job=job)[0]
+            # 與分層摘要的第一層相同：比原段落還長的部分摘要截斷
+            return self.truncate_tokens(text, self.estimate_tokens(processed_text)) if text else text
+
+        def final(*texts):
+            if writer is not None:
+                writer.emit("\n")
+            if on_summary_start:
+                on_summary_start()
+            # 各段的部分摘要即為第一層，合起來仍超過上限時從第二層繼續合併（失敗的段落略過）
+            texts = [text for text in texts if text]
+            if not texts:
+                raise RuntimeError("分段摘要全部失敗")
+            return self.generate_summary(None, job=job, partials=texts)
+
+        process_names = []
+        partial_names = []
+        for chunk in chunks:
+            number = chunk['index'] + 1
+            process_names.append(scheduler.add(f"處理 第 {number} 段", process, args=(chunk,), category="process"))
+            partial_names.append(scheduler.add(f"分段摘要 第 {number} 段", partial, args=(chunk,),
+                                               deps=[process_names[-1]], category="summary"))
+        scheduler.add("最終摘要", final, deps=partial_names, category="summary")
+        results = scheduler.run()
+
+        processed = SegmentStore("zh" if needs_translation(language) else store.language, "llm", separator)
+        for chunk, name in zip(chunks, process_names):
+            processed.append(chunk['start'], chunk['end'], results[name] or chunk['text'])
+        summary = results["最終摘要"]
+        if summary is None:
+            print(f"摘要生成失敗: {scheduler.errors.get('最終摘要')}")
+            summary = "摘要生成失敗"
+        print(f"LLM 處理與摘要完成！({time.time() - start:.1f} 秒)")
+        return processed, summary
+
     def cleanup_temp_files(self, audio_file):
         """清理暫存檔案"""
         try:
@@ -234,106 +2151,130 @@ class YouTubeTranscriptAnalyzer:
         except Exception as e:
             print(f"清理暫存檔案時出現錯誤: {e}")
 
+    def get_ydl_session(self):
+        """取得目前執行緒共用的 YoutubeDL
+
+        同一個工作者的頁面解析、字幕與每次格式下載都使用同一個 session，
+        共用 cookie 與連線，不必每次嘗試都重新建立。
+        """
+        ydl = getattr(self._ydl_local, 'ydl', None)
+        if ydl is None:
+            import yt_dlp
+            ydl = yt_dlp.YoutubeDL({
+                'quiet': True,
+                'no_warnings': True,
+                'http_headers': {
+                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+                    'Accept': '*/*',
+                    'Accept-Language': 'en-US,en;q=0.9',
+                    'Accept-Encoding': 'gzip, deflate, br',
+                    'Connection': 'keep-alive',
+                },
+            })
+            self._ydl_local.ydl = ydl
+        return ydl
+
+    def extract_info(self, url):
+        """解析影片頁面（網路請求），並記錄每部影片的解析次數"""
+        ydl = self.get_ydl_session()
+        # 使用預設格式選擇，避免沿用上一次下載指定的格式
+        ydl.format_selector = None
+        key = self.extract_video_id(url) or url
+        with self._extraction_lock:
+            self.extraction_counts[key] = self.extraction_counts.get(key, 0) + 1
+        return ydl.extract_info(url, download=False)
+
     def get_available_formats(self, url):
         """獲取可用的音訊格式"""
         print("正在檢查可用的音訊格式...")
-        
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-                'Accept-Encoding': 'gzip,deflate',
-                'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7',
-            }
-        }
-        
+        with self.metrics.span("get_available_formats", video_id=self.extract_video_id(url)) as span:
+            audio_formats, info = self.find_audio_formats(url, span)
+            span.set(formats=len(audio_formats))
+            return audio_formats, info
+
+    def find_audio_formats(self, url, span):
+        """get_available_formats 的實作；失敗時記錄於 span"""
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                formats = info.get('formats', [])
+            info = self.extract_info(url)
+            formats = info.get('formats', [])
+            
+            # 篩選出音訊格式，特別關注 m3u8 格式的純音訊
+            audio_formats = []
+            for f in formats:
+                # 檢查是否為音訊格式
+                format_note = (f.get('format_note') or '').lower()
+                acodec = f.get('acodec', 'none')
+                vcodec = f.get('vcodec', 'none')
+                format_id = f.get('format_id', '')
                 
-                # 篩選出音訊格式，特別關注 m3u8 格式的純音訊
-                audio_formats = []
-                for f in formats:
-                    # 檢查是否為音訊格式
-                    format_note = f.get('format_note', '').lower()
-                    acodec = f.get('acodec', 'none')
-                    vcodec = f.get('vcodec', 'none')
-                    format_id = f.get('format_id', '')
+                # 根據您的輸出，233 和 234 是 audio only 格式
+                if ('audio only' in format_note or 
+                    format_id in ['233', '234'] or
+                    (acodec != 'none' and vcodec == 'none')):
                     
-                    # 根據您的輸出，233 和 234 是 audio only 格式
-                    if ('audio only' in format_note or 
-                        format_id in ['233', '234'] or
-                        (acodec != 'none' and vcodec == 'none')):
-                        
-                        format_info = {
-                            'format_id': format_id,
-                            'ext': f.get('ext', 'mp4'),
-                            'acodec': acodec,
-                            'quality': f.get('quality', 0),
-                            'format_note': format_note,
-                            'protocol': f.get('protocol', ''),
-                            'is_audio_only': True
-                        }
-                        audio_formats.append(format_info)
-                
-                # 優先選擇格式 234 (高品質)，然後是 233 (低品質)
-                audio_formats.sort(key=lambda x: (
-                    x['format_id'] == '234',  # 優先高品質音訊
-                    x['format_id'] == '233',  # 然後是低品質音訊
-                    x.get('quality', 0)
-                ), reverse=True)
-                
-                if audio_formats:
-                    print(f"找到 {len(audio_formats)} 個音訊格式:")
-                    for fmt in audio_formats[:3]:
-                        print(f"  ID: {fmt['format_id']}, 格式: {fmt['ext']}, 說明: {fmt['format_note']}")
-                
-                return audio_formats, info
+                    format_info = {
+                        'format_id': format_id,
+                        'ext': f.get('ext', 'mp4'),
+                        'acodec': acodec,
+                        'quality': f.get('quality', 0),
+                        'format_note': format_note,
+                        'protocol': f.get('protocol', ''),
+                        'is_audio_only': True
+                    }
+                    audio_formats.append(format_info)
+            
+            # 優先選擇格式 234 (高品質)，然後是 233 (低品質)
+            audio_formats.sort(key=lambda x: (
+                x['format_id'] == '234',  # 優先高品質音訊
+                x['format_id'] == '233',  # 然後是低品質音訊
+                x.get('quality', 0)
+            ), reverse=True)
+            
+            if audio_formats:
+                print(f"找到 {len(audio_formats)} 個音訊格式:")
+                for fmt in audio_formats[:3]:
+                    print(f"  ID: {fmt['format_id']}, 格式: {fmt['ext']}, 說明: {fmt['format_note']}")
+            
+            return audio_formats, info
                 
         except Exception as e:
             print(f"獲取格式列表失敗: {e}")
+            span.fail(e)
             return [], {}
 
-    def download_audio_by_format(self, url, format_id):
-        """根據指定格式 ID 下載音訊"""
+    def download_from_info(self, info, format_spec, output_template):
+        """使用已解析的影片資訊下載指定格式，不再重新解析頁面
+
+        下載的容器檔直接交給 load_audio_array 解碼，不再另外轉成 WAV。
+        """
+        ydl = self.get_ydl_session()
+        ydl.params['outtmpl']['default'] = output_template
+        ydl.format_selector = ydl.build_format_selector(format_spec)
+        return ydl.process_ie_result(copy.deepcopy(info), download=True)
+
+    def download_audio_by_format(self, url, format_id, info=None, attempt=1):
+        """根據指定格式 ID 下載音訊
+
+        info: 已解析的影片資訊；未提供時會重新解析
+        attempt: 這是此影片第幾次格式下載嘗試（第二次起每次嘗試記為一次重試）
+        """
         print(f"使用格式 ID {format_id} 下載音訊...")
-        
+        with self.metrics.span("download_audio_by_format", video_id=self.extract_video_id(url),
+                               format_id=format_id, attempt=attempt, retries=1 if attempt > 1 else 0) as span:
+            audio_file = self.download_format(url, format_id, info, span)
+            if audio_file:
+                span.set(bytes=os.path.getsize(audio_file))
+            return audio_file
+
+    def download_format(self, url, format_id, info, span):
+        """download_audio_by_format 的實作；失敗時記錄於 span"""
         temp_dir = tempfile.mkdtemp()
         output_path = os.path.join(temp_dir, "audio.%(ext)s")
         
-        # 針對 m3u8 格式的特殊配置
-        ydl_opts = {
-            'format': format_id,
-            'outtmpl': output_path,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-                'Accept': '*/*',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Sec-Fetch-Dest': 'empty',
-                'Sec-Fetch-Mode': 'cors',
-                'Sec-Fetch-Site': 'same-origin',
-            },
-            'no_warnings': True,
-            'ignoreerrors': False,
-        }
-        
-        # 如果不是 m3u8 格式，添加音訊提取後處理器
-        if format_id not in ['233', '234']:
-            ydl_opts['postprocessors'] = [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'wav',
-                'preferredquality': '192',
-            }]
-        
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+            if not info:
+                info = self.extract_info(url)
+            self.download_from_info(info, format_id, output_path)
             
             # 尋找下載的檔案
             for ext in ['wav', 'mp4', 'm4a', 'webm', 'mp3']:
@@ -353,36 +2294,49 @@ class YouTubeTranscriptAnalyzer:
             
         except Exception as e:
             print(f"格式 {format_id} 下載失敗: {e}")
+            span.fail(e)
+            shutil.rmtree(temp_dir, ignore_errors=True)
             return None
 
-    def download_audio(self, url):
-        """改進的音訊下載方法"""
+    def download_audio(self, url, formats=None):
+        """改進的音訊下載方法
+
+        影片頁面只解析一次，之後每個格式嘗試與備用策略都重用同一份資訊。
+        formats: 已取得的 (audio_formats, info)，提供時不再重新解析影片頁面
+        """
         print("正在下載影片音訊...")
         
         # 1. 獲取可用格式
-        audio_formats, info = self.get_available_formats(url)
+        audio_formats, info = formats or self.get_available_formats(url)
         
-        if info:
-            print(f"影片標題: {info.get('title', '未知')}")
-            print(f"影片長度: {info.get('duration', 0)} 秒")
-        
-        if not audio_formats:
-            print("未找到可用的音訊格式，嘗試備用方法...")
-            return self.download_audio_fallback(url)
-        
-        # 2. 按優先順序嘗試下載音訊格式
-        for fmt in audio_formats:
-            print(f"嘗試下載格式 {fmt['format_id']} ({fmt['format_note']})")
-            result = self.download_audio_by_format(url, fmt['format_id'])
-            if result:
-                return result
-        
-        # 3. 如果音訊格式都失敗，嘗試備用方法
-        print("音訊格式下載失敗，嘗試備用方法...")
-        return self.download_audio_fallback(url)
+        try:
+            if info:
+                print(f"影片標題: {info.get('title', '未知')}")
+                print(f"影片長度: {info.get('duration', 0)} 秒")
+            
+            if not audio_formats:
+                print("未找到可用的音訊格式，嘗試備用方法...")
+                return self.download_audio_fallback(url, info)
+            
+            # 2. 按優先順序嘗試下載音訊格式
+            for attempt, fmt in enumerate(audio_formats, 1):
+                print(f"嘗試下載格式 {fmt['format_id']} ({fmt['format_note']})")
+                result = self.download_audio_by_format(url, fmt['format_id'], info, attempt=attempt)
+                if result:
+                    return result
+            
+            # 3. 如果音訊格式都失敗，嘗試備用方法
+            print("音訊格式下載失敗，嘗試備用方法...")
+            return self.download_audio_fallback(url, info)
+        finally:
+            key = self.extract_video_id(url) or url
+            print(f"此影片共進行 {self.extraction_counts.get(key, 0)} 次網路解析")
 
-    def download_audio_fallback(self, url):
-        """備用下載方法"""
+    def download_audio_fallback(self, url, info=None):
+        """備用下載方法
+
+        info: 已解析的影片資訊；未提供（或先前解析失敗）時重新解析一次
+        """
         print("使用備用下載策略...")
         
         temp_dir = tempfile.mkdtemp()
@@ -403,54 +2357,222 @@ class YouTubeTranscriptAnalyzer:
             }
         ]
         
+        if not info:
+            try:
+                info = self.extract_info(url)
+            except Exception as e:
+                print(f"影片解析失敗: {e}")
+                print("所有下載方法都失敗了")
+                return None
+        
         for i, strategy in enumerate(fallback_strategies):
             print(f"備用策略 {i+1}: {strategy['description']}")
             
-            ydl_opts = {
-                'format': strategy['format'],
-                'outtmpl': os.path.join(temp_dir, f"backup_{i}.%(ext)s"),
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'wav',
-                    'preferredquality': '128',
-                }],
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
-                },
-                'no_warnings': True,
-                'ignoreerrors': True,
-            }
-            
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
+            with self.metrics.span("download_audio_fallback", video_id=self.extract_video_id(url),
+                                   format_id=strategy['format'], attempt=i + 1, retries=1 if i > 0 else 0) as span:
+                try:
+                    self.download_from_info(
+                        info, strategy['format'], os.path.join(temp_dir, f"backup_{i}.%(ext)s")
+                    )
                 
-                # 檢查下載結果
-                for ext in ['wav', 'mp4', 'm4a', 'webm', 'mp3']:
-                    audio_file = os.path.join(temp_dir, f"backup_{i}.{ext}")
-                    if os.path.exists(audio_file):
-                        print(f"備用方法成功！檔案: {audio_file}")
-                        return audio_file
+                    # 檢查下載結果
+                    for ext in ['wav', 'mp4', 'm4a', 'webm', 'mp3']:
+                        audio_file = os.path.join(temp_dir, f"backup_{i}.{ext}")
+                        if os.path.exists(audio_file):
+                            print(f"備用方法成功！檔案: {audio_file}")
+                            span.set(bytes=os.path.getsize(audio_file))
+                            return audio_file
                 
-                # 檢查所有檔案
-                for file in os.listdir(temp_dir):
-                    if file.startswith(f'backup_{i}') and not file.endswith('.part'):
-                        audio_file = os.path.join(temp_dir, file)
-                        print(f"備用方法找到檔案: {audio_file}")
-                        return audio_file
+                    # 檢查所有檔案
+                    for file in os.listdir(temp_dir):
+                        if file.startswith(f'backup_{i}') and not file.endswith('.part'):
+                            audio_file = os.path.join(temp_dir, file)
+                            print(f"備用方法找到檔案: {audio_file}")
+                            span.set(bytes=os.path.getsize(audio_file))
+                            return audio_file
                         
-            except Exception as e:
-                print(f"備用策略 {i+1} 失敗: {e}")
-                continue
-        
+                    span.fail("找不到下載的檔案")
+
+                except Exception as e:
+                    print(f"備用策略 {i+1} 失敗: {e}")
+                    span.fail(e)
+                    continue
+
         print("所有下載方法都失敗了")
         return None
 
 
+def build_parser(description="YouTube 逐字稿分析器"):
+    """分析器的命令列參數（api_server.py 也共用）"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--download-workers", type=int, default=2,
+                        help="批次模式的下載工作者數（預設 2）")
+    parser.add_argument("--transcribe-workers", type=int, default=1,
+                        help="批次模式的轉錄工作者數，每個各載入一份 Whisper 模型（預設 1）")
+    parser.add_argument("--batch-llm-workers", type=int, default=2,
+                        help="批次模式同時進行 LLM 處理的影片數（預設 2）")
+    parser.add_argument("--queue-size", type=int, default=4,
+                        help="批次模式各階段之間的佇列長度（預設 4）")
+    parser.add_argument("--results", default=None,
+                        help="批次模式結果輸出檔（JSON Lines）")
+    parser.add_argument("--chunk-tokens", type=int, default=1500,
+                        help="每段送給 LLM 的 token 上限（預設 1500）")
+    parser.add_argument("--chunk-overlap", type=int, default=100,
+                        help="每段附帶的前文 token 數（預設 100）")
+    parser.add_argument("--llm-workers", type=int, default=4,
+                        help="同時送出的 LLM 請求數（預設 4）")
+    parser.add_argument("--summary-mode", choices=["auto", "single", "hierarchical"],
+                        default="auto",
+                        help="摘要模式：auto 依長度自動選擇、single 一次摘要、hierarchical 分層摘要")
+    parser.add_argument("--model", default="base",
+                        help="Whisper 模型名稱（預設 base）")
+    parser.add_argument("--language", default=None,
+                        help="指定逐字稿語言（如 en、zh、ja），跳過 Whisper 與文字的語言檢測")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="openai-whisper",
+                        help="轉錄引擎（預設 openai-whisper；faster-whisper 需另外安裝）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不使用逐字稿快取")
+    parser.add_argument("--cache-dir", default=None,
+                        help="逐字稿快取目錄（預設 ~/.cache/youtube_transcript_analyzer）")
+    parser.add_argument("--cache-max-mb", type=float, default=500,
+                        help="逐字稿快取大小上限（MB，預設 500）")
+    parser.add_argument("--whisper-server", default=os.environ.get("WHISPER_SERVER"),
+                        help="Whisper 模型服務位址（見 whisper_server.py），設定後不在本行程載入模型")
+    parser.add_argument("--ollama-url", default=None,
+                        help="Ollama 服務位址（預設讀取 OLLAMA_HOST 或 http://localhost:11434）")
+    parser.add_argument("--warmup", action="store_true",
+                        help="啟動時就載入 Whisper 並連接 LLM（預設第一次使用時才載入）")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="結束時印出啟動時間分析")
+    parser.add_argument("--stream", action="store_true",
+                        help="邊下載邊轉錄，逐段印出逐字稿")
+    parser.add_argument("--stream-window", type=float, default=30,
+                        help="串流轉錄每個視窗的秒數（預設 30）")
+    parser.add_argument("--memmap-seconds", type=float, default=1800,
+                        help="解碼後音訊超過此秒數時改用記憶體映射檔（預設 1800，0 表示停用）")
+    parser.add_argument("--vad", action="store_true",
+                        help="轉錄前偵測語音區段，略過靜音與長段空白（時間戳會換回原始時間軸）")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="長音訊切成 N 個分片以多個行程並行轉錄（預設 1，不分片；不能與 --whisper-server 同時使用）")
+    parser.add_argument("--shard-threads", type=int, default=None,
+                        help="每個分片行程的 torch 執行緒數（預設 CPU 核心數 / 分片數）")
+    parser.add_argument("--captions", choices=["off", "manual", "auto"], default="off",
+                        help="字幕優先模式：manual 使用人工字幕、auto 也接受自動字幕，無可用字幕時才使用 Whisper")
+    parser.add_argument("--caption-min-coverage", type=float, default=0.5,
+                        help="字幕涵蓋影片長度的最低比例（預設 0.5）")
+    parser.add_argument("--llm-model", default="gemma:7b",
+                        help="Ollama 模型名稱（預設 gemma:7b）")
+    parser.add_argument("--llm-client", choices=["langchain", "async"], default="langchain",
+                        help="LLM 客戶端：langchain（預設）或 async（非同步、共用連線池，見 ollama_client.py）")
+    parser.add_argument("--llm-timeout", type=float, default=300,
+                        help="非同步客戶端每個請求的逾時秒數（預設 300）")
+    parser.add_argument("--llm-retries", type=int, default=3,
+                        help="非同步客戶端暫時性錯誤的重試次數（預設 3）")
+    parser.add_argument("--stream-llm", action="store_true",
+                        help="翻譯與摘要以串流方式即時輸出，並統計首個 token 延遲與 tokens/秒（單一影片模式）")
+    parser.add_argument("--output-file", default=None,
+                        help="將處理後的逐字稿與摘要寫入檔案（串流模式下逐 token 寫入）")
+    parser.add_argument("--output-dir", default=None,
+                        help="將每部影片的字幕（SRT/WebVTT，原始與處理後）、Markdown 與 results.jsonl 寫入此目錄")
+    parser.add_argument("--output-formats", default=",".join(OUTPUT_FORMATS),
+                        help=f"--output-dir 輸出的格式，以逗號分隔（預設 {','.join(OUTPUT_FORMATS)}）")
+    parser.add_argument("--trace", default=None,
+                        help="將每部影片各階段的開始/結束時間寫成 Chrome trace JSON 檔")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="在此連接埠提供 Prometheus 格式的計量（/metrics）與最近的階段記錄（/spans）")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="計量服務的監聽位址（預設 127.0.0.1）")
+    parser.add_argument("--metrics-log", default=None,
+                        help="每個階段結束時寫入一行 JSON 記錄的檔案（- 表示 stderr）")
+    parser.add_argument("--no-llm-cache", action="store_true",
+                        help="不快取 LLM 回應")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="不保存工作檢查點（預設每部影片保存音訊、逐字稿與各段結果，中斷後可續跑）")
+    parser.add_argument("--job-dir", default=None,
+                        help="工作檢查點目錄（預設為快取目錄下的 jobs，可用 job_store.py 管理）")
+    return parser
+
+
+def check_args(parser, args):
+    """檢查無法同時使用的選項，有衝突時以 parser.error 結束"""
+    if args.whisper_server and args.shards > 1:
+        parser.error("--shards 需要在本行程載入模型，不能與 --whisper-server 同時使用"
+                     "（模型服務會自行排隊轉錄）")
+    return args
+
+
+def parse_args(argv=None):
+    """解析命令列參數"""
+    parser = build_parser()
+    parser.add_argument("sources", nargs="*",
+                        help="批次模式：影片 URL、播放清單 URL 或 URL 清單檔案（未提供時互動輸入）")
+    return check_args(parser, parser.parse_args(argv))
+
+
+def build_analyzer(args):
+    """依命令列參數建立分析器（含計量記錄與計量服務）"""
+    metrics = Metrics(sinks=[JsonLogSink(args.metrics_log)] if args.metrics_log else None)
+    if args.metrics_port is not None:
+        server = start_metrics_server(metrics, args.metrics_host, args.metrics_port)
+        print(f"計量服務: http://{args.metrics_host}:{server.server_port}/metrics")
+    return YouTubeTranscriptAnalyzer(
+        chunk_tokens=args.chunk_tokens,
+        chunk_overlap=args.chunk_overlap,
+        llm_workers=args.llm_workers,
+        summary_mode=args.summary_mode,
+        whisper_model_name=args.model,
+        backend=args.backend,
+        language=args.language,
+        resume=not args.no_resume,
+        job_dir=args.job_dir,
+        use_cache=not args.no_cache,
+        cache_dir=args.cache_dir,
+        cache_max_bytes=int(args.cache_max_mb * 1024 * 1024),
+        llm_model_name=args.llm_model,
+        llm_cache=False if args.no_llm_cache else None,
+        whisper_server=args.whisper_server,
+        llm_base_url=args.ollama_url,
+        llm_client=args.llm_client,
+        llm_timeout=args.llm_timeout,
+        llm_retries=args.llm_retries,
+        stream_llm=args.stream_llm,
+        output_file=args.output_file,
+        output_dir=args.output_dir,
+        output_formats=[fmt.strip() for fmt in args.output_formats.split(",") if fmt.strip()],
+        trace_file=args.trace,
+        metrics=metrics,
+        warmup=args.warmup,
+        streaming=args.stream,
+        stream_window=args.stream_window,
+        caption_mode=args.captions,
+        caption_min_coverage=args.caption_min_coverage,
+        memmap_seconds=args.memmap_seconds,
+        vad=args.vad,
+        shards=args.shards,
+        shard_threads=args.shard_threads,
+    )
+
+
 def main():
     """主函數"""
-    analyzer = YouTubeTranscriptAnalyzer()
-    analyzer.run()
+    args = parse_args()
+    analyzer = build_analyzer(args)
+    try:
+        if args.sources:
+            analyzer.run_batch(
+                args.sources,
+                download_workers=args.download_workers,
+                transcribe_workers=args.transcribe_workers,
+                batch_llm_workers=args.batch_llm_workers,
+                queue_size=args.queue_size,
+                results_file=args.results,
+            )
+        else:
+            analyzer.run()
+    finally:
+        analyzer.close()
+    if args.startup_report:
+        analyzer.print_startup_report()
 
 if __name__ == "__main__":
     main()